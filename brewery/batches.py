@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Columnar batches of rows passed through pipes between nodes that process whole columns.
+
+A :class:`RecordBatch` keeps values of each field in a separate column and an optional
+selection vector - list of indexes of rows that are part of the batch. Filters only change the
+selection, columns are shared by the filtered batch. Nodes declare which data they read with
+:attr:`brewery.nodes.Node.input_format`, pipes convert between rows and batches only where a
+node producing rows is connected to a node reading batches or vice versa."""
+
+import itertools
+from brewery.metadata import FieldList
+from brewery.utils import MissingPackage
+
+try:
+    import numpy
+except ImportError:
+    numpy = MissingPackage("numpy", "Vectorized expressions", "http://numpy.scipy.org/")
+
+__all__ = (
+    "RecordBatch",
+)
+
+# Kinds of numpy arrays evaluated with the same result as python numbers: signed and unsigned
+# integers and floats. Booleans are not included, as numpy arithmetic on them is logical.
+_NUMERIC_KINDS = "iuf"
+
+_INTEGER_TYPES = frozenset([int, long])
+_FLOAT_TYPES = frozenset([float])
+
+def _is_array(values):
+    return not isinstance(numpy, MissingPackage) and isinstance(values, numpy.ndarray)
+
+def _same_number_type(values):
+    """Return ``True`` if `values` are all integers or all floats. Numpy converts integers mixed
+    with floats to floats, which changes results of integer arithmetic."""
+    types = frozenset(itertools.imap(type, values))
+    return types <= _INTEGER_TYPES or types == _FLOAT_TYPES
+
+class RecordBatch(object):
+    """Batch of rows stored by columns.
+
+    :Attributes:
+        * `fields`: :class:`brewery.metadata.FieldList` of the batch
+        * `columns`: list of column value sequences (lists, tuples or arrays), one for each
+          field, all of the same length
+        * `selection`: list of indexes of rows in the columns that are part of the batch, in
+          order, or ``None`` if all rows are selected
+        * `row_objects`: list of rows with the values of the columns, such as the rows the batch
+          was created from, or ``None``. Batches created by :meth:`select` share them.
+
+    Iterating a batch yields its selected rows as tuples, or the selected `row_objects` if the
+    batch has them, so that rows passed through batches stay as they were put into a pipe. Values of numpy array columns are
+    converted to python values when they are read with :meth:`column` or as rows, the arrays are
+    used as they are by :meth:`numeric_array`. Columns should not be modified, as they
+    might be shared by several batches. Create new batches with :meth:`select`,
+    :meth:`replace_columns` or :meth:`add_column` instead.
+    """
+
+    def __init__(self, fields, columns, selection=None, length=None, row_objects=None):
+        """Creates a record batch. `length` is number of rows in the columns, it is required only
+        for batches without fields."""
+        self.fields = fields
+        self.columns = list(columns)
+        self.selection = selection
+        self.row_objects = row_objects
+        # Numpy arrays of whole columns by column index, None for non-numeric columns
+        self._arrays = {}
+
+        if length is None:
+            length = len(self.columns[0]) if self.columns else 0
+        self._length = length
+
+    @classmethod
+    def from_rows(cls, fields, rows, keep_rows=False):
+        """Create a batch from list of `rows` with `fields`. If `keep_rows` is ``True``, the rows
+        are kept as `row_objects` of the batch."""
+        if rows:
+            columns = zip(*rows)
+        else:
+            columns = [()] * len(fields)
+        return cls(fields, columns, length=len(rows), row_objects=rows if keep_rows else None)
+
+    def __len__(self):
+        """Return number of selected rows."""
+        if self.selection is not None:
+            return len(self.selection)
+        return self._length
+
+    def __iter__(self):
+        if self.row_objects is not None:
+            return iter(self.rows())
+        return itertools.izip(*self.selected_columns())
+
+    def rows(self):
+        """Return list of selected rows as tuples or selected `row_objects`."""
+        if self.row_objects is None:
+            return zip(*self.selected_columns())
+        elif self.selection is None:
+            return self.row_objects
+        return [self.row_objects[i] for i in self.selection]
+
+    def _column_index(self, field):
+        if isinstance(field, (int, long)):
+            return field
+        return self.fields.index(field)
+
+    def _selected_values(self, index):
+        """Return selected values of column `index`, numpy arrays are kept."""
+        values = self.columns[index]
+        if self.selection is None:
+            return values
+        elif _is_array(values):
+            return values[self.selection]
+        return [values[i] for i in self.selection]
+
+    def column(self, field):
+        """Return selected values of `field` - field name, :class:`Field` or column index - as
+        python values."""
+        values = self._selected_values(self._column_index(field))
+        if _is_array(values):
+            return values.tolist()
+        return values
+
+    def numeric_array(self, field):
+        """Return selected values of `field` as a numpy array or ``None`` if the column contains
+        values other than integers and floats, such as ``None``, strings or booleans, or
+        integers mixed with floats. Columns are converted once and the arrays are shared by
+        batches created by :meth:`select`. Requires numpy."""
+        index = self._column_index(field)
+        try:
+            array = self._arrays[index]
+        except KeyError:
+            column = self.columns[index]
+            array = numpy.asarray(column)
+            if array.dtype.kind not in _NUMERIC_KINDS \
+                    or not _is_array(column) and not _same_number_type(column):
+                array = None
+            self._arrays[index] = array
+
+        if array is None or self.selection is None:
+            return array
+        return array[self.selection]
+
+    def selected_columns(self):
+        """Return list of columns with selected values only, as python values."""
+        if self.selection is None and not any(_is_array(column) for column in self.columns):
+            return self.columns
+        return [self.column(index) for index in range(len(self.columns))]
+
+    def select(self, indexes):
+        """Return new batch with rows at positions `indexes` (relative to the selected rows of
+        this batch). The columns are shared."""
+        if self.selection is not None:
+            indexes = [self.selection[index] for index in indexes]
+        batch = RecordBatch(self.fields, self.columns, indexes, self._length, self.row_objects)
+        batch._arrays = self._arrays
+        return batch
+
+    def filter(self, flags):
+        """Return new batch with selected rows for which the corresponding item of `flags` is
+        true. `flags` might be a numpy array. Returns the batch itself if all rows are
+        selected."""
+        if hasattr(flags, "nonzero"):
+            # numpy array
+            indexes = flags.nonzero()[0].tolist()
+        else:
+            indexes = [index for (index, flag) in enumerate(flags) if flag]
+
+        if len(indexes) == len(self):
+            return self
+        return self.select(indexes)
+
+    def compact(self):
+        """Return batch with selected values only and no selection. Returns the batch itself if
+        all rows are selected."""
+        if self.selection is None:
+            return self
+        columns = [self._selected_values(index) for index in range(len(self.columns))]
+        return RecordBatch(self.fields, columns, length=len(self.selection))
+
+    def replace_columns(self, columns):
+        """Return new batch with columns replaced by dictionary `columns` from column index to
+        values. Values are selected values, the returned batch has no selection."""
+        batch = self.compact()
+        new_columns = list(batch.columns)
+        for (index, values) in columns.items():
+            new_columns[index] = values
+        return RecordBatch(self.fields, new_columns, length=len(batch))
+
+    def add_column(self, field, values):
+        """Return new batch with new column `values` of `field` appended. Values are values of
+        selected rows, the returned batch has no selection."""
+        batch = self.compact()
+        fields = FieldList(list(self.fields) + [field])
+        return RecordBatch(fields, batch.columns + [values], length=len(batch))
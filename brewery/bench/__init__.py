@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks of brewery nodes and streams. Run them with ``brewery bench``."""
+
+from base import *
+from nodes import *
+from scenarios import *
+
+__all__ = []
+__all__ += base.__all__
+__all__ += nodes.__all__
+__all__ += scenarios.__all__
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark harness: running benchmarks, measuring throughput and memory, storing and comparing
+baselines."""
+
+import json
+import random
+import resource
+import multiprocessing
+import Queue
+import timeit
+import brewery.metadata
+
+__all__ = (
+    "Benchmark",
+    "BenchmarkSuite",
+    "default_settings",
+    "synthetic_fields",
+    "synthetic_rows",
+    "run_benchmark",
+    "load_baseline",
+    "save_baseline",
+    "compare_results"
+)
+
+"""Default settings of synthetic data used by benchmarks"""
+default_settings = {
+    "rows": 50000,
+    "width": 10,
+    "cardinality": 100,
+    "seed": 0
+}
+
+# Memory differences smaller than this are considered noise when comparing with a baseline
+_memory_noise = 1024 * 1024
+
+def _complete_settings(settings):
+    """Return copy of default settings updated with `settings`."""
+    complete = dict(default_settings)
+    complete.update(settings or {})
+    return complete
+
+def synthetic_fields(width):
+    """Return field list of synthetic rows with `width` fields. First four fields are always
+    ``id`` (integer), ``category`` (string), ``amount`` (float) and ``text`` (string), rest of the
+    fields alternate between integer and string fields."""
+
+    fields = brewery.metadata.FieldList([("id", "integer"),
+                                         ("category", "string"),
+                                         ("amount", "float"),
+                                         ("text", "string")])
+
+    for i in range(len(fields), width):
+        if i % 2:
+            fields.append(("field_%d" % i, "string"))
+        else:
+            fields.append(("field_%d" % i, "integer"))
+
+    return fields
+
+def synthetic_rows(settings, as_strings=False):
+    """Return list of synthetic rows according to `settings`: number of ``rows``, ``width`` of
+    a row, ``cardinality`` of categorical fields and random ``seed``. If `as_strings` is ``True``
+    then all values are strings, as if they were read from a CSV file. Settings that are not
+    specified are taken from `default_settings`."""
+
+    settings = _complete_settings(settings)
+    rng = random.Random(settings["seed"])
+    fields = synthetic_fields(settings["width"])
+    cardinality = settings["cardinality"]
+
+    categories = [u"category %d" % i for i in range(cardinality)]
+    words = [u" word %d " % i for i in range(cardinality)]
+    types = [field.storage_type for field in fields][4:]
+
+    rows = []
+    for i in xrange(settings["rows"]):
+        row = [i,
+               rng.choice(categories),
+               rng.random() * 1000,
+               rng.choice(words)]
+        for storage_type in types:
+            if storage_type == "integer":
+                row.append(rng.randint(0, cardinality))
+            else:
+                row.append(rng.choice(categories))
+        if as_strings:
+            row = [unicode(value) for value in row]
+        rows.append(row)
+
+    return rows
+
+class Benchmark(object):
+    """A named benchmark."""
+    def __init__(self, name, setup, description=None):
+        """Creates a benchmark.
+
+        :Parameters:
+            * `name` - benchmark name
+            * `setup` - callable that gets benchmark settings and returns a tuple (`function`,
+              `count`) where `function` is the measured callable without arguments and `count`
+              is number of rows it processes. Preparation of data is done in the `setup` and is not
+              measured. Optional third element of the tuple is a callable that is called after
+              the measurement to clean up (for example to remove generated files). If `function`
+              returns a dictionary, it is included in the results as additional metrics.
+            * `description` - human readable description
+        """
+        super(Benchmark, self).__init__()
+        self.name = name
+        self.setup = setup
+        self.description = description
+
+class BenchmarkSuite(object):
+    """Ordered collection of benchmarks."""
+    def __init__(self, name, benchmarks=None):
+        super(BenchmarkSuite, self).__init__()
+        self.name = name
+        self.benchmarks = []
+        for benchmark in benchmarks or []:
+            self.add(benchmark)
+
+    def add(self, benchmark):
+        self.benchmarks.append(benchmark)
+
+    def benchmark(self, name):
+        for benchmark in self.benchmarks:
+            if benchmark.name == name:
+                return benchmark
+        raise KeyError("No benchmark with name '%s' in suite '%s'" % (name, self.name))
+
+    def names(self):
+        return [benchmark.name for benchmark in self.benchmarks]
+
+    def run(self, settings=None, names=None, repeat=3, isolate=True):
+        """Run benchmarks with `names` (all if not specified) and return dictionary of
+        results, keys are benchmark names. See :func:`run_benchmark` for more information."""
+
+        names = names or self.names()
+        results = {}
+        for name in names:
+            benchmark = self.benchmark(name)
+            results[name] = run_benchmark(benchmark, settings, repeat, isolate)
+        return results
+
+def _max_rss():
+    """Return peak resident set size of current process in bytes."""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _measure(benchmark, settings, repeat):
+    best = None
+    count = 0
+    memory = 0
+    metrics = {}
+
+    for i in range(repeat):
+        setup = benchmark.setup(settings)
+        (function, count) = setup[:2]
+        cleanup = setup[2] if len(setup) > 2 else None
+
+        rss = _max_rss()
+        try:
+            start = timeit.default_timer()
+            extra = function()
+            seconds = timeit.default_timer() - start
+        finally:
+            if cleanup:
+                cleanup()
+
+        # Peak can be measured only for the first run, the following runs reuse memory
+        if i == 0:
+            memory = _max_rss() - rss
+
+        if best is None or seconds < best:
+            best = seconds
+            metrics = extra or {}
+
+    result = {
+        "rows": count,
+        "seconds": best,
+        "rows_per_second": count / best if best else None,
+        "peak_memory": memory
+    }
+    result.update(metrics)
+
+    return result
+
+# Seconds between checks whether the benchmark process is still running
+_POLL_INTERVAL = 0.5
+
+def _measure_in_child(benchmark, settings, repeat, queue):
+    try:
+        result = _measure(benchmark, settings, repeat)
+    except Exception as e:
+        result = {"error": "%s: %s" % (e.__class__.__name__, e)}
+    queue.put(result)
+
+def run_benchmark(benchmark, settings=None, repeat=3, isolate=True):
+    """Run a `benchmark` `repeat` times and return dictionary with keys: ``rows`` - number of
+    processed rows, ``seconds`` - best time, ``rows_per_second`` and ``peak_memory`` - growth of
+    peak resident memory in bytes during the first run.
+
+    If `isolate` is ``True`` (default), benchmark is run in a separate process, so memory
+    allocated by other benchmarks does not affect the measurement. Without isolation the peak
+    memory is reported only if the benchmark exceeds the peak the process already had. If the
+    separate process dies without a result, such as when it is killed, an exception is raised.
+    """
+
+    run_settings = _complete_settings(settings)
+
+    if not isolate:
+        return _measure(benchmark, run_settings, repeat)
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure_in_child,
+                                      args=(benchmark, run_settings, repeat, queue))
+    process.start()
+
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=_POLL_INTERVAL)
+        except Queue.Empty:
+            if process.is_alive():
+                continue
+            # The result might be posted just before the process exited
+            try:
+                result = queue.get(timeout=_POLL_INTERVAL)
+            except Queue.Empty:
+                process.join()
+                result = {"error": "process exited with code %s without result"
+                                   % process.exitcode}
+    process.join()
+
+    if "error" in result:
+        raise Exception("Benchmark '%s' failed: %s" % (benchmark.name, result["error"]))
+
+    return result
+
+def load_baseline(path):
+    """Load benchmark baseline from a JSON file. Returns a dictionary with keys ``settings`` and
+    ``results``."""
+    with open(path) as handle:
+        return json.load(handle)
+
+def save_baseline(path, results, settings=None):
+    """Save benchmark `results` with `settings` as a baseline JSON file."""
+    run_settings = _complete_settings(settings)
+
+    baseline = {"settings": run_settings, "results": results}
+    with open(path, "w") as handle:
+        json.dump(baseline, handle, indent=4, sort_keys=True)
+
+def compare_results(results, baseline, tolerance=0.2):
+    """Compare benchmark `results` with `baseline` results. `tolerance` is allowed relative
+    slowdown or memory growth, default is 0.2 (20%). Returns list of dictionaries with keys:
+    ``name``, ``speed_change``, ``memory_change`` (relative changes, ``None`` if there is
+    nothing to compare) and ``regression`` flag."""
+
+    baseline_results = baseline.get("results", baseline)
+    comparisons = []
+
+    for name in sorted(results.keys()):
+        result = results[name]
+        base = baseline_results.get(name)
+        comparison = {"name": name,
+                      "speed_change": None,
+                      "memory_change": None,
+                      "regression": False}
+
+        if base:
+            if base.get("rows_per_second") and result.get("rows_per_second"):
+                change = result["rows_per_second"] / float(base["rows_per_second"]) - 1
+                comparison["speed_change"] = change
+                if change < -tolerance:
+                    comparison["regression"] = True
+
+            base_memory = base.get("peak_memory") or 0
+            memory = result.get("peak_memory") or 0
+            if base_memory:
+                comparison["memory_change"] = memory / float(base_memory) - 1
+            if memory - base_memory > max(base_memory * tolerance, _memory_noise):
+                comparison["regression"] = True
+
+        comparisons.append(comparison)
+
+    return comparisons
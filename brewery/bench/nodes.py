@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Microbenchmarks of built-in nodes and of the pieces of the stream machinery that every row
+passes through: pipes, field lookup, CSV decoding and field statistics."""
+
+import threading
+import StringIO
+import brewery.nodes as nodes
+import brewery.streams as streams
+from brewery.ds.csv_streams import UnicodeReader, UnicodeWriter
+from brewery.dq.field_statistics import FieldStatistics
+from .base import *
+
+__all__ = (
+    "node_benchmarks",
+)
+
+class _CountingPipe(streams.SimpleDataPipe):
+    """Output pipe that only counts rows, so the output does not affect measured memory."""
+    def __init__(self):
+        super(_CountingPipe, self).__init__()
+        self.count = 0
+
+    def put(self, obj):
+        self.count += 1
+
+    def put_batch(self, batch):
+        self.count += len(batch)
+
+class _NullOutput(object):
+    """File-like object that discards everything written."""
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+def _input_pipe(fields, rows):
+    pipe = streams.SimpleDataPipe()
+    pipe.fields = fields
+    pipe.buffer = rows
+    return pipe
+
+def node_setup(factory, as_strings=False, inputs=1):
+    """Return a benchmark setup function for a node created by `factory`. `factory` gets input
+    fields and returns configured node. Node gets `inputs` pipes with the same synthetic rows."""
+
+    def setup(settings):
+        fields = synthetic_fields(settings["width"])
+        if as_strings:
+            fields = fields.copy()
+            for i in range(len(fields)):
+                fields[i].storage_type = "string"
+
+        node = factory(fields)
+        node.inputs = []
+        for i in range(inputs):
+            node.inputs.append(_input_pipe(fields, synthetic_rows(settings, as_strings)))
+
+        if isinstance(node, nodes.TargetNode):
+            node.outputs = []
+        else:
+            output = _CountingPipe()
+            node.outputs = [output]
+
+        node.initialize()
+        for output in node.outputs:
+            output.fields = node.output_fields
+
+        def run():
+            node.run()
+            node.finalize()
+
+        return (run, settings["rows"] * inputs)
+
+    return setup
+
+def _sample(fields):
+    return nodes.SampleNode(size=1000000000, method="first")
+
+def _aggregate(fields):
+    return nodes.AggregateNode(keys=["category"], measures=["amount"])
+
+def _audit(fields):
+    return nodes.AuditNode()
+
+def _distinct(fields):
+    return nodes.DistinctNode(distinct_fields=["category", "field_4"])
+
+def _select(fields):
+    return nodes.SelectNode(condition="amount > 500")
+
+def _function_select(fields):
+    return nodes.FunctionSelectNode(function=lambda value: value > 500, fields=["amount"])
+
+def _vectorized_function_select(fields):
+    return nodes.FunctionSelectNode(function=lambda value: value > 500, fields=["amount"],
+                                    vectorized=True)
+
+def _set_select(fields):
+    return nodes.SetSelectNode(field="category", value_set=set([u"category 1", u"category 2"]))
+
+def _field_map(fields):
+    return nodes.FieldMapNode(map_fields={"amount": "value"}, drop_fields=["text"])
+
+def _text_substitute(fields):
+    node = nodes.TextSubstituteNode("text")
+    node.add_substitution("word", "term")
+    return node
+
+def _string_strip(fields):
+    return nodes.StringStripNode()
+
+def _derive(fields):
+    return nodes.DeriveNode(formula="amount * 2", field_name="double_amount")
+
+def _coalesce(fields):
+    node = nodes.CoalesceValueToTypeNode()
+    node.fields = synthetic_fields(len(fields))
+    return node
+
+def _value_threshold(fields):
+    return nodes.ValueThresholdNode(thresholds=[["amount", 100, 900]])
+
+def _merge(fields):
+    node = nodes.MergeNode(joins=[(1, "id")], maps={1: {"keep": ["id", "category"]}})
+    return node
+
+def _append(fields):
+    return nodes.AppendNode()
+
+def _row_list_target(fields):
+    return nodes.RowListTargetNode()
+
+def _record_list_target(fields):
+    return nodes.RecordListTargetNode()
+
+def _formatted_printer(fields):
+    return nodes.FormattedPrinterNode(target=_NullOutput())
+
+def _pretty_printer(fields):
+    return nodes.PrettyPrinterNode(target=_NullOutput())
+
+def _csv_target(fields):
+    return nodes.CSVTargetNode(StringIO.StringIO())
+
+def _pipe_setup(settings):
+    """Pass rows through a threaded pipe from one thread to another."""
+    rows = synthetic_rows(settings)
+
+    def run():
+        pipe = streams.Pipe()
+
+        def produce():
+            for row in rows:
+                pipe.put(row)
+            pipe.done_sending()
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        for row in pipe.rows():
+            pass
+        producer.join()
+
+    return (run, len(rows))
+
+def _field_list_index_setup(settings):
+    """Look up field index by name - once per row for each field."""
+    fields = synthetic_fields(settings["width"])
+    names = fields.names()
+    count = settings["rows"]
+
+    def run():
+        for i in xrange(count):
+            for name in names:
+                fields.index(name)
+
+    return (run, count)
+
+def _unicode_reader_setup(settings):
+    """Decode CSV data with typed fields."""
+    fields = synthetic_fields(settings["width"])
+    handle = StringIO.StringIO()
+    writer = UnicodeWriter(handle)
+    writer.writerows(synthetic_rows(settings))
+    data = handle.getvalue()
+
+    def run():
+        reader = UnicodeReader(StringIO.StringIO(data))
+        reader.set_fields(fields)
+        for row in reader:
+            pass
+
+    return (run, settings["rows"])
+
+def _field_statistics_setup(settings):
+    """Probe values of one categorical and one numeric field."""
+    rows = synthetic_rows(settings)
+
+    def run():
+        category = FieldStatistics("category")
+        amount = FieldStatistics("amount")
+        for row in rows:
+            category.probe(row[1])
+            amount.probe(row[2])
+        category.finalize()
+        amount.finalize()
+
+    return (run, len(rows))
+
+def node_benchmarks():
+    """Return a suite of node benchmarks."""
+
+    suite = BenchmarkSuite("nodes")
+
+    # Stream machinery
+    suite.add(Benchmark("pipe", _pipe_setup, "threaded Pipe transfer"))
+    suite.add(Benchmark("field_list_index", _field_list_index_setup,
+                        "FieldList.index() of every field"))
+    suite.add(Benchmark("unicode_reader", _unicode_reader_setup, "UnicodeReader CSV decoding"))
+    suite.add(Benchmark("field_statistics", _field_statistics_setup,
+                        "FieldStatistics.probe()"))
+
+    # Record nodes
+    suite.add(Benchmark("sample", node_setup(_sample)))
+    suite.add(Benchmark("append", node_setup(_append, inputs=2)))
+    suite.add(Benchmark("merge", node_setup(_merge, inputs=2)))
+    suite.add(Benchmark("distinct", node_setup(_distinct)))
+    suite.add(Benchmark("aggregate", node_setup(_aggregate)))
+    suite.add(Benchmark("audit", node_setup(_audit)))
+    suite.add(Benchmark("select", node_setup(_select)))
+    suite.add(Benchmark("function_select", node_setup(_function_select)))
+    suite.add(Benchmark("vectorized_function_select",
+                        node_setup(_vectorized_function_select)))
+    suite.add(Benchmark("set_select", node_setup(_set_select)))
+
+    # Field nodes
+    suite.add(Benchmark("field_map", node_setup(_field_map)))
+    suite.add(Benchmark("text_substitute", node_setup(_text_substitute)))
+    suite.add(Benchmark("string_strip", node_setup(_string_strip)))
+    suite.add(Benchmark("derive", node_setup(_derive)))
+    suite.add(Benchmark("coalesce_value_to_type", node_setup(_coalesce, as_strings=True)))
+    suite.add(Benchmark("value_threshold", node_setup(_value_threshold)))
+
+    # Target nodes
+    suite.add(Benchmark("row_list_target", node_setup(_row_list_target)))
+    suite.add(Benchmark("record_list_target", node_setup(_record_list_target)))
+    suite.add(Benchmark("formatted_printer", node_setup(_formatted_printer)))
+    suite.add(Benchmark("pretty_printer", node_setup(_pretty_printer)))
+    suite.add(Benchmark("csv_target", node_setup(_csv_target)))
+
+    return suite
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""End-to-end benchmarks of realistic streams. Scenario input data are generated locally into a
+temporary directory, each scenario is run under each execution engine with each pipe buffer
+size."""
+
+import os
+import shutil
+import tempfile
+import timeit
+import brewery.nodes as nodes
+import brewery.streams as streams
+from brewery.ds.csv_streams import UnicodeWriter
+from .base import *
+
+__all__ = (
+    "Scenario",
+    "stream_engines",
+    "stream_scenarios",
+    "stream_benchmarks"
+)
+
+def _run_threaded(stream):
+    """Run stream with one thread per node."""
+    stream.run()
+
+"""Execution engines: dictionary of functions that get a stream and run it"""
+stream_engines = {
+    "threads": _run_threaded
+}
+
+class Scenario(object):
+    """Stream benchmark scenario."""
+    def __init__(self, name, build, description=None):
+        """Creates a scenario.
+
+        :Parameters:
+            * `name` - scenario name
+            * `build` - callable that gets benchmark settings and a directory for generated data
+              and returns a tuple (`stream`, `count`, `target`) where `stream` is the stream to
+              be run, `count` is number of source rows and `target` is the node which receives
+              the stream output. Arrival of the first row at `target` is measured as latency.
+            * `description` - human readable description
+        """
+        super(Scenario, self).__init__()
+        self.name = name
+        self.build = build
+        self.description = description
+
+def _write_csv(path, fields, rows):
+    """Write CSV file with header."""
+    handle = open(path, "wb")
+    writer = UnicodeWriter(handle)
+    writer.writerow(fields)
+    writer.writerows(rows)
+    handle.close()
+
+def _time_first_row(node, timings):
+    """Instrument `node` so that time of arrival of the first input row is stored in the
+    `timings` dictionary under the ``first_row`` key."""
+
+    run = node.run
+
+    def timed_run():
+        for pipe in node.inputs:
+            def timed_rows(rows=pipe.rows):
+                iterator = iter(rows())
+                for row in iterator:
+                    timings.setdefault("first_row", timeit.default_timer())
+                    yield row
+                    break
+                for row in iterator:
+                    yield row
+            pipe.rows = timed_rows
+        run()
+
+    node.run = timed_run
+
+def _aggregate_sql(settings, directory):
+    """CSV -> coalesce value to type -> aggregate -> SQL (sqlite) table"""
+
+    fields = synthetic_fields(settings["width"])
+    path = os.path.join(directory, "aggregate.csv")
+    _write_csv(path, fields.names(), synthetic_rows(settings))
+
+    coalesce = nodes.CoalesceValueToTypeNode()
+    coalesce.fields = fields
+    target = nodes.SQLTableTargetNode(url="sqlite:///" + os.path.join(directory, "aggregate.db"),
+                                      table="aggregates", create=True, replace=True)
+
+    stream = streams.Stream()
+    stream.add(nodes.CSVSourceNode(path), "source")
+    stream.add(coalesce, "coalesce")
+    stream.add(nodes.AggregateNode(keys=["category"], measures=["amount"]), "aggregate")
+    stream.add(target, "target")
+    stream.connect("source", "coalesce")
+    stream.connect("coalesce", "aggregate")
+    stream.connect("aggregate", "target")
+
+    return (stream, settings["rows"], target)
+
+def _merge_files(settings, directory):
+    """Merge multiple CSV files with different fields but with common subset of fields, as in
+    the ``merge_multiple_files`` example, with additional field with origin file name."""
+
+    sources = [
+        ("grants_2008.csv", ["receiver", "amount", "date"]),
+        ("grants_2009.csv", ["id", "receiver", "amount", "contract_number", "date"]),
+        ("grants_2010.csv", ["receiver", "subject", "requested_amount", "amount", "date"])
+    ]
+    common = ["receiver", "amount", "date"]
+
+    file_settings = dict(settings)
+    file_settings["rows"] = settings["rows"] / len(sources)
+    file_settings["width"] = 5
+    generated = synthetic_rows(file_settings, as_strings=True)
+
+    stream = streams.Stream()
+    target = nodes.CSVTargetNode(os.path.join(directory, "merged.csv"))
+    stream.add(nodes.AppendNode(), "append")
+    stream.add(target, "target")
+    stream.connect("append", "target")
+
+    for i, (name, names) in enumerate(sources):
+        path = os.path.join(directory, name)
+        _write_csv(path, names, [row[:len(names)] for row in generated])
+
+        stream.add(nodes.CSVSourceNode(path), "source_%d" % i)
+        stream.add(nodes.FieldMapNode(keep_fields=common), "keep_%d" % i)
+        stream.add(nodes.DeriveNode(formula=repr(name), field_name="file"), "file_%d" % i)
+        stream.connect("source_%d" % i, "keep_%d" % i)
+        stream.connect("keep_%d" % i, "file_%d" % i)
+        stream.connect("file_%d" % i, "append")
+
+    return (stream, file_settings["rows"] * len(sources), target)
+
+def _audit_wide(settings, directory):
+    """Audit of a wide CSV file (at least 50 fields)"""
+
+    wide_settings = dict(settings)
+    wide_settings["width"] = max(settings["width"], 50)
+    fields = synthetic_fields(wide_settings["width"])
+    path = os.path.join(directory, "wide.csv")
+    _write_csv(path, fields.names(), synthetic_rows(wide_settings))
+
+    target = nodes.RowListTargetNode()
+    stream = streams.Stream()
+    stream.add(nodes.CSVSourceNode(path), "source")
+    stream.add(nodes.AuditNode(), "audit")
+    stream.add(target, "target")
+    stream.connect("source", "audit")
+    stream.connect("audit", "target")
+
+    return (stream, settings["rows"], target)
+
+"""List of stream scenarios"""
+stream_scenarios = [
+    Scenario("aggregate_sql", _aggregate_sql,
+             "CSV -> coalesce -> aggregate -> sqlite table"),
+    Scenario("merge_files", _merge_files,
+             "three CSV files -> field map -> derive -> append -> CSV"),
+    Scenario("audit_wide", _audit_wide,
+             "wide CSV -> audit -> row list")
+]
+
+def scenario_setup(scenario, engine, buffer_size):
+    """Return a benchmark setup function that runs `scenario` with `engine` and pipes with
+    `buffer_size`. Generating data and building the stream is not measured. Measured function
+    returns ``first_row_latency`` - seconds from the start of the run until the first row
+    arrived at the scenario target."""
+
+    def setup(settings):
+        directory = tempfile.mkdtemp(prefix="brewery_bench_")
+        (stream, count, target) = scenario.build(settings, directory)
+        stream.pipe_buffer_size = buffer_size
+
+        timings = {}
+        _time_first_row(target, timings)
+
+        def run():
+            start = timeit.default_timer()
+            stream_engines[engine](stream)
+            if "first_row" in timings:
+                return {"first_row_latency": timings["first_row"] - start}
+            else:
+                return {"first_row_latency": None}
+
+        def cleanup():
+            shutil.rmtree(directory, ignore_errors=True)
+
+        return (run, count, cleanup)
+
+    return setup
+
+def stream_benchmarks(engines=None, buffer_sizes=None):
+    """Return a suite of stream scenario benchmarks. Each scenario is run with each of `engines`
+    (default is all from `stream_engines`) and each of pipe `buffer_sizes` (default is 1000).
+    Benchmark names are in form ``scenario:engine:buffer_size``."""
+
+    engines = engines or sorted(stream_engines.keys())
+    buffer_sizes = buffer_sizes or [1000]
+
+    for engine in engines:
+        if engine not in stream_engines:
+            raise KeyError("Unknown stream engine '%s'. Available: %s"
+                           % (engine, ", ".join(sorted(stream_engines.keys()))))
+
+    suite = BenchmarkSuite("streams")
+    for scenario in stream_scenarios:
+        for engine in engines:
+            for buffer_size in buffer_sizes:
+                name = "%s:%s:%d" % (scenario.name, engine, buffer_size)
+                suite.add(Benchmark(name, scenario_setup(scenario, engine, buffer_size),
+                                    scenario.description))
+
+    return suite
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Persistent caches used by streams, so that repeated runs do not obtain the same data again.
+
+:class:`MetadataCache` keeps metadata that is expensive to obtain, such as reflected database
+tables. Each entry is stored together with a fingerprint of the described resource – size and
+modification time of a file or hash of a table definition. An entry with a different fingerprint
+is stale: it is removed and the caller obtains the metadata again.
+
+:class:`ResultCache` keeps rows produced by parts of streams in binary row files, see
+:meth:`brewery.streams.Stream.memoize`."""
+
+import os
+import time
+import datetime
+import hashlib
+import tempfile
+import cPickle as pickle
+
+__all__ = (
+    "MetadataCache",
+    "ResultCache",
+    "file_fingerprint",
+    "value_fingerprint"
+)
+
+def file_fingerprint(path):
+    """Return fingerprint of a local file `path` – tuple (`size`, `modification time`) – or
+    ``None`` if `path` is not a local file."""
+    if not isinstance(path, basestring) or not os.path.isfile(path):
+        return None
+    info = os.stat(path)
+    return (info.st_size, info.st_mtime)
+
+def _canonical(value):
+    """Return representation of `value` that is equal for equal values in any process, or raise
+    `TypeError` if there is no such representation (for example for functions)."""
+    if value is None or isinstance(value, (bool, int, long, float, basestring,
+                                           datetime.date, datetime.time, datetime.timedelta)):
+        return value
+    elif isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    elif isinstance(value, (set, frozenset)):
+        return ["set"] + sorted(_canonical(item) for item in value)
+    elif isinstance(value, dict):
+        return ["dict"] + sorted((_canonical(key), _canonical(item))
+                                 for (key, item) in value.items())
+    elif isinstance(value, type):
+        return "%s.%s" % (value.__module__, value.__name__)
+    elif hasattr(value, "to_dict"):
+        # Field
+        return _canonical(value.to_dict())
+    elif hasattr(value, "fields") and hasattr(value, "names"):
+        # FieldList
+        return _canonical(list(value))
+
+    raise TypeError("Value of type %s has no canonical representation" % type(value))
+
+def value_fingerprint(value):
+    """Return hash of `value` composed of basic python types, fields and field lists, that is
+    the same in any process. Returns ``None`` if the value contains objects without stable
+    representation, such as functions."""
+    try:
+        canonical = _canonical(value)
+    except TypeError:
+        return None
+    return hashlib.sha1(repr(canonical)).hexdigest()
+
+class MetadataCache(object):
+    """Metadata cache stored in a directory, one pickled file per entry."""
+
+    def __init__(self, path):
+        """Creates a metadata cache in directory `path`. The directory is created when the first
+        entry is stored."""
+        self.path = path
+
+    def _entry_path(self, key):
+        digest = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(self.path, digest + ".pickle")
+
+    def get(self, key, fingerprint):
+        """Return value stored under `key` if it was stored with the same `fingerprint`,
+        otherwise return ``None``. `key` is a tuple of strings and numbers. Stale entries are
+        removed."""
+        path = self._entry_path(key)
+
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "rb") as handle:
+                (stored_fingerprint, value) = pickle.load(handle)
+        except Exception:
+            # Unreadable entry, for example written by another version of a library
+            self._remove(path)
+            return None
+
+        if stored_fingerprint != fingerprint:
+            self._remove(path)
+            return None
+
+        return value
+
+    def set(self, key, fingerprint, value):
+        """Store `value` under `key` with `fingerprint` of the resource described by the
+        value."""
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        # Write into a temporary file first, so that nodes running in parallel never read half
+        # written entry
+        (fd, temp_path) = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as handle:
+            pickle.dump((fingerprint, value), handle, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, self._entry_path(key))
+
+    def clear(self):
+        """Remove all entries."""
+        if not os.path.exists(self.path):
+            return
+        for name in os.listdir(self.path):
+            if name.endswith(".pickle"):
+                self._remove(os.path.join(self.path, name))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+class ResultCache(object):
+    """Cache of stream results stored in a directory, one binary row file per entry. When the
+    cache grows over `max_size`, least recently used entries are removed."""
+
+    def __init__(self, path, max_size=None, max_age=None):
+        """Creates a result cache in directory `path`.
+
+        :Attributes:
+            * `path`: cache directory, created when the first entry is stored
+            * `max_size`: maximal size of all entries in bytes, default is ``None`` - no limit
+            * `max_age`: number of seconds after which an entry expires, default is ``None`` -
+              entries expire only when they are evicted
+        """
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + ".brw")
+
+    def lookup(self, key):
+        """Return path of binary row file stored under `key` or ``None`` if there is no such
+        entry or it expired. The entry is marked as recently used."""
+        path = self._entry_path(key)
+        if not os.path.exists(path):
+            return None
+
+        now = time.time()
+        info = os.stat(path)
+        if self.max_age is not None and now - info.st_mtime > self.max_age:
+            self._remove(path)
+            return None
+
+        # Access time marks use of the entry, modification time its creation
+        os.utime(path, (now, info.st_mtime))
+        return path
+
+    def temporary_path(self):
+        """Return path of a new temporary file to write an entry into. Pass it to `store()` when
+        the entry is complete or to `discard()`."""
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        (fd, path) = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        os.close(fd)
+        return path
+
+    def store(self, key, temporary_path):
+        """Store file `temporary_path` as entry `key` and evict least recently used entries if
+        the cache is too big."""
+        os.rename(temporary_path, self._entry_path(key))
+        self.evict()
+
+    def discard(self, temporary_path):
+        """Remove file `temporary_path` of an entry that was not completed."""
+        self._remove(temporary_path)
+
+    def evict(self):
+        """Remove least recently used entries until size of the cache is at most `max_size`."""
+        if self.max_size is None or not os.path.exists(self.path):
+            return
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith(".brw"):
+                continue
+            path = os.path.join(self.path, name)
+            info = os.stat(path)
+            entries.append((info.st_atime, info.st_size, path))
+            total += info.st_size
+
+        entries.sort()
+        for (atime, size, path) in entries:
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        """Remove all entries."""
+        if not os.path.exists(self.path):
+            return
+        for name in os.listdir(self.path):
+            if name.endswith(".brw"):
+                self._remove(os.path.join(self.path, name))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -90,6 +90,36 @@ class FieldStatistics(object):
         for probe in self.probes:
             probe.probe(value)
 
+    def probe_values(self, values):
+        """Probe list of `values` of the field, for example a column of a record batch. Result
+        is the same as of calling :meth:`probe` for each value, but faster."""
+
+        if not isinstance(values, (list, tuple)):
+            values = list(values)
+
+        classes = set(value.__class__ for value in values)
+        self.storage_types.update(cls.__name__ for cls in classes)
+        self.value_count += len(values)
+        self.null_count += values.count(None)
+        self.empty_string_count += values.count('')
+
+        if not self.distinct_overflow:
+            distinct = self.distinct_values
+            threshold = self.distinct_threshold
+            for value in values:
+                if threshold and len(distinct) >= threshold:
+                    self.distinct_overflow = True
+                    break
+                try:
+                    distinct.add(value)
+                except:
+                    # FIXME: Should somehow handle invalid values that can not be added
+                    pass
+
+        for probe in self.probes:
+            for value in values:
+                probe.probe(value)
+
     def _probe_distinct(self, value):
         """"""
         if self.distinct_overflow:
@@ -11,6 +11,10 @@ from brewery.ds.stream_auditor import *
 from brewery.ds.yaml_dir_streams import *
 from brewery.ds.sql_streams import *
 from brewery.ds.html_target import *
+from brewery.ds.synthetic_streams import *
+from brewery.ds.binary_streams import *
+from brewery.ds.pandas_streams import *
+from brewery.ds.arrow_streams import *
 
 __all__ = (
     "Field",
@@ -32,5 +36,16 @@ __all__ = (
     "SQLDataSource",
     "SQLDataTarget",
     "StreamAuditor",
-    "SimpleHTMLDataTarget"
+    "SimpleHTMLDataTarget",
+    "SyntheticDataSource",
+    "BinaryDataSource",
+    "BinaryDataTarget",
+    "DataFrameDataSource",
+    "DataFrameDataTarget",
+    "dataframe_fields",
+    "ArrowDataSource",
+    "ArrowDataTarget",
+    "ParquetDataSource",
+    "ParquetDataTarget",
+    "arrow_fields"
 )
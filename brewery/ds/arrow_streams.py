@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Data sources and targets of Apache Arrow IPC files and Parquet files.
+
+Both formats store typed values by columns, so the files are read without parsing and type
+conversion of every value as in CSV files. Data are passed in :class:`brewery.batches.RecordBatch`
+chunks, integer and float columns without missing values as numpy arrays that share memory with
+the read file. Sources read only projected columns and stream the files one record batch or row
+group at a time."""
+
+import os
+import base
+import datetime
+import itertools
+from brewery.metadata import Field, FieldList
+from brewery.batches import RecordBatch
+from brewery.utils import MissingPackage
+
+try:
+    import numpy
+except ImportError:
+    numpy = MissingPackage("numpy", "Arrow and Parquet source/target",
+                           "http://numpy.scipy.org/")
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = MissingPackage("pyarrow", "Arrow and Parquet source/target",
+                             "http://arrow.apache.org/")
+
+__all__ = (
+    "ArrowDataSource",
+    "ArrowDataTarget",
+    "ParquetDataSource",
+    "ParquetDataTarget",
+    "arrow_fields"
+)
+
+# Storage type: arrow type name, see _arrow_type()
+_storage_arrow_types = {
+    "integer": "int64",
+    "float": "float64",
+    "boolean": "bool_",
+    "string": "string",
+    "text": "string"
+}
+
+def _field_types(arrow_type):
+    """Return tuple (storage type, analytical type) of `arrow_type`."""
+    types = pyarrow.types
+    if types.is_integer(arrow_type):
+        return ("integer", "discrete")
+    elif types.is_floating(arrow_type) or types.is_decimal(arrow_type):
+        return ("float", "range")
+    elif types.is_boolean(arrow_type):
+        return ("boolean", "flag")
+    elif types.is_string(arrow_type) or types.is_large_string(arrow_type):
+        return ("string", "set")
+    elif types.is_date(arrow_type) or types.is_timestamp(arrow_type):
+        return ("date", "typeless")
+    elif types.is_list(arrow_type):
+        return ("array", "typeless")
+    return ("unknown", "typeless")
+
+def arrow_fields(schema):
+    """Return :class:`FieldList` describing columns of arrow `schema`. Concrete storage type is
+    the arrow type name."""
+    fields = FieldList()
+    for arrow_field in schema:
+        (storage_type, analytical_type) = _field_types(arrow_field.type)
+        fields.append(Field(unicode(arrow_field.name), storage_type=storage_type,
+                            analytical_type=analytical_type,
+                            concrete_storage_type=str(arrow_field.type)))
+    return fields
+
+def _column_values(array):
+    """Return batch column of arrow `array`: numpy array sharing memory with `array` for
+    integers and floats without missing values, otherwise list of python values."""
+    if array.null_count == 0:
+        arrow_type = array.type
+        if pyarrow.types.is_integer(arrow_type) or pyarrow.types.is_floating(arrow_type):
+            return array.to_numpy()
+        elif pyarrow.types.is_boolean(arrow_type):
+            # Booleans are stored as bits, they are always converted
+            return array.to_numpy(zero_copy_only=False)
+    return array.to_pylist()
+
+def _open_source(resource):
+    """Return tuple (`handle`, `should_close`) of `resource` to be read. Local files are
+    memory mapped, so numeric columns are not copied."""
+    if isinstance(resource, basestring) and os.path.isfile(resource):
+        return (pyarrow.memory_map(resource), True)
+    return base.open_resource(resource, "rb")
+
+class _ArrowDataSource(base.DataSource):
+    """Base of data sources reading arrow record batches."""
+
+    def __init__(self, resource, projection=None, limit=None, batch_size=10000):
+        super(_ArrowDataSource, self).__init__()
+        self.resource = resource
+        self.projection = projection
+        self.limit = limit
+        self.batch_size = batch_size
+        self.fields = None
+        self.handle = None
+        self.close_file = False
+        self._names = None
+
+    def initialize(self):
+        self.handle, self.close_file = _open_source(self.resource)
+        fields = arrow_fields(self._open_schema())
+
+        if self.projection is not None:
+            projection = set(self.projection)
+            fields = FieldList([field for field in fields if field.name in projection])
+
+        self.fields = fields
+        self._names = fields.names()
+
+    def _open_schema(self):
+        """Open the file and return its arrow schema."""
+        raise NotImplementedError
+
+    def _arrow_batches(self):
+        """Return iterator of arrow record batches of projected columns."""
+        raise NotImplementedError
+
+    def batches(self):
+        """Return iterator of :class:`RecordBatch` objects of at most `batch_size` rows."""
+        remaining = self.limit
+        for arrow_batch in self._arrow_batches():
+            for start in xrange(0, arrow_batch.num_rows, self.batch_size):
+                if remaining is not None and remaining <= 0:
+                    return
+
+                length = min(self.batch_size, arrow_batch.num_rows - start)
+                if remaining is not None:
+                    length = min(length, remaining)
+                    remaining -= length
+
+                chunk = arrow_batch.slice(start, length)
+                columns = [_column_values(chunk.column(index))
+                           for index in range(chunk.num_columns)]
+                yield RecordBatch(self.fields, columns, length=length)
+
+    def rows(self):
+        for batch in self.batches():
+            for row in batch:
+                yield row
+
+    def records(self):
+        names = self.fields.names()
+        for row in self.rows():
+            yield dict(zip(names, row))
+
+    def finalize(self):
+        if self.handle and self.close_file:
+            self.handle.close()
+        self.handle = None
+
+class ArrowDataSource(_ArrowDataSource):
+    """Reads rows of an Arrow IPC file (Feather version 2)."""
+
+    def __init__(self, resource, projection=None, limit=None, batch_size=10000):
+        """Creates an Arrow IPC file data source.
+
+        :Attributes:
+            * `resource`: file name or file-like object opened for binary reading. Files are
+              memory mapped
+            * `projection`: list of names of columns to be read, ``None`` means all columns
+            * `limit`: maximal number of rows to be read, ``None`` means all rows
+            * `batch_size`: maximal number of rows of one batch, default is 10000
+
+        Fields are read from the file schema, see :func:`arrow_fields`. Record batches of the
+        file are read one at a time.
+        """
+        super(ArrowDataSource, self).__init__(resource, projection, limit, batch_size)
+        self.reader = None
+
+    def _open_schema(self):
+        self.reader = pyarrow.ipc.open_file(self.handle)
+        return self.reader.schema
+
+    def _arrow_batches(self):
+        indexes = [self.reader.schema.get_field_index(name) for name in self._names]
+        for i in range(self.reader.num_record_batches):
+            arrow_batch = self.reader.get_batch(i)
+            columns = [arrow_batch.column(index) for index in indexes]
+            yield pyarrow.RecordBatch.from_arrays(columns, self._names)
+
+class ParquetDataSource(_ArrowDataSource):
+    """Reads rows of a Parquet file."""
+
+    def __init__(self, resource, projection=None, limit=None, batch_size=10000):
+        """Creates a Parquet file data source.
+
+        :Attributes:
+            * `resource`: file name or file-like object opened for binary reading. Files are
+              memory mapped
+            * `projection`: list of names of columns to be read, ``None`` means all columns.
+              Other columns are not read from the file at all
+            * `limit`: maximal number of rows to be read, ``None`` means all rows
+            * `batch_size`: maximal number of rows of one batch, default is 10000
+
+        Fields are read from the file schema, see :func:`arrow_fields`. Row groups of the file
+        are read one at a time, so memory use depends on the row group size of the file, not on
+        the file size.
+        """
+        super(ParquetDataSource, self).__init__(resource, projection, limit, batch_size)
+        self.parquet_file = None
+
+    def _open_schema(self):
+        self.parquet_file = pyarrow.parquet.ParquetFile(self.handle)
+        return self.parquet_file.schema.to_arrow_schema()
+
+    def _arrow_batches(self):
+        for i in range(self.parquet_file.num_row_groups):
+            table = self.parquet_file.read_row_group(i, columns=self._names)
+            for arrow_batch in table.to_batches():
+                yield arrow_batch
+
+class _ArrowDataTarget(base.DataTarget):
+    """Base of data targets writing arrow record batches."""
+
+    def __init__(self, resource, fields=None, chunk_size=10000):
+        super(_ArrowDataTarget, self).__init__()
+        self.resource = resource
+        self.fields = fields
+        self.chunk_size = chunk_size
+        self.handle = None
+        self.close_file = False
+        self.schema = None
+        self.writer = None
+        self._rows = []
+        self._chunks = None
+        self._count = 0
+
+    def initialize(self):
+        if not self.fields:
+            raise ValueError("Fields are not initialized")
+        self.fields = FieldList(self.fields)
+        self.handle, self.close_file = base.open_resource(self.resource, "wb")
+        self._rows = []
+        self._chunks = [[] for field in self.fields]
+        self._count = 0
+
+    def append(self, obj):
+        if type(obj) == dict:
+            obj = [obj.get(name) for name in self.fields.names()]
+        self._rows.append(obj)
+        if len(self._rows) >= self.chunk_size:
+            self._flush_rows()
+
+    def append_batch(self, batch):
+        """Append :class:`RecordBatch`. Numeric columns are kept as numpy arrays, rows are
+        written when at least `chunk_size` rows are collected."""
+        self._flush_rows()
+        for (index, chunks) in enumerate(self._chunks):
+            values = batch.numeric_array(index)
+            if values is None:
+                values = batch.column(index)
+            chunks.append(values)
+        self._count += len(batch)
+        if self._count >= self.chunk_size:
+            self._write_chunks()
+
+    def _flush_rows(self):
+        if self._rows:
+            rows = self._rows
+            self._rows = []
+            self.append_batch(RecordBatch.from_rows(self.fields, rows))
+
+    def _arrow_type(self, field, values):
+        """Return arrow type of `field` - derived from the storage type, for dates and fields
+        of other types inferred from the first written `values`."""
+        type_name = _storage_arrow_types.get(field.storage_type)
+        if type_name is not None:
+            return getattr(pyarrow, type_name)()
+
+        present = [value for value in values if value is not None]
+        if field.storage_type == "date":
+            if any(isinstance(value, datetime.datetime) for value in present):
+                return pyarrow.timestamp("us")
+            return pyarrow.date32()
+        elif present:
+            return pyarrow.array(present).type
+        return pyarrow.string()
+
+    def _write_chunks(self, final=False):
+        """Write collected rows as record batches of `chunk_size` rows. Remaining rows are kept,
+        unless `final` is true."""
+        columns = []
+        for chunks in self._chunks:
+            if chunks and all(isinstance(chunk, numpy.ndarray) for chunk in chunks):
+                columns.append(numpy.concatenate(chunks))
+            else:
+                columns.append(list(itertools.chain.from_iterable(chunk.tolist()
+                                                                  if isinstance(chunk,
+                                                                                numpy.ndarray)
+                                                                  else chunk
+                                                                  for chunk in chunks)))
+
+        if self.schema is None:
+            self._open_writer(columns)
+
+        if final:
+            size = self._count
+        else:
+            size = self._count - self._count % self.chunk_size
+
+        # File with no rows still has an empty batch with the schema
+        starts = xrange(0, size, self.chunk_size) if size else [0]
+        for start in starts:
+            arrays = [pyarrow.array(values[start:start + self.chunk_size], type=arrow_field.type)
+                      for (values, arrow_field) in zip(columns, self.schema)]
+            self._write(pyarrow.RecordBatch.from_arrays(arrays, self.fields.names()))
+
+        self._chunks = [[values[size:]] for values in columns]
+        self._count -= size
+
+    def _open_writer(self, columns):
+        types = [self._arrow_type(field, values) for (field, values) in zip(self.fields, columns)]
+        self.schema = pyarrow.schema([pyarrow.field(name, arrow_type)
+                                      for (name, arrow_type) in zip(self.fields.names(), types)])
+        self.writer = self._create_writer()
+
+    def _create_writer(self):
+        raise NotImplementedError
+
+    def _write(self, arrow_batch):
+        raise NotImplementedError
+
+    def finalize(self):
+        if self._chunks is None:
+            return
+        self._flush_rows()
+        if self._count or self.writer is None:
+            self._write_chunks(final=True)
+        self._chunks = None
+
+        self.writer.close()
+        if self.close_file:
+            self.handle.close()
+        self.handle = None
+
+class ArrowDataTarget(_ArrowDataTarget):
+    """Writes rows into an Arrow IPC file (Feather version 2)."""
+
+    def __init__(self, resource, fields=None, chunk_size=10000):
+        """Creates an Arrow IPC file data target.
+
+        :Attributes:
+            * `resource`: file name or file-like object opened for binary writing
+            * `fields`: fields of appended rows, columns of the file
+            * `chunk_size`: number of rows of one record batch of the file, default is 10000
+
+        Column types are derived from field storage types: ``integer`` columns are int64,
+        ``float`` columns float64, ``boolean`` bool and ``string`` and ``text`` columns
+        string. ``date`` columns are date32 or timestamps if the values are datetimes, types of
+        other columns are inferred from the first written values.
+        """
+        super(ArrowDataTarget, self).__init__(resource, fields, chunk_size)
+
+    def _create_writer(self):
+        return pyarrow.RecordBatchFileWriter(self.handle, self.schema)
+
+    def _write(self, arrow_batch):
+        self.writer.write_batch(arrow_batch)
+
+class ParquetDataTarget(_ArrowDataTarget):
+    """Writes rows into a Parquet file."""
+
+    def __init__(self, resource, fields=None, row_group_size=100000, compression="snappy"):
+        """Creates a Parquet file data target.
+
+        :Attributes:
+            * `resource`: file name or file-like object opened for binary writing
+            * `fields`: fields of appended rows, columns of the file
+            * `row_group_size`: number of rows of one row group of the file, default is 100000
+            * `compression`: compression codec of the file - ``snappy`` (default), ``gzip``,
+              ``brotli`` or ``None``
+
+        Column types are derived from field storage types as in :class:`ArrowDataTarget`.
+        """
+        super(ParquetDataTarget, self).__init__(resource, fields, row_group_size)
+        self.compression = compression
+
+    def _create_writer(self):
+        return pyarrow.parquet.ParquetWriter(self.handle, self.schema,
+                                             compression=self.compression or "none")
+
+    def _write(self, arrow_batch):
+        table = pyarrow.Table.from_batches([arrow_batch])
+        self.writer.write_table(table, row_group_size=arrow_batch.num_rows or None)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compact binary row files used for recording and replaying streams, caches and passing data
+between streams.
+
+File layout: 8 bytes of magic ``BRWROWS1`` followed by frames. Each frame is a 4-byte big-endian
+length, one byte of flags and serialized data - marshalled, or pickled for values that can not be
+marshalled (flag 2), optionally compressed with zlib (flag 1). The first frame is a dictionary
+with file metadata (key ``fields`` contains list of field dictionaries), following frames are
+batches of rows - tuples (`row count`, `columns`). Frame of length zero marks end of data.
+
+The end frame is followed by the index frame - list of tuples (`offset`, `row count`) of all
+batch frames, offsets from the start of the file - and by 16 bytes of trailer: 8-byte big-endian
+offset of the index frame and magic ``BRWINDEX``. Files are read sequentially, the index is used
+only to read ranges of batches."""
+
+import base
+import zlib
+import struct
+import marshal
+import cPickle as pickle
+from brewery.metadata import Field, FieldList
+from brewery.batches import RecordBatch
+
+__all__ = (
+    "BinaryDataSource",
+    "BinaryDataTarget"
+)
+
+_MAGIC = "BRWROWS1"
+_INDEX_MAGIC = "BRWINDEX"
+_FRAME_HEADER = struct.Struct(">IB")
+_TRAILER = struct.Struct(">Q8s")
+
+# Frame flags
+_COMPRESSED = 1
+_PICKLED = 2
+
+_MARSHAL_VERSION = 2
+
+def _serialize(obj, compression):
+    """Return tuple (`flags`, `data`) of `obj`."""
+    try:
+        data = marshal.dumps(obj, _MARSHAL_VERSION)
+        flags = 0
+    except ValueError:
+        # Values such as dates or decimals
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        flags = _PICKLED
+
+    if compression:
+        compressed = zlib.compress(data, compression)
+        if len(compressed) < len(data):
+            return (flags | _COMPRESSED, compressed)
+    return (flags, data)
+
+def _deserialize(flags, data):
+    if flags & _COMPRESSED:
+        data = zlib.decompress(data)
+    if flags & _PICKLED:
+        return pickle.loads(data)
+    return marshal.loads(data)
+
+class BinaryDataTarget(base.DataTarget):
+    """Writes rows into a binary row file."""
+
+    def __init__(self, resource, buffer_size=1000, compression=None):
+        """Creates a binary data target.
+
+        :Attributes:
+            * `resource`: file name or file-like object opened for binary writing
+            * `buffer_size`: number of rows collected by `append()` before they are written as
+              one batch, default is 1000. Batches written by `append_batch()` are written as they
+              are.
+            * `compression`: zlib compression level from 1 (fastest) to 9, default is ``None`` -
+              no compression. Batches that do not get smaller are not compressed.
+
+        Batches are stored by columns. Columns of strings, numbers, booleans and ``None`` are
+        marshalled, other values are pickled.
+        """
+        super(BinaryDataTarget, self).__init__()
+        self.resource = resource
+        self.buffer_size = buffer_size
+        self.compression = compression
+        self.fields = None
+        self.handle = None
+        self.close_file = False
+        self._buffer = []
+        self._index = []
+        self._offset = 0
+        self.count = 0
+
+    def initialize(self):
+        if not self.fields:
+            raise ValueError("Fields are not initialized")
+
+        self.handle, self.close_file = base.open_resource(self.resource, "wb")
+        self.handle.write(_MAGIC)
+        self._offset = len(_MAGIC)
+        self._index = []
+        metadata = {"fields": [field.to_dict() for field in self.fields]}
+        self._write_frame(*_serialize(metadata, None))
+
+    def _write_frame(self, flags, data):
+        self.handle.write(_FRAME_HEADER.pack(len(data), flags))
+        self.handle.write(data)
+        self._offset += _FRAME_HEADER.size + len(data)
+
+    def append(self, obj):
+        if type(obj) == dict:
+            obj = [obj.get(name) for name in self.fields.names()]
+        self._buffer.append(obj)
+        if len(self._buffer) >= self.buffer_size:
+            self._flush()
+
+    def append_batch(self, rows):
+        """Write list of rows or :class:`brewery.batches.RecordBatch` as one batch."""
+        self._flush()
+        count = len(rows)
+        if not count:
+            return
+
+        if isinstance(rows, RecordBatch):
+            columns = [tuple(column) for column in rows.selected_columns()]
+        else:
+            columns = zip(*rows)
+
+        self._index.append((self._offset, count))
+        self._write_frame(*_serialize((count, columns), self.compression))
+        self.count += count
+
+    def _flush(self):
+        if self._buffer:
+            buffer = self._buffer
+            self._buffer = []
+            self.append_batch(buffer)
+
+    def finalize(self):
+        if not self.handle:
+            return
+        self._flush()
+        self.handle.write(_FRAME_HEADER.pack(0, 0))
+        self._offset += _FRAME_HEADER.size
+
+        index_offset = self._offset
+        self._write_frame(*_serialize(self._index, None))
+        self.handle.write(_TRAILER.pack(index_offset, _INDEX_MAGIC))
+
+        if self.close_file:
+            self.handle.close()
+        else:
+            self.handle.flush()
+        self.handle = None
+
+class BinaryDataSource(base.DataSource):
+    """Reads rows from a binary row file written by :class:`BinaryDataTarget`."""
+
+    def __init__(self, resource, start=None, stop=None):
+        """Creates a binary data source.
+
+        :Attributes:
+            * `resource`: file name or file-like object opened for binary reading
+            * `start`, `stop`: range of batches to be read - index of the first batch and of the
+              batch after the last one. Default is ``None`` - from the first batch or to the last
+              one. Reading a range requires seekable file.
+
+        Fields are read from the file on `initialize()`. Several sources with different ranges
+        can read the same file in parallel, see :meth:`ranges`.
+        """
+        super(BinaryDataSource, self).__init__()
+        self.resource = resource
+        self.start = start
+        self.stop = stop
+        self.fields = None
+        self.handle = None
+        self.close_file = False
+        self._base = 0
+        self._data_offset = None
+        self._index = None
+
+    def initialize(self):
+        self.handle, self.close_file = base.open_resource(self.resource, "rb")
+        position = self._tell()
+        self._base = position or 0
+
+        if self.handle.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("Resource '%s' is not a brewery binary row file" % self.resource)
+
+        metadata = self._read_frame()
+        if metadata is None:
+            raise ValueError("Binary row file '%s' has no metadata" % self.resource)
+        self.fields = FieldList([Field(**field) for field in metadata["fields"]])
+        position = self._tell()
+        if position is not None:
+            self._data_offset = position - self._base
+
+    def _tell(self):
+        """Return position in the file or ``None`` if the file is not seekable, such as URL."""
+        try:
+            return self.handle.tell()
+        except (AttributeError, IOError):
+            return None
+
+    def _read(self, length):
+        data = self.handle.read(length)
+        if len(data) < length:
+            raise ValueError("Binary row file '%s' is truncated" % self.resource)
+        return data
+
+    def _read_frame(self):
+        """Read next frame and return its deserialized object or ``None`` at the end frame."""
+        (length, flags) = _FRAME_HEADER.unpack(self._read(_FRAME_HEADER.size))
+        if not length:
+            return None
+        return _deserialize(flags, self._read(length))
+
+    def _batch(self, frame):
+        (count, columns) = frame
+        return RecordBatch(self.fields, columns, length=count)
+
+    def index(self):
+        """Return list of tuples (`offset`, `row count`) of all batches of the file. Requires
+        seekable file."""
+        if self._index is not None:
+            return self._index
+
+        self.handle.seek(-_TRAILER.size, 2)
+        (offset, magic) = _TRAILER.unpack(self._read(_TRAILER.size))
+        if magic != _INDEX_MAGIC:
+            raise ValueError("Binary row file '%s' has no index, it is incomplete"
+                             % self.resource)
+        self.handle.seek(self._base + offset)
+        self._index = self._read_frame()
+        return self._index
+
+    def batch_count(self):
+        """Return number of batches in the file."""
+        return len(self.index())
+
+    def row_count(self):
+        """Return number of rows in the file."""
+        return sum(count for (offset, count) in self.index())
+
+    def ranges(self, count):
+        """Return list of at most `count` ranges (`start`, `stop`) of batches with about the same
+        number of rows, covering the whole file. Each range can be read by a separate
+        :class:`BinaryDataSource`, for example in a separate thread or process."""
+        index = self.index()
+        total = sum(rows for (offset, rows) in index)
+        ranges = []
+        start = 0
+        read = 0
+        for (i, (offset, rows)) in enumerate(index):
+            read += rows
+            if read * count >= total * (len(ranges) + 1):
+                ranges.append((start, i + 1))
+                start = i + 1
+        if start < len(index):
+            ranges.append((start, len(index)))
+        return ranges
+
+    def read_batch(self, number):
+        """Return batch `number` of the file as :class:`brewery.batches.RecordBatch`."""
+        (offset, count) = self.index()[number]
+        self.handle.seek(self._base + offset)
+        return self._batch(self._read_frame())
+
+    def batches(self):
+        """Return iterator of :class:`brewery.batches.RecordBatch` objects as they were written,
+        only batches of the range `start`, `stop` if specified."""
+        if self.start is None and self.stop is None:
+            if self._index is not None:
+                # Reading of the index moved the position
+                self.handle.seek(self._base + self._data_offset)
+            while True:
+                frame = self._read_frame()
+                if frame is None:
+                    break
+                yield self._batch(frame)
+            return
+
+        index = self.index()
+        selected = index[self.start:self.stop]
+        if not selected:
+            return
+        self.handle.seek(self._base + selected[0][0])
+        for entry in selected:
+            yield self._batch(self._read_frame())
+
+    def rows(self):
+        for batch in self.batches():
+            for row in batch:
+                yield row
+
+    def records(self):
+        names = self.fields.names()
+        for row in self.rows():
+            yield dict(zip(names, row))
+
+    def finalize(self):
+        if self.handle and self.close_file:
+            self.handle.close()
+        self.handle = None
@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import csv
 import codecs
 import cStringIO
 import base
 import brewery.metadata
+from brewery.cache import file_fingerprint, value_fingerprint
 
 class UTF8Recoder(object):
     """
@@ -51,14 +53,21 @@ class UnicodeReader:
         self.reader = csv.reader(f, dialect=dialect, **kwds)
         self.converters = []
         self.empty_as_null = empty_as_null
+        self.indexes = None
 
-    def set_fields(self, fields):
+    def set_fields(self, fields, indexes=None):
+        """Set `fields` of returned rows. If `indexes` are specified, only values of columns at
+        those indexes are decoded and returned."""
         self.converters = [storage_conversion[f.storage_type] for f in fields]
+        self.indexes = indexes
 
     def next(self):
         row = self.reader.next()
         result = []
 
+        if self.indexes is not None:
+            row = [row[i] for i in self.indexes if i < len(row)]
+
         # FIXME: make this nicer, this is just quick hack
         for i, value in enumerate(row):
             if self.converters:
@@ -127,7 +136,8 @@ class CSVDataSource(base.DataSource):
     """
     def __init__(self, resource, read_header=True, dialect=None, encoding=None,
                  detect_header=False, sample_size=200, skip_rows=None,
-                 empty_as_null=True,fields=None, **reader_args):
+                 empty_as_null=True,fields=None, projection=None, metadata_cache=None,
+                 **reader_args):
         """Creates a CSV data source stream.
         
         :Attributes:
@@ -143,6 +153,13 @@ class CSVDataSource(base.DataSource):
               prevent loading huge CSV files at once.
             * skip_rows: number of rows to be skipped. Default: ``None``
             * empty_as_null: treat empty strings as ``Null`` values
+            * projection: list of names of fields to be read, values of other
+              columns are skipped without decoding. Default is ``None`` - all
+              fields are read
+            * metadata_cache: :class:`brewery.cache.MetadataCache` where the
+              header of a local file is stored - result of header detection
+              and field names - so that it is not detected and decoded again
+              while the file does not change
             
         Note: avoid auto-detection when you are reading from remote URL
         stream.
@@ -162,7 +179,21 @@ class CSVDataSource(base.DataSource):
         self.close_file = False
         self.skip_rows = skip_rows
         self.fields = fields
+        self.projection = projection
+        self.metadata_cache = metadata_cache
         
+    def _header_key(self):
+        """Return key of the header in the metadata cache or ``None`` if the header is not
+        cached: there is no cache or the resource is not a local file."""
+        if self.metadata_cache is None or file_fingerprint(self.resource) is None:
+            return None
+        options = value_fingerprint((self.encoding, self.dialect, self.read_header,
+                                     self.detect_header, self.sample_size, self.skip_rows,
+                                     self.reader_args))
+        if options is None:
+            return None
+        return ("csv_header", os.path.abspath(self.resource), options)
+
     def initialize(self):
         """Initialize CSV source stream:
         
@@ -185,8 +216,16 @@ class CSVDataSource(base.DataSource):
         self.file, self.close_file = base.open_resource(self.resource)
 
         handle = None
-        
-        if self.detect_header:
+
+        header_key = self._header_key()
+        header = None
+        if header_key:
+            fingerprint = file_fingerprint(self.resource)
+            header = self.metadata_cache.get(header_key, fingerprint)
+
+        if header is not None:
+            self.read_header = header[0]
+        elif self.detect_header:
             
             sample = self.file.read(self.sample_size)
 
@@ -216,7 +255,12 @@ class CSVDataSource(base.DataSource):
                 
         # Initialize field list
         if self.read_header:
-            field_names = self.reader.next()
+            if header is not None:
+                # Known header line is skipped without decoding
+                self.reader.reader.next()
+                field_names = header[1]
+            else:
+                field_names = self.reader.next()
             
             # Fields set explicitly take priority over what is read from the
             # header. (Issue #17 might be somehow related)
@@ -224,12 +268,22 @@ class CSVDataSource(base.DataSource):
                 fields = [ (name, "string", "default") for name in field_names]
                 self.fields = brewery.metadata.FieldList(fields)
             
+        if header_key and header is None:
+            names = field_names if self.read_header else None
+            self.metadata_cache.set(header_key, fingerprint, (self.read_header, names))
+
         if not self.fields:
             raise RuntimeError("Fields are not initialized. "
                                "Either read fields from CSV header or "
                                "set them manually")
 
-        self.reader.set_fields(self.fields)
+        indexes = None
+        if self.projection is not None:
+            indexes = [i for (i, field) in enumerate(self.fields)
+                                        if field.name in self.projection]
+            self.fields = brewery.metadata.FieldList([self.fields[i] for i in indexes])
+
+        self.reader.set_fields(self.fields, indexes)
         
     def finalize(self):
         if self.file and self.close_file:
@@ -288,7 +342,7 @@ class CSVDataTarget(base.DataTarget):
             self.file.close()
 
     def append(self, obj):
-        if type(obj) == dict:
+        if isinstance(obj, (dict, brewery.metadata.RecordView)):
             row = []
             for field in self.field_names:
                 row.append(obj.get(field))
@@ -4,7 +4,7 @@
 import base
 from brewery import dq
 import time
-from brewery.metadata import expand_record
+from brewery.metadata import expand_record, RecordView
 
 try:
     from pyes.es import ES
@@ -231,7 +231,9 @@ class ESDataTarget(base.DataTarget):
 
     def append(self, obj):
         record = obj
-        if not isinstance(obj, dict):
+        if isinstance(obj, RecordView):
+            record = obj.to_dict()
+        elif not isinstance(obj, dict):
             record = dict(zip(self.fields.names(), obj))
 
         if self.expand:
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Data source and target of pandas data frames.
+
+Data are passed by columns in :class:`brewery.batches.RecordBatch` chunks. Numeric columns are
+passed as numpy arrays - slices of the data frame columns or arrays of collected chunks - so the
+values are not converted into python objects unless a node reads them as rows."""
+
+import base
+import itertools
+from brewery.metadata import Field, FieldList
+from brewery.batches import RecordBatch
+from brewery.utils import MissingPackage
+
+try:
+    import numpy
+    import pandas
+except ImportError:
+    numpy = MissingPackage("numpy", "pandas data frame source/target",
+                           "http://numpy.scipy.org/")
+    pandas = MissingPackage("pandas", "pandas data frame source/target",
+                            "http://pandas.pydata.org/")
+
+__all__ = (
+    "DataFrameDataSource",
+    "DataFrameDataTarget",
+    "dataframe_fields"
+)
+
+# numpy dtype kind: (storage type, analytical type)
+_dtype_kind_types = {
+    "i": ("integer", "discrete"),
+    "u": ("integer", "discrete"),
+    "f": ("float", "range"),
+    "b": ("boolean", "flag"),
+    "M": ("date", "typeless")
+}
+
+# Result of pandas infer_dtype() of object columns: (storage type, analytical type)
+_inferred_types = {
+    "string": ("string", "set"),
+    "unicode": ("string", "set"),
+    "integer": ("integer", "discrete"),
+    "floating": ("float", "range"),
+    "mixed-integer-float": ("float", "range"),
+    "boolean": ("boolean", "flag"),
+    "date": ("date", "typeless"),
+    "datetime": ("date", "typeless")
+}
+
+# Storage type: data frame column dtype
+_storage_dtypes = {
+    "integer": "int64",
+    "float": "float64",
+    "boolean": "bool",
+    "date": "datetime64[ns]"
+}
+
+# Kinds of numpy arrays that are passed as they are, without missing values
+_ARRAY_KINDS = "iub"
+
+def dataframe_fields(dataframe):
+    """Return :class:`FieldList` describing columns of pandas `dataframe`. Storage types are
+    derived from column dtypes, types of object columns are inferred from their values. Concrete
+    storage type is the dtype name."""
+    fields = FieldList()
+    for name in dataframe.columns:
+        series = dataframe[name]
+        types = _dtype_kind_types.get(series.dtype.kind)
+        if types is None:
+            inferred = pandas.api.types.infer_dtype(numpy.asarray(series), skipna=True)
+            types = _inferred_types.get(inferred, ("unknown", "typeless"))
+
+        (storage_type, analytical_type) = types
+        fields.append(Field(unicode(name), storage_type=storage_type,
+                            analytical_type=analytical_type,
+                            concrete_storage_type=str(series.dtype)))
+    return fields
+
+def _chunk_values(values):
+    """Return column chunk of batch: numpy array `values` if they can be passed as they are,
+    otherwise list of python values with ``None`` for missing values (NaN, NaT)."""
+    kind = values.dtype.kind
+    if kind in _ARRAY_KINDS:
+        return values
+    elif kind == "f":
+        missing = numpy.isnan(values)
+        if not missing.any():
+            return values
+    elif kind == "M":
+        # Python datetime objects, NaT is converted to None
+        return values.astype("datetime64[us]").tolist()
+    elif kind == "m":
+        return values.astype("timedelta64[us]").tolist()
+    else:
+        missing = pandas.isnull(values)
+
+    result = values.tolist()
+    for index in numpy.flatnonzero(missing):
+        result[index] = None
+    return result
+
+class DataFrameDataSource(base.DataSource):
+    """Reads rows of a pandas data frame."""
+
+    def __init__(self, dataframe, fields=None, chunk_size=10000):
+        """Creates a data frame data source.
+
+        :Attributes:
+            * `dataframe`: pandas data frame
+            * `fields`: fields of the source, names of data frame columns to be read. Default
+              are :func:`dataframe_fields` of all columns of the data frame
+            * `chunk_size`: number of rows of one batch, default is 10000
+
+        Rows are read in the data frame order, the index is not read. Missing values (NaN, NaT)
+        are read as ``None``.
+        """
+        super(DataFrameDataSource, self).__init__()
+        self.dataframe = dataframe
+        self.fields = fields
+        self.chunk_size = chunk_size
+        self._labels = None
+
+    def initialize(self):
+        if self.fields:
+            self.fields = FieldList(self.fields)
+            self._labels = self.fields.names()
+        else:
+            # Column labels might be other than strings
+            self.fields = dataframe_fields(self.dataframe)
+            self._labels = list(self.dataframe.columns)
+
+    def batches(self):
+        """Return iterator of :class:`RecordBatch` objects of at most `chunk_size` rows.
+        Integer, boolean and float columns without missing values are slices of the data frame
+        columns."""
+        columns = [numpy.asarray(self.dataframe[label]) for label in self._labels]
+        length = len(self.dataframe)
+
+        for start in xrange(0, length, self.chunk_size):
+            end = min(start + self.chunk_size, length)
+            chunk = [_chunk_values(column[start:end]) for column in columns]
+            yield RecordBatch(self.fields, chunk, length=end - start)
+
+    def rows(self):
+        for batch in self.batches():
+            for row in batch:
+                yield row
+
+    def records(self):
+        names = self.fields.names()
+        for row in self.rows():
+            yield dict(zip(names, row))
+
+    def finalize(self):
+        pass
+
+class DataFrameDataTarget(base.DataTarget):
+    """Collects rows into a pandas data frame, available as `dataframe` after `finalize()`."""
+
+    def __init__(self, fields=None, chunk_size=10000):
+        """Creates a data frame data target.
+
+        :Attributes:
+            * `fields`: fields of appended rows, columns of the data frame
+            * `chunk_size`: number of rows collected by `append()` before they are converted
+              into columns, default is 10000
+
+        Numeric columns are kept as numpy arrays, one for each chunk, which are joined into the
+        data frame columns. Column dtypes follow field storage types, columns with ``None``
+        values or values that do not match the storage type get the dtype inferred by pandas.
+        """
+        super(DataFrameDataTarget, self).__init__()
+        self.fields = fields
+        self.chunk_size = chunk_size
+        self.dataframe = None
+        self._rows = []
+        self._chunks = None
+
+    def initialize(self):
+        if not self.fields:
+            raise ValueError("Fields are not initialized")
+        self.fields = FieldList(self.fields)
+        self._rows = []
+        self._chunks = [[] for field in self.fields]
+
+    def append(self, obj):
+        if type(obj) == dict:
+            obj = [obj.get(name) for name in self.fields.names()]
+        self._rows.append(obj)
+        if len(self._rows) >= self.chunk_size:
+            self._flush()
+
+    def append_batch(self, batch):
+        """Append :class:`RecordBatch`. Numeric columns are stored as numpy arrays, numpy
+        columns of the batch are not copied."""
+        self._flush()
+        for (index, chunks) in enumerate(self._chunks):
+            values = batch.numeric_array(index)
+            if values is None:
+                values = batch.column(index)
+            chunks.append(values)
+
+    def _flush(self):
+        if self._rows:
+            rows = self._rows
+            self._rows = []
+            self.append_batch(RecordBatch.from_rows(self.fields, rows))
+
+    def _series(self, field, chunks):
+        """Return data frame column of `field` from list of value `chunks`."""
+        if chunks and all(isinstance(chunk, numpy.ndarray) for chunk in chunks):
+            return pandas.Series(numpy.concatenate(chunks), name=field.name)
+
+        values = list(itertools.chain.from_iterable(chunk.tolist()
+                                                    if isinstance(chunk, numpy.ndarray)
+                                                    else chunk
+                                                    for chunk in chunks))
+        dtype = _storage_dtypes.get(field.storage_type)
+        if dtype is not None and None not in values:
+            try:
+                return pandas.Series(values, dtype=dtype, name=field.name)
+            except (TypeError, ValueError, OverflowError):
+                pass
+        return pandas.Series(values, name=field.name)
+
+    def finalize(self):
+        if self._chunks is None:
+            return
+        self._flush()
+
+        columns = [self._series(field, chunks)
+                   for (field, chunks) in zip(self.fields, self._chunks)]
+        self._chunks = None
+
+        names = self.fields.names()
+        self.dataframe = pandas.DataFrame(dict(zip(names, columns)), columns=names)
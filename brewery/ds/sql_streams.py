@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import ast
 import base
+import copy
+import hashlib
 import brewery.metadata
 
 try:
@@ -54,8 +57,10 @@ def split_table_schema(table_name):
 class SQLContext(object):
     """Holds context of SQL store operations."""
 
-    def __init__(self, url=None, connection=None, schema=None):
-        """Creates a SQL context"""
+    def __init__(self, url=None, connection=None, schema=None, metadata_cache=None):
+        """Creates a SQL context. If `metadata_cache` (:class:`brewery.cache.MetadataCache`)
+        is specified, reflected tables are stored in the cache and reused while the table
+        definition does not change."""
 
         if not url and not connection:
             raise AttributeError("Either url or connection should be provided" \
@@ -74,6 +79,7 @@ class SQLContext(object):
         self.metadata = sqlalchemy.MetaData()
         self.metadata.bind = self.connection.engine
         self.schema = schema
+        self.metadata_cache = metadata_cache
 
     def close(self):
         if self.should_close and self.connection:
@@ -82,9 +88,64 @@ class SQLContext(object):
     def table(self, name, autoload=True):
         """Get table by name"""
 
+        if autoload and self.metadata_cache is not None:
+            return self._cached_table(name)
+
         return sqlalchemy.Table(name, self.metadata,
                                 autoload=autoload, schema=self.schema)
 
+    def _cached_table(self, name):
+        """Get reflected table from the metadata cache or reflect it and store it in the
+        cache."""
+
+        fingerprint = table_fingerprint(self.connection, name, self.schema)
+        if fingerprint is None:
+            return sqlalchemy.Table(name, self.metadata, autoload=True, schema=self.schema)
+
+        key = ("sql_table", str(self.connection.engine.url), self.schema, name)
+        metadata = self.metadata_cache.get(key, fingerprint)
+        if metadata is not None:
+            table = metadata.tables.values()[0]
+            return table.tometadata(self.metadata)
+
+        table = sqlalchemy.Table(name, self.metadata, autoload=True, schema=self.schema)
+
+        # Tables are stored with their own unbound metadata, which is pickled with them
+        metadata = sqlalchemy.MetaData()
+        table.tometadata(metadata)
+        self.metadata_cache.set(key, fingerprint, metadata)
+
+        return table
+
+def table_fingerprint(connection, table, schema=None):
+    """Return hash of definition of `table` read by a single query: the ``CREATE`` statement
+    in SQLite or column descriptions from ``information_schema`` in PostgreSQL, MySQL and MS
+    SQL. Returns ``None`` for other databases or if the table does not exist."""
+
+    dialect = connection.dialect.name
+    text = sqlalchemy.sql.text
+
+    if dialect == "sqlite":
+        master = "%s.sqlite_master" % schema if schema else "sqlite_master"
+        query = text("SELECT sql FROM %s WHERE type = 'table' AND name = :name" % master)
+        rows = connection.execute(query, name=table).fetchall()
+    elif dialect in ("postgresql", "mysql", "mssql"):
+        statement = "SELECT column_name, data_type, is_nullable, column_default " \
+                    "FROM information_schema.columns WHERE table_name = :name"
+        params = {"name": table}
+        if schema:
+            statement += " AND table_schema = :schema"
+            params["schema"] = schema
+        statement += " ORDER BY ordinal_position"
+        rows = connection.execute(text(statement), **params).fetchall()
+    else:
+        return None
+
+    if not rows:
+        return None
+
+    return hashlib.sha1(repr([tuple(row) for row in rows])).hexdigest()
+
 def fields_from_table(table):
     """Get fields from a table. Field types are normalized to the Brewery
     data types. Analytical type is set according to a default conversion
@@ -131,12 +192,174 @@ def concrete_storage_type(field, type_map={}):
 
     return concrete_type
 
+def _condition_column(name, columns):
+    if columns is None:
+        return sqlalchemy.sql.column(name)
+    try:
+        return columns[name]
+    except KeyError:
+        raise ValueError("Condition refers to unknown column '%s'" % name)
+
+def _condition_literal(node):
+    """Return python value of literal expression `node`. Raises `TypeError` if the node is not a
+    literal."""
+    if isinstance(node, ast.Num):
+        return node.n
+    elif isinstance(node, ast.Str):
+        return node.s
+    elif isinstance(node, ast.Name) and node.id in ("None", "True", "False"):
+        return {"None": None, "True": True, "False": False}[node.id]
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) \
+            and isinstance(node.operand, ast.Num):
+        return -node.operand.n
+    elif isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+        return [_condition_literal(element) for element in node.elts]
+    raise TypeError("Not a literal")
+
+def _is_condition_column(node):
+    return isinstance(node, ast.Name) and node.id not in ("None", "True", "False")
+
+# Operator with column on the right side -> operator with column on the left side
+_swapped_operators = {
+    ast.Eq: ast.Eq, ast.NotEq: ast.NotEq,
+    ast.Lt: ast.Gt, ast.LtE: ast.GtE,
+    ast.Gt: ast.Lt, ast.GtE: ast.LtE
+}
+
+def _sql_in_clause(column, values, negate):
+    """Return clause equivalent to python ``value in values`` or ``value not in values``."""
+    values = list(values)
+    has_null = None in values
+    values = [value for value in values if value is not None]
+
+    if not negate:
+        clauses = [column.in_(values)] if values else []
+        if has_null:
+            clauses.append(column.is_(None))
+        if not clauses:
+            return sqlalchemy.sql.false()
+        return sqlalchemy.or_(*clauses)
+    else:
+        if has_null:
+            clause = column.isnot(None)
+            if values:
+                clause = sqlalchemy.and_(clause, column.notin_(values))
+            return clause
+        if not values:
+            return sqlalchemy.sql.true()
+        return sqlalchemy.or_(column.notin_(values), column.is_(None))
+
+def _sql_comparison(name, op, value, columns):
+    """Return clause for comparison of column `name` with literal `value` that matches the same
+    rows as python comparison would. In python 2 ``None`` is less than any other value, however
+    comparison with ``NULL`` in SQL is never true, therefore ``NULL`` is included explicitly where
+    python would evaluate the comparison to ``True``."""
+
+    column = _condition_column(name, columns)
+
+    if isinstance(op, (ast.In, ast.NotIn)):
+        if not isinstance(value, list):
+            raise TypeError("Right side of 'in' is not a literal sequence")
+        return _sql_in_clause(column, value, isinstance(op, ast.NotIn))
+
+    if isinstance(value, list):
+        raise TypeError("Comparison with a sequence")
+
+    if value is None:
+        if isinstance(op, (ast.Eq, ast.Is)):
+            return column.is_(None)
+        elif isinstance(op, (ast.NotEq, ast.IsNot)):
+            return column.isnot(None)
+        raise TypeError("Ordering comparison with None")
+
+    if isinstance(op, ast.Eq):
+        return column == value
+    elif isinstance(op, ast.Gt):
+        return column > value
+    elif isinstance(op, ast.GtE):
+        return column >= value
+    elif isinstance(op, ast.NotEq):
+        clause = column != value
+    elif isinstance(op, ast.Lt):
+        clause = column < value
+    elif isinstance(op, ast.LtE):
+        clause = column <= value
+    else:
+        raise TypeError("Unsupported comparison operator")
+
+    return sqlalchemy.or_(clause, column.is_(None))
+
+def _sql_clause(node, columns):
+    if isinstance(node, ast.BoolOp):
+        clauses = [_sql_clause(value, columns) for value in node.values]
+        if isinstance(node.op, ast.And):
+            return sqlalchemy.and_(*clauses)
+        else:
+            return sqlalchemy.or_(*clauses)
+
+    if not isinstance(node, ast.Compare):
+        raise TypeError("Unsupported expression")
+
+    clauses = []
+    left = node.left
+    for (op, right) in zip(node.ops, node.comparators):
+        if _is_condition_column(left) and not _is_condition_column(right):
+            clause = _sql_comparison(left.id, op, _condition_literal(right), columns)
+        elif _is_condition_column(right) and not _is_condition_column(left) \
+                and type(op) in _swapped_operators:
+            op = _swapped_operators[type(op)]()
+            clause = _sql_comparison(right.id, op, _condition_literal(left), columns)
+        else:
+            raise TypeError("Comparison should be between a field and a literal")
+        clauses.append(clause)
+        left = right
+
+    if len(clauses) == 1:
+        return clauses[0]
+    return sqlalchemy.and_(*clauses)
+
+def sql_condition(expression, columns=None):
+    """Translate python `expression` – such as :class:`SelectNode` condition – into SQLAlchemy
+    clause selecting the same rows. Returns ``None`` if the expression can not be translated.
+
+    Supported are comparisons of a field with a literal (``==``, ``!=``, ``<``, ``<=``, ``>``,
+    ``>=``, ``is None``, ``is not None``), ``in`` and ``not in`` with a literal list, tuple or
+    set, and their combinations with ``and`` and ``or``. ``not``, arithmetic, function calls and
+    comparisons between fields are not translated.
+
+    `columns` is a dictionary-like object of table columns, such as ``table.columns``. If it is
+    ``None``, columns are referenced by name only, which is useful for checking whether the
+    expression can be translated. `ValueError` is raised when the expression refers to a column
+    that is not in `columns`.
+
+    .. note::
+
+        Values are compared by the database, collation and type coercion of the database apply.
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError:
+        return None
+
+    try:
+        return _sql_clause(tree.body, columns)
+    except TypeError:
+        return None
+
+def sql_set_condition(field, values, discard=False, columns=None):
+    """Return SQLAlchemy clause selecting rows where `field` value is in `values` (as
+    :class:`SetSelectNode` does) or not in `values` if `discard` is ``True``. `columns` is the same
+    as in :func:`sql_condition`."""
+    column = _condition_column(field, columns)
+    return _sql_in_clause(column, values, discard)
+
 class SQLDataSource(base.DataSource):
     """docstring for ClassName
     """
     def __init__(self, connection=None, url=None,
                     table=None, statement=None, schema=None, autoinit = True,
-                    **options):
+                    condition=None, projection=None, limit=None, aggregation=None,
+                    metadata_cache=None, **options):
         """Creates a relational database data source stream.
 
         :Attributes:
@@ -144,6 +367,19 @@ class SQLDataSource(base.DataSource):
             * connection: SQLAlchemy database connection - either this or url should be specified
             * table: table name
             * statement: SQL statement to be used as a data source (not supported yet)
+            * condition: SQLAlchemy clause used as ``WHERE`` condition, only matching rows are
+              read from the table
+            * projection: list of names of columns to be read, other columns are not selected.
+              Default is ``None`` - all columns are read
+            * limit: maximal number of rows to be read, default is ``None`` - no limit
+            * aggregation: dictionary describing aggregation computed by the database with
+              ``GROUP BY`` query, rows and fields are the same as output of
+              :class:`AggregateNode`. Keys: ``keys`` - list of columns to group by, ``measures``
+              - list of columns to be aggregated, ``record_count_field`` - name of the count
+              field (default is ``record_count``) and ``rename`` - dictionary of output names of
+              key and measure columns. Groups are in no particular order.
+            * metadata_cache: :class:`brewery.cache.MetadataCache` where reflected table is
+              stored, so the table is not reflected again while its definition is the same
             * autoinit: initialize on creation, no explicit initialize() is
               needed
             * options: SQL alchemy connect() options
@@ -169,6 +405,12 @@ class SQLDataSource(base.DataSource):
         self.statement = statement
         self.schema = schema
         self.options = options
+        self.condition = condition
+        self.projection = projection
+        self.limit = limit
+        self.aggregation = aggregation
+        self.metadata_cache = metadata_cache
+        self._aggregated = False
 
         self.context = None
         self.table = None
@@ -182,11 +424,18 @@ class SQLDataSource(base.DataSource):
         they are read from the table.
         """
         if not self.context:
-            self.context = SQLContext(self.url, self.connection, self.schema)
+            self.context = SQLContext(self.url, self.connection, self.schema,
+                                      self.metadata_cache)
         if self.table is None:
             self.table = self.context.table(self.table_name)
         if not self.fields:
             self.read_fields()
+        if self.projection is not None:
+            fields = [field for field in self.fields if field.name in self.projection]
+            self.fields = brewery.metadata.FieldList(fields)
+        if self.aggregation is not None and not self._aggregated:
+            self.fields = self._aggregated_fields(self.fields)
+            self._aggregated = True
         self.field_names = self.fields.names()
 
     def finalize(self):
@@ -196,10 +445,72 @@ class SQLDataSource(base.DataSource):
         self.fields = fields_from_table(self.table)
         return self.fields
 
+    def _aggregated_fields(self, fields):
+        rename = self.aggregation.get("rename") or {}
+
+        renamed = brewery.metadata.FieldList()
+        for field in fields:
+            if field.name in rename:
+                field = copy.copy(field)
+                field.name = rename[field.name]
+            renamed.append(field)
+
+        keys = [rename.get(name, name) for name in self.aggregation.get("keys") or []]
+        measures = [rename.get(name, name) for name in self.aggregation.get("measures") or []]
+        count_field = self.aggregation.get("record_count_field", "record_count")
+
+        return brewery.metadata.aggregated_fields(renamed, keys, measures, count_field)
+
+    def select_statement(self, names=None):
+        """Return ``SELECT`` statement of rows read by the source. `names` is list of names of
+        output fields to be selected in that order, default is all fields."""
+
+        if self.aggregation is not None:
+            (selection, keys) = self._aggregation_selection()
+        elif self.projection is not None:
+            selection = [self.table.columns[name] for name in self.field_names]
+            keys = None
+        else:
+            selection = list(self.table.columns)
+            keys = None
+
+        if names is not None:
+            columns = dict(zip(self.field_names, selection))
+            selection = [columns[name] for name in names]
+
+        statement = sqlalchemy.sql.select(selection, from_obj=self.table)
+        if keys:
+            statement = statement.group_by(*keys)
+        elif keys is not None:
+            # Aggregation of no rows produces no output
+            statement = statement.having(sqlalchemy.sql.func.count() > 0)
+
+        if self.condition is not None:
+            statement = statement.where(self.condition)
+        if self.limit is not None:
+            statement = statement.limit(self.limit)
+
+        return statement
+
+    def _aggregation_selection(self):
+        """Return tuple (`selection`, `keys`) of aggregation query: selected expressions in order
+        of output fields and columns to group by."""
+        columns = self.table.columns
+        func = sqlalchemy.sql.func
+
+        keys = [columns[name] for name in self.aggregation.get("keys") or []]
+        selection = list(keys)
+        for name in self.aggregation.get("measures") or []:
+            column = columns[name]
+            selection += [func.sum(column), func.min(column), func.max(column), func.avg(column)]
+        selection.append(func.count())
+
+        return (selection, keys)
+
     def rows(self):
         if not self.context:
             raise RuntimeError("Stream is not initialized")
-        return self.table.select().execute()
+        return self.select_statement().execute()
 
     def records(self):
         if not self.context:
@@ -217,7 +528,7 @@ class SQLDataTarget(base.DataTarget):
                     create=False, replace=False,
                     add_id_key=False, id_key_name=None,
                     buffer_size=None, fields=None, concrete_type_map=None,
-                    **options):
+                    metadata_cache=None, **options):
         """Creates a relational database data target stream.
 
         :Attributes:
@@ -235,6 +546,8 @@ class SQLDataTarget(base.DataTarget):
             * buffer_size: size of INSERT buffer - how many records are collected before they are
               inserted using multi-insert statement. Default is 1000
             * fields : fieldlist for a new table
+            * metadata_cache: :class:`brewery.cache.MetadataCache` where reflected table is
+              stored, see :class:`SQLDataSource`
 
         Note: avoid auto-detection when you are reading from remote URL stream.
 
@@ -256,6 +569,7 @@ class SQLDataTarget(base.DataTarget):
         self.fields = fields
 
         self.concrete_type_map = concrete_type_map
+        self.metadata_cache = metadata_cache
 
         if id_key_name:
             self.id_key_name = id_key_name
@@ -273,7 +587,8 @@ class SQLDataTarget(base.DataTarget):
 
         self.context = SQLContext(url=self.url,
                                   connection=self.connection,
-                                  schema=self.schema)
+                                  schema=self.schema,
+                                  metadata_cache=self.metadata_cache)
 
         if self.create:
             self.table = self._create_table()
@@ -343,6 +658,9 @@ class SQLDataTarget(base.DataTarget):
     def append(self, obj):
         if type(obj) == dict:
             record = obj
+        elif isinstance(obj, brewery.metadata.RecordView):
+            # SQLAlchemy reads insert parameters faster from a dictionary
+            record = obj.to_dict()
         else:
             record = dict(zip(self.field_names, obj))
 
@@ -350,6 +668,15 @@ class SQLDataTarget(base.DataTarget):
         if len(self._buffer) >= self.buffer_size:
             self._flush()
 
+    def insert_select(self, statement):
+        """Insert rows selected by `statement` into the table with ``INSERT ... SELECT``
+        executed by the database. Selected columns are inserted into fields of the target in
+        their order. Returns number of inserted rows if the database reports it."""
+
+        self._flush()
+        insert = self.table.insert().from_select(self.field_names, statement)
+        return insert.execute().rowcount
+
     def _flush(self):
         if len(self._buffer) > 0:
             self.context.connection.execute(self.insert_command, self._buffer)
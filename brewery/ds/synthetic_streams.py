@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import base
+import bisect
+import datetime
+import random
+import string
+from brewery.metadata import FieldList
+from brewery.batches import RecordBatch
+
+class SyntheticDataSource(base.DataSource):
+    """Generates random rows according to field list and per-field distributions."""
+
+    def __init__(self, fields=None, count=1000, distributions=None, seed=None,
+                 batch_size=10000):
+        """Creates a synthetic data source.
+
+        Values are generated column by column in batches of `batch_size` rows, which makes the
+        source cheap per row. The same `seed`, `count` and `batch_size` produce the same rows.
+
+        :Attributes:
+            * `fields`: field list of generated rows. Storage types ``integer``, ``float``,
+              ``boolean``, ``date``, ``string`` and ``text`` are supported
+            * `count`: number of generated rows, default is 1000
+            * `distributions`: dictionary where keys are field names and values are dictionaries
+              describing field values (see below)
+            * `seed`: random seed
+            * `batch_size`: number of rows generated at once, default is 10000
+
+        Distribution of a field is a dictionary with keys:
+
+            * ``distribution``: ``uniform`` (default), ``zipf`` – categorical values where the
+              k-th most frequent value has frequency proportional to 1/k^``exponent``, or
+              ``sequence`` – integers from ``min``
+            * ``min``, ``max``: value range of numbers and dates, defaults are 0 and 1000 for
+              integers, 0.0 and 1.0 for floats, 2000-01-01 and 2020-12-31 for dates
+            * ``values``: list of categorical values
+            * ``cardinality``: number of distinct values if ``values`` are not specified –
+              strings are taken uniformly or zipf-like from a pool of this size and so are
+              numbers of ``zipf`` distribution. Default is 100
+            * ``exponent``: exponent of ``zipf`` distribution, default is 1.0
+            * ``length``: length of generated strings, integer or tuple (`min`, `max`), default
+              is 10
+            * ``null_ratio``: ratio of ``None`` values, default is 0.0
+        """
+        super(SyntheticDataSource, self).__init__()
+        self.fields = fields
+        self.count = count
+        self.distributions = distributions or {}
+        self.seed = seed
+        self.batch_size = batch_size
+
+        self._generators = None
+
+    def initialize(self):
+        if not self.fields:
+            raise ValueError("Fields are not initialized")
+
+        self.fields = FieldList(self.fields)
+        self.random = random.Random(self.seed)
+        self._generators = []
+
+        for field in self.fields:
+            spec = self.distributions.get(field.name, {})
+            self._generators.append(self._column_generator(field, spec))
+
+    def _column_generator(self, field, spec):
+        """Return function that gets number of values and returns list of values of `field`
+        according to the distribution `spec`."""
+
+        rng = self.random
+        rand = rng.random
+        storage_type = field.storage_type
+        distribution = spec.get("distribution", "uniform")
+        null_ratio = spec.get("null_ratio", 0.0)
+
+        if distribution == "sequence":
+            state = {"next": spec.get("min", 0)}
+
+            def generate(count):
+                start = state["next"]
+                state["next"] = start + count
+                return range(start, start + count)
+
+        elif distribution == "zipf" or "values" in spec \
+                or storage_type in ("string", "text", "unknown", None):
+            values = self._categorical_values(field, spec)
+            if distribution == "zipf":
+                exponent = spec.get("exponent", 1.0)
+                cumulative = []
+                total = 0.0
+                for k in range(len(values)):
+                    total += 1.0 / (k + 1) ** exponent
+                    cumulative.append(total)
+                last = len(values) - 1
+
+                def generate(count):
+                    return [values[min(bisect.bisect(cumulative, rand() * total), last)]
+                            for i in xrange(count)]
+
+            elif distribution == "uniform":
+                size = len(values)
+
+                def generate(count):
+                    return [values[int(rand() * size)] for i in xrange(count)]
+
+            else:
+                raise ValueError("Unknown distribution '%s' of field '%s'"
+                                 % (distribution, field.name))
+
+        elif distribution != "uniform":
+            raise ValueError("Unknown distribution '%s' of field '%s'"
+                             % (distribution, field.name))
+
+        elif storage_type == "integer":
+            minimum = spec.get("min", 0)
+            span = spec.get("max", 1000) - minimum + 1
+
+            def generate(count):
+                return [minimum + int(rand() * span) for i in xrange(count)]
+
+        elif storage_type == "float":
+            minimum = spec.get("min", 0.0)
+            span = spec.get("max", 1.0) - minimum
+
+            def generate(count):
+                return [minimum + rand() * span for i in xrange(count)]
+
+        elif storage_type == "boolean":
+            def generate(count):
+                return [rand() < 0.5 for i in xrange(count)]
+
+        elif storage_type == "date":
+            minimum = spec.get("min", datetime.date(2000, 1, 1)).toordinal()
+            span = spec.get("max", datetime.date(2020, 12, 31)).toordinal() - minimum + 1
+            fromordinal = datetime.date.fromordinal
+
+            def generate(count):
+                return [fromordinal(minimum + int(rand() * span)) for i in xrange(count)]
+
+        else:
+            raise ValueError("Can not generate values of storage type '%s' (field '%s')"
+                             % (storage_type, field.name))
+
+        if not null_ratio:
+            return generate
+
+        def generate_nullable(count):
+            return [None if rand() < null_ratio else value for value in generate(count)]
+
+        return generate_nullable
+
+    def _categorical_values(self, field, spec):
+        """Return list of distinct values of a categorical field."""
+        if "values" in spec:
+            return list(spec["values"])
+
+        rng = self.random
+        cardinality = spec.get("cardinality", 100)
+        storage_type = field.storage_type
+
+        if storage_type == "integer":
+            minimum = spec.get("min", 0)
+            return range(minimum, minimum + cardinality)
+        elif storage_type == "float":
+            minimum = spec.get("min", 0.0)
+            span = spec.get("max", 1.0) - minimum
+            return [minimum + rng.random() * span for i in range(cardinality)]
+        elif storage_type == "boolean":
+            return [True, False]
+        elif storage_type == "date":
+            start = spec.get("min", datetime.date(2000, 1, 1))
+            return [start + datetime.timedelta(i) for i in range(cardinality)]
+
+        length = spec.get("length", 10)
+        if isinstance(length, (list, tuple)):
+            (min_length, max_length) = length
+        else:
+            min_length = max_length = length
+
+        letters = string.ascii_lowercase
+        values = []
+        for i in range(cardinality):
+            size = rng.randint(min_length, max_length)
+            values.append(u"".join(rng.choice(letters) for j in range(size)))
+
+        return values
+
+    def finalize(self):
+        pass
+
+    def batches(self):
+        """Return iterator of :class:`brewery.batches.RecordBatch` objects of at most
+        `batch_size` rows. Values are generated by columns and kept in columns."""
+        if self._generators is None:
+            raise Exception("Data source is not initialized")
+
+        remaining = self.count
+        while remaining > 0:
+            size = min(remaining, self.batch_size)
+            columns = [generate(size) for generate in self._generators]
+            yield RecordBatch(self.fields, columns, length=size)
+            remaining -= size
+
+    def rows(self):
+        for batch in self.batches():
+            for row in batch:
+                yield row
+
+    def records(self):
+        names = self.fields.names()
+        for row in self.rows():
+            yield dict(zip(names, row))
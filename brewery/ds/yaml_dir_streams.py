@@ -5,6 +5,7 @@ import base
 import string
 import os
 import shutil
+import brewery.metadata
 
 try:
     import yaml
@@ -123,6 +124,8 @@ class YamlDirectoryDataTarget(base.DataTarget):
 
         if type(obj) == dict:
             record = obj
+        elif isinstance(obj, brewery.metadata.RecordView):
+            record = obj.to_dict()
         else:
             record = dict(zip(self.fields.names(), obj))
 
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Utilities for python expressions used in nodes, such as :class:`SelectNode` conditions or
+:class:`DeriveNode` formulas."""
+
+import ast
+import __builtin__
+from brewery.utils import MissingPackage
+
+try:
+    import numpy
+except ImportError:
+    numpy = MissingPackage("numpy", "Vectorized expressions", "http://numpy.scipy.org/")
+
+__all__ = (
+    "expression_names",
+    "compile_row_expression",
+    "compile_vector_expression",
+    "VectorExpression"
+)
+
+_ROW_ARGUMENT = "__row"
+_COLUMNS_ARGUMENT = "__columns"
+_NUMPY_NAME = "__numpy"
+
+def expression_names(expression):
+    """Return set of variable names used in a python `expression` string. Expressions in nodes
+    are evaluated with record fields as variables, therefore the names are field names the
+    expression might read. Names of builtins or of variables bound inside the expression (such as
+    in a list comprehension) are included as well, so the result is a superset of the fields
+    actually read. Returns ``None`` if the expression can not be parsed."""
+
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError:
+        return None
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+
+    return names
+
+class _FieldAccessTransformer(ast.NodeTransformer):
+    """Replaces variables with field names by item access of the row argument."""
+
+    def __init__(self, indexes):
+        super(_FieldAccessTransformer, self).__init__()
+        self.indexes = indexes
+
+    def visit_Name(self, node):
+        if node.id not in self.indexes:
+            return node
+        access = ast.Subscript(value=ast.Name(id=_ROW_ARGUMENT, ctx=ast.Load()),
+                               slice=ast.Index(value=ast.Num(n=self.indexes[node.id])),
+                               ctx=ast.Load())
+        return ast.copy_location(access, node)
+
+def compile_row_expression(expression, field_names, label="expression", flags=0):
+    """Compile python `expression` string into a function of one argument: a row – list or
+    tuple of values in order of `field_names`. The function returns value of the expression
+    evaluated with field values as variables, as `eval()` of the expression with a record
+    dictionary would, without creating the dictionary for each row. `label` is used as file name
+    in tracebacks, `flags` are passed to `compile()`. Future statements of the calling module are
+    not inherited, so by default the expression has the same meaning as when it is evaluated
+    with `eval()`, for example ``/`` of integers is integer division.
+
+    Returns ``None`` if the expression assigns to a variable with a field name, for example in a
+    list comprehension, and can not be compiled. Raises `SyntaxError` if the expression is not
+    valid."""
+
+    tree = ast.parse(expression.strip(), label, "eval")
+    indexes = dict((name, index) for (index, name) in enumerate(field_names))
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in indexes \
+                and not isinstance(node.ctx, ast.Load):
+            return None
+        if isinstance(node, ast.Name) and node.id == _ROW_ARGUMENT:
+            return None
+
+    body = _FieldAccessTransformer(indexes).visit(tree.body)
+    arguments = ast.arguments(args=[ast.Name(id=_ROW_ARGUMENT, ctx=ast.Param())],
+                              vararg=None, kwarg=None, defaults=[])
+    function = ast.Expression(body=ast.Lambda(args=arguments, body=body))
+    ast.fix_missing_locations(function)
+
+    code = compile(function, label, "eval", flags, True)
+    return eval(code, {"__builtins__": __builtin__})
+
+
+# Operators that numpy arrays evaluate as python does for numbers
+_VECTOR_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+_VECTOR_UNARY_OPERATORS = (ast.UAdd, ast.USub)
+_VECTOR_COMPARISONS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+_VECTOR_FUNCTIONS = {"abs": "absolute"}
+
+# Largest absolute value of integers evaluated by numpy as 64 bit numbers
+_MAX_VECTOR_INTEGER = 2 ** 63 - 1
+
+class _NotVectorizable(Exception):
+    pass
+
+def _integer_bound(node, bounds):
+    """Return upper bound of absolute value of the result of expression tree `node` if it
+    evaluates to integers, otherwise ``None``. `bounds` is a dictionary from field name to upper
+    bound of absolute values of the integer field, fields that are not in `bounds` are floats.
+    Raises `OverflowError` if an integer result, or an intermediate one, might not fit into 64
+    bits."""
+    if isinstance(node, ast.Num):
+        bound = abs(node.n) if isinstance(node.n, (int, long)) else None
+    elif isinstance(node, ast.Name):
+        bound = bounds.get(node.id)
+    elif isinstance(node, ast.BinOp):
+        left = _integer_bound(node.left, bounds)
+        right = _integer_bound(node.right, bounds)
+        if left is None or right is None:
+            return None
+        elif isinstance(node.op, (ast.Add, ast.Sub)):
+            bound = left + right
+        elif isinstance(node.op, ast.Mult):
+            bound = left * right
+        elif isinstance(node.op, (ast.Div, ast.FloorDiv)):
+            bound = left
+        elif isinstance(node.op, ast.Mod):
+            bound = right
+        elif left <= 1:
+            bound = left
+        elif right < 64:
+            bound = left ** right
+        else:
+            raise OverflowError
+    elif isinstance(node, ast.UnaryOp):
+        bound = _integer_bound(node.operand, bounds)
+        if isinstance(node.op, ast.Not):
+            return None
+    elif isinstance(node, ast.Call):
+        bound = _integer_bound(node.args[0], bounds)
+    else:
+        # Comparisons and boolean operations
+        for child in ast.iter_child_nodes(node):
+            _integer_bound(child, bounds)
+        return None
+
+    if bound is not None and bound > _MAX_VECTOR_INTEGER:
+        raise OverflowError
+    return bound
+
+class _VectorTransformer(object):
+    """Translates expression tree into an expression over numpy arrays of columns. Only
+    arithmetic, comparisons and boolean operations on booleans are translated, other expressions
+    raise `_NotVectorizable`."""
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+        self.used_indexes = set()
+
+    def translate(self, node):
+        """Return tuple (`node`, `is_boolean`) with translated node and flag whether it evaluates
+        to booleans."""
+        method = getattr(self, "translate_" + node.__class__.__name__, None)
+        if not method:
+            raise _NotVectorizable
+        (translated, is_boolean) = method(node)
+        return (ast.copy_location(translated, node), is_boolean)
+
+    def numeric(self, node):
+        """Translate `node` which is an operand of arithmetic. Numpy operators on booleans are
+        logical, unlike python operators, therefore booleans are not accepted."""
+        (translated, is_boolean) = self.translate(node)
+        if is_boolean:
+            raise _NotVectorizable
+        return translated
+
+    def numpy_call(self, function, args):
+        numpy_function = ast.Attribute(value=ast.Name(id=_NUMPY_NAME, ctx=ast.Load()),
+                                       attr=function, ctx=ast.Load())
+        return ast.Call(func=numpy_function, args=args, keywords=[], starargs=None,
+                        kwargs=None)
+
+    def translate_Num(self, node):
+        if isinstance(node.n, complex):
+            raise _NotVectorizable
+        return (node, False)
+
+    def translate_Name(self, node):
+        if node.id in self.indexes:
+            index = self.indexes[node.id]
+            self.used_indexes.add(index)
+            access = ast.Subscript(value=ast.Name(id=_COLUMNS_ARGUMENT, ctx=ast.Load()),
+                                   slice=ast.Index(value=ast.Num(n=index)), ctx=ast.Load())
+            return (access, False)
+        elif node.id in ("True", "False"):
+            return (node, True)
+        raise _NotVectorizable
+
+    def translate_BinOp(self, node):
+        if not isinstance(node.op, _VECTOR_OPERATORS):
+            raise _NotVectorizable
+        left = self.numeric(node.left)
+        right = self.numeric(node.right)
+        return (ast.BinOp(left=left, op=node.op, right=right), False)
+
+    def translate_UnaryOp(self, node):
+        if isinstance(node.op, ast.Not):
+            (operand, is_boolean) = self.translate(node.operand)
+            return (self.numpy_call("logical_not", [operand]), True)
+        elif isinstance(node.op, _VECTOR_UNARY_OPERATORS):
+            return (ast.UnaryOp(op=node.op, operand=self.numeric(node.operand)), False)
+        raise _NotVectorizable
+
+    def translate_BoolOp(self, node):
+        # Python and/or return one of the operands, which is the same as the logical result only
+        # for boolean operands
+        operands = []
+        for value in node.values:
+            (operand, is_boolean) = self.translate(value)
+            if not is_boolean:
+                raise _NotVectorizable
+            operands.append(operand)
+
+        function = "logical_and" if isinstance(node.op, ast.And) else "logical_or"
+        result = operands[0]
+        for operand in operands[1:]:
+            result = self.numpy_call(function, [result, operand])
+        return (result, True)
+
+    def translate_Compare(self, node):
+        # Chained comparison a < b < c is (a < b) and (b < c)
+        operands = [self.translate(node.left)[0]]
+        for comparator in node.comparators:
+            operands.append(self.translate(comparator)[0])
+
+        result = None
+        for (i, op) in enumerate(node.ops):
+            if not isinstance(op, _VECTOR_COMPARISONS):
+                raise _NotVectorizable
+            comparison = ast.Compare(left=operands[i], ops=[op], comparators=[operands[i + 1]])
+            if result is None:
+                result = comparison
+            else:
+                result = self.numpy_call("logical_and", [result, comparison])
+        return (result, True)
+
+    def translate_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in _VECTOR_FUNCTIONS \
+                or node.func.id in self.indexes or len(node.args) != 1 or node.keywords \
+                or node.starargs or node.kwargs:
+            raise _NotVectorizable
+        argument = self.numeric(node.args[0])
+        return (self.numpy_call(_VECTOR_FUNCTIONS[node.func.id], [argument]), False)
+
+class VectorExpression(object):
+    """Expression evaluated over numpy arrays of columns of a
+    :class:`brewery.batches.RecordBatch`. Created by :func:`compile_vector_expression`.
+
+    :Attributes:
+        * `expression`: the expression string
+        * `indexes`: indexes of fields the expression reads
+    """
+
+    def __init__(self, expression, function, indexes, tree=None, names=None):
+        """`tree` is the parsed expression and `names` a dictionary from names of fields the
+        expression reads to their indexes, they are used to check that integer results fit into
+        64 bits."""
+        self.expression = expression
+        self.function = function
+        self.indexes = indexes
+        self.tree = tree
+        self.names = names or {}
+
+    def evaluate(self, batch):
+        """Return numpy array with value of the expression for each selected row of `batch`.
+        Returns ``None`` if a column the expression reads contains values that are not numbers,
+        integers mixed with floats, if an integer result might not fit into 64 bits or if the
+        evaluation fails, for example on division by zero. Evaluate the rows one by one in that
+        case, to get the python result or exception."""
+        columns = {}
+        for index in self.indexes:
+            array = batch.numeric_array(index)
+            if array is None:
+                return None
+            columns[index] = array
+
+        try:
+            if self.tree is not None:
+                bounds = {}
+                for (name, index) in self.names.items():
+                    array = columns[index]
+                    if array.dtype.kind not in "iu":
+                        continue
+                    bounds[name] = max(int(array.max()), -int(array.min())) if len(array) else 0
+                _integer_bound(self.tree, bounds)
+
+            with numpy.errstate(all="raise"):
+                result = self.function(columns)
+        except (ArithmeticError, ValueError):
+            return None
+
+        if numpy.shape(result) != (len(batch), ):
+            return None
+        return result
+
+def compile_vector_expression(expression, field_names, label="expression", flags=0):
+    """Compile python `expression` string into a :class:`VectorExpression` that evaluates the
+    expression for all rows of a record batch at once with numpy. Arguments are the same as for
+    :func:`compile_row_expression`.
+
+    Only expressions with arithmetic operators, comparisons, ``and``, ``or``, ``not`` of
+    comparisons and ``abs()`` of fields and numbers can be vectorized. Returns ``None`` for other
+    expressions, for expressions that do not read any field or if numpy is not installed.
+
+    Integers are evaluated as 64 bit numbers. Batches where an integer result might not fit,
+    judged by the largest absolute values of the integer columns, are not evaluated by
+    :meth:`VectorExpression.evaluate`, as well as batches with integers mixed with floats in a
+    column, which numpy would convert to floats."""
+
+    if isinstance(numpy, MissingPackage):
+        return None
+
+    tree = ast.parse(expression.strip(), label, "eval")
+    indexes = dict((name, index) for (index, name) in enumerate(field_names))
+
+    transformer = _VectorTransformer(indexes)
+    try:
+        (body, is_boolean) = transformer.translate(tree.body)
+    except _NotVectorizable:
+        return None
+
+    if not transformer.used_indexes:
+        return None
+
+    arguments = ast.arguments(args=[ast.Name(id=_COLUMNS_ARGUMENT, ctx=ast.Param())],
+                              vararg=None, kwarg=None, defaults=[])
+    function = ast.Expression(body=ast.Lambda(args=arguments, body=body))
+    ast.fix_missing_locations(function)
+
+    code = compile(function, label, "eval", flags, True)
+    function = eval(code, {"__builtins__": __builtin__, _NUMPY_NAME: numpy})
+    names = dict((name, index) for (name, index) in indexes.items()
+                 if index in transformer.used_indexes)
+    return VectorExpression(expression, function, sorted(transformer.used_indexes), tree.body,
+                            names)
@@ -7,13 +7,17 @@ import re
 __all__ = [
     "Field",
     "FieldList",
+    "RecordView",
+    "CompactRow",
+    "compact_row_type",
     "fieldlist", # FIXME remove this
     "expand_record",
     "collapse_record",
     "FieldMap",
     "storage_types",
     "analytical_types",
-    "coalesce_value"
+    "coalesce_value",
+    "aggregated_fields"
 ]
 
 """Abstracted field storage types"""
@@ -274,6 +278,16 @@ class FieldList(object):
 
         return tuple(indexes)
 
+    def index_map(self):
+        """Return a dictionary mapping field names to their indexes in a data row. The dictionary
+        is meant to be shared by :class:`RecordView` objects of rows with these fields."""
+        return dict((name, index) for (index, name) in enumerate(self._field_names))
+
+    def row_type(self):
+        """Return :class:`CompactRow` subclass for rows with fields of this list. The class is
+        shared by all field lists with the same field names."""
+        return compact_row_type(self._field_names)
+
     def selectors(self, fields = None):
         """Return a list representing field selector - which fields are
         selected from a row."""
@@ -376,6 +390,132 @@ class FieldList(object):
                 else:
                     raise Exception("Should not use retype to change field attribute '%s'", key)
 
+class RecordView(object):
+    """Read-only record (dictionary-like) view of a row. Field values are read from the row by
+    index found in `indexes` - a dictionary from :meth:`FieldList.index_map` shared by all views
+    of rows with the same fields. Creating a view is much cheaper than creating a dictionary
+    with the record.
+
+    .. code-block:: python
+
+        indexes = fields.index_map()
+        for row in rows:
+            record = RecordView(row, indexes)
+            print record["name"]
+
+    The view can be unpacked with ``**``, however python creates a dictionary in that case. Use
+    ``dict(zip(names, row))`` when the record is passed as keyword arguments anyway. Use
+    :meth:`to_dict` to get a dictionary that can be modified or kept after the row changes.
+    """
+
+    __slots__ = ("row", "indexes")
+
+    def __init__(self, row, indexes):
+        self.row = row
+        self.indexes = indexes
+
+    def __getitem__(self, name):
+        return self.row[self.indexes[name]]
+
+    def get(self, name, default=None):
+        index = self.indexes.get(name)
+        if index is None:
+            return default
+        return self.row[index]
+
+    def __contains__(self, name):
+        return name in self.indexes
+
+    def __iter__(self):
+        return iter(self.indexes)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def keys(self):
+        return self.indexes.keys()
+
+    def values(self):
+        return [self.row[index] for index in self.indexes.values()]
+
+    def items(self):
+        return [(name, self.row[index]) for (name, index) in self.indexes.items()]
+
+    def to_dict(self):
+        """Return record as a dictionary."""
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, RecordView):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "RecordView(%r)" % self.to_dict()
+
+class CompactRow(tuple):
+    """Immutable row stored as a tuple, which takes less memory than a list. Field names and the
+    name to index map are attributes of the class, shared by all rows of the class, therefore a
+    compact row is not bigger than a plain tuple. Use :meth:`FieldList.row_type` or
+    :func:`compact_row_type` to get the class for given fields:
+
+    .. code-block:: python
+
+        row_type = fields.row_type()
+        row = row_type(["Hello", 10])
+        print row.get("greeting")
+
+    Compact rows can not be modified. Nodes create new rows instead of modifying their input
+    rows, therefore compact rows can be passed through any node.
+    """
+
+    __slots__ = ()
+    field_names = ()
+    field_indexes = {}
+
+    def get(self, name, default=None):
+        """Return value of field `name` or `default` if there is no such field."""
+        index = self.field_indexes.get(name)
+        if index is None:
+            return default
+        return self[index]
+
+    def to_dict(self):
+        """Return record as a dictionary."""
+        return dict(zip(self.field_names, self))
+
+    def replace(self, values):
+        """Return new row with field values replaced by values from dictionary `values`."""
+        row = list(self)
+        for (name, value) in values.items():
+            row[self.field_indexes[name]] = value
+        return self.__class__(row)
+
+    def __reduce__(self):
+        return (_create_compact_row, (self.field_names, tuple(self)))
+
+_compact_row_types = {}
+
+def compact_row_type(names):
+    """Return :class:`CompactRow` subclass for rows with field `names`."""
+    names = tuple(names)
+    row_type = _compact_row_types.get(names)
+    if row_type is None:
+        indexes = dict((name, index) for (index, name) in enumerate(names))
+        row_type = type("CompactRow", (CompactRow, ), {"__slots__": (),
+                                                         "field_names": names,
+                                                         "field_indexes": indexes})
+        _compact_row_types[names] = row_type
+    return row_type
+
+def _create_compact_row(names, values):
+    return compact_row_type(names)(values)
+
 class FieldMap(object):
     """Filters fields in a stream"""
     def __init__(self, rename = None, drop = None, keep=None):
@@ -454,6 +594,27 @@ class RowFieldFilter(object):
         """Filter a `row` according to ``indexes``."""
         return list(itertools.compress(row, self.selectors))
 
+def aggregated_fields(fields, keys, measures, record_count_field="record_count"):
+    """Return :class:`FieldList` of aggregation output: `keys` fields from `fields` followed by
+    ``sum``, ``min``, ``max`` and ``average`` of each of `measures` and the record count field.
+    This is the output of :class:`AggregateNode`."""
+
+    # FIXME: use storage types based on aggregated field type
+    output = FieldList()
+
+    if keys:
+        for field in fields.fields(keys):
+            output.append(field)
+
+    for field in measures:
+        output.append(Field(field + "_sum", storage_type = "float", analytical_type = "range"))
+        output.append(Field(field + "_min", storage_type = "float", analytical_type = "range"))
+        output.append(Field(field + "_max", storage_type = "float", analytical_type = "range"))
+        output.append(Field(field + "_average", storage_type = "float", analytical_type = "range"))
+    output.append(Field(record_count_field, storage_type = "integer", analytical_type = "range"))
+
+    return output
+
 def coalesce_value(value, storage_type, empty_values=None, strip=False):
     """Coalesces `value` to given storage `type`. `empty_values` is a dictionary
     where keys are storage type names and values are values to be used
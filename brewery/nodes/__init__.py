@@ -36,13 +36,21 @@ __all__ = [
     "CSVSourceNode",
     "YamlDirectorySourceNode",
     "ESSourceNode",
+    "SyntheticSourceNode",
+    "ReplaySourceNode",
+    "DataFrameSourceNode",
+    "ArrowSourceNode",
+    "ParquetSourceNode",
     
     # Target nodes    
     "RowListTargetNode",
     "RecordListTargetNode",
     "StreamTargetNode",
     "FormattedPrinterNode",
-    "SQLTableTargetNode"
+    "SQLTableTargetNode",
+    "DataFrameTargetNode",
+    "ArrowTargetNode",
+    "ParquetTargetNode"
 ]
 
 __all__ += base.__all__
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import brewery.utils as utils
+from brewery.cache import file_fingerprint
 import heapq
 
 __all__ = (
@@ -19,33 +20,46 @@ __all__ = (
 # FIXME: temporary dictionary to record displayed warnings about __node_info__
 _node_info_warnings = set()
 
+# Node classes by identifier, collected by node_dictionary()
+_node_dictionary = None
+
 def create_node(identifier, *args, **kwargs):
     """Creates a node of type specified by `identifier`. Options are passed to
     the node initializer"""
 
     d = node_dictionary()
+    if identifier not in d:
+        d = node_dictionary(refresh=True)
     node_class = d[identifier]
     node = node_class(*args, **kwargs)
     return node
 
-def node_dictionary():
+def node_dictionary(refresh=False):
     """Return a dictionary containing node name as key and node class as
     value. This will be depreciated soon in favour of
-    :func:`node_catalogue()`"""
+    :func:`node_catalogue()`
 
-    classes = node_subclasses(Node)
-    dictionary = {}
+    Node classes are collected only once, use `refresh` to collect them again
+    when a node class was defined after the first call."""
 
-    for c in classes:
-        try:
-            name = c.identifier()
-            dictionary[name] = c
-        except AttributeError:
-            # If node does not provide identifier, we consider it to be
-            # private or abstract class
-            pass
+    global _node_dictionary
 
-    return dictionary
+    if _node_dictionary is None or refresh:
+        classes = node_subclasses(Node)
+        dictionary = {}
+
+        for c in classes:
+            try:
+                name = c.identifier()
+                dictionary[name] = c
+            except AttributeError:
+                # If node does not provide identifier, we consider it to be
+                # private or abstract class
+                pass
+
+        _node_dictionary = dictionary
+
+    return dict(_node_dictionary)
 
 def node_catalogue():
     """Returns a dictionary of information about all available nodes. Keys are
@@ -166,6 +180,27 @@ class Node(object):
 
     .. abstract_node
     """
+
+    # Kind of row processing, used by the stream optimizer: ``"map"`` - exactly one output row
+    # for every input row computed only from that row, ``"filter"`` - input rows are passed
+    # unchanged or dropped based only on the row itself, ``None`` - anything else.
+    row_operation = None
+
+    # ``True`` if the node keeps or copies whole input rows (such as a join or random sample),
+    # therefore it is worth to drop unused fields before the node. Used by the stream optimizer.
+    holds_rows = False
+
+    # Names of attributes that fully describe what the node does with its input, ``None`` if
+    # not known. Used to recognize repeated computations by the result cache. Nodes with random
+    # output should keep it ``None``.
+    config_attributes = None
+
+    # Data the node reads from its inputs and puts to its outputs: ``"rows"`` or ``"batches"``
+    # (:class:`brewery.batches.RecordBatch` with `input.batches()` and `put_batch()`). Pipes
+    # convert between rows and batches only between nodes with different formats.
+    input_format = "rows"
+    output_format = "rows"
+
     def __init__(self):
         """Creates a new data processing node.
 
@@ -202,6 +237,59 @@ class Node(object):
         """Finalizes the node. Default implementation does nothing."""
         pass
 
+    def consumed_fields(self):
+        """Return list of names of input fields the node reads or ``None`` if it is not known.
+        Used by the stream optimizer. Default is ``None``."""
+        return None
+
+    def produced_fields(self):
+        """Return list of names of output fields that are created or whose values are changed by
+        the node, ``None`` if not known. Meaningful for nodes with `row_operation` ``"map"`` or
+        ``"filter"``. Used by the stream optimizer. Default is ``None``."""
+        return None
+
+    def required_fields(self, fields):
+        """Return list of names of input fields the node needs to produce output fields with
+        names `fields` (``None`` means all output fields). Returns ``None`` if all input fields
+        are needed or if it is not known. Used by the stream optimizer.
+
+        Default implementation works for nodes with `row_operation` ``"map"`` or ``"filter"``:
+        output fields that are not produced by the node are passed from the input, fields read
+        by the node are needed as well."""
+        if fields is None or self.row_operation not in ("map", "filter"):
+            return None
+
+        consumed = self.consumed_fields()
+        produced = self.produced_fields()
+        if consumed is None or produced is None:
+            return None
+
+        return list((set(fields) - set(produced)) | set(consumed))
+
+    def config_key(self):
+        """Return a value describing what the node does with its input: node class, values of
+        `config_attributes` and retyped fields. Two nodes with equal keys produce the same output
+        from the same input. Returns ``None`` if not known, which is the default for nodes without
+        `config_attributes`."""
+        if self.config_attributes is None:
+            return None
+        values = [(name, getattr(self, name)) for name in self.config_attributes]
+        return (type(self), values, self._retype_dictionary)
+
+    def memory_behavior(self):
+        """Return a tuple (`kind`, `description`) describing how the node holds data in memory
+        while running. `kind` is one of:
+
+        * ``streaming`` - rows are passed one by one, memory does not grow with input size
+        * ``buffering`` - output is streamed, but some data grow with the input (for example
+          set of distinct keys)
+        * ``blocking`` - output is produced only after whole input was consumed
+
+        `description` is human readable detail or ``None``. Used by :meth:`Stream.explain`.
+        Default is ``streaming``, nodes that hold data should override this method.
+        """
+        return ("streaming", None)
+
     def run(self):
         """Main method for running the node code. Subclasses should implement this method.
         """
@@ -266,6 +354,18 @@ class Node(object):
         if not active_outputs:
             raise NodeFinished
 
+    def put_batch(self, batch):
+        """Put :class:`brewery.batches.RecordBatch` into all output pipes. Raises `NodeFinished`
+        when target nodes are not receiving data anymore, see :meth:`put`."""
+        active_outputs = 0
+        for output in self.outputs:
+            if not output.closed():
+                output.put_batch(batch)
+                active_outputs += 1
+
+        if not active_outputs:
+            raise NodeFinished
+
     def put_record(self, obj):
         """Put record into all output pipes. Convenience method. Not recommended to be used.
 
@@ -381,6 +481,26 @@ class SourceNode(Node):
     def output_fields(self):
         raise NotImplementedError("SourceNode subclasses should implement output_fields")
 
+    def scan_key(self):
+        """Return a value describing the data read by the node: resource and all settings that
+        affect rows and fields. Two source nodes with equal keys produce the same rows, the
+        stream optimizer reads them only once. Returns ``None`` if the node can not tell, which
+        is the default."""
+        return None
+
+    def resource_fingerprint(self):
+        """Return fingerprint of the resource read by the node, which changes when the resource
+        changes. Default is size and modification time of `resource` of the node if it is a
+        local file. Returns ``None`` if there is no fingerprint, for example for URLs."""
+        return file_fingerprint(getattr(self, "resource", None))
+
+    def config_key(self):
+        """Return :meth:`scan_key` together with :meth:`resource_fingerprint`."""
+        key = self.scan_key()
+        if key is None:
+            return None
+        return (key, self.resource_fingerprint())
+
     def add_input(self, pipe):
         raise Exception("Should not add input pipe to a source node")
 
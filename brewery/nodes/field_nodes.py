@@ -4,6 +4,7 @@ from __future__ import absolute_import
 from .base import Node
 from ..metadata import FieldMap, FieldList, Field
 from ..common import FieldError
+from ..expressions import expression_names, compile_row_expression, compile_vector_expression
 
 import re
 
@@ -33,6 +34,9 @@ class FieldMapNode(Node):
         ]
     }
 
+    row_operation = "map"
+    config_attributes = ("mapped_fields", "dropped_fields", "kept_fields")
+
     def __init__(self, map_fields = None, drop_fields = None, keep_fields=None):
         super(FieldMapNode, self).__init__()
 
@@ -73,6 +77,23 @@ class FieldMapNode(Node):
         self._output_fields = self.map.map(self.input.fields)
         self.filter = self.map.row_filter(self.input.fields)
 
+    def consumed_fields(self):
+        return []
+
+    def produced_fields(self):
+        # Renamed fields: both names refer to a different field after the map
+        return list(self.mapped_fields.keys()) + list(self.mapped_fields.values())
+
+    def required_fields(self, fields):
+        if fields is None:
+            return list(self.kept_fields) if self.kept_fields else None
+
+        sources = dict((target, source) for (source, target) in self.mapped_fields.items())
+        names = set(sources.get(name, name) for name in fields)
+        if self.kept_fields:
+            names &= self.kept_fields
+        return list(names - self.dropped_fields)
+
     def run(self):
         self.mapped_field_names = self.mapped_fields.keys()
 
@@ -110,6 +131,8 @@ class TextSubstituteNode(Node):
         ]
     }
 
+    row_operation = "map"
+
     def __init__(self, field, derived_field = None):
         """Creates a node for text replacement.
 
@@ -141,6 +164,12 @@ class TextSubstituteNode(Node):
     # def output_fields(self):
     #     pass
 
+    def consumed_fields(self):
+        return [self.field]
+
+    def produced_fields(self):
+        return [self.derived_field or self.field]
+
     def run(self):
         pipe = self.input
 
@@ -155,6 +184,7 @@ class TextSubstituteNode(Node):
             value = row[index]
             for (pattern, repl) in self.substitutions:
                 value = re.sub(pattern, repl, value)
+            row = list(row)
             if append:
                 row.append(value)
             else:
@@ -185,6 +215,9 @@ class StringStripNode(Node):
         ]
     }
 
+    row_operation = "map"
+    config_attributes = ("fields", "chars")
+
     def __init__(self, fields = None, chars = None):
         """Creates a node for string stripping.
 
@@ -198,6 +231,12 @@ class StringStripNode(Node):
         self.fields = fields
         self.chars = chars
 
+    def consumed_fields(self):
+        return [str(field) for field in self.fields] if self.fields else None
+
+    def produced_fields(self):
+        return self.consumed_fields()
+
     def run(self):
 
         if self.fields:
@@ -211,6 +250,7 @@ class StringStripNode(Node):
         indexes = self.input_fields.indexes(fields)
 
         for row in self.input.rows():
+            row = list(row)
             for index in indexes:
                 value = row[index]
                 if value:
@@ -253,6 +293,11 @@ class CoalesceValueToTypeNode(Node):
         ]
     }
 
+    row_operation = "map"
+    config_attributes = ("fields", "types", "empty_values")
+    input_format = "batches"
+    output_format = "batches"
+
     def __init__(self, fields = None, types = None, empty_values = None):
         super(CoalesceValueToTypeNode, self).__init__()
         self.fields = fields
@@ -281,52 +326,52 @@ class CoalesceValueToTypeNode(Node):
         self.integer_none = self.empty_values.get("integer")
         self.float_none = self.empty_values.get("float")
 
-    def run(self):
+    def consumed_fields(self):
+        return [str(field) for field in self.fields] if self.fields else None
 
-        for row in self.input.rows():
-            for i in self.string_indexes:
-                value = row[i]
-                if type(value) == str or type(value) == unicode:
-                    value = value.strip()
-                elif value:
-                    value = unicode(value)
-
-                if not value:
-                    value = self.string_none
-
-                row[i] = value
+    def produced_fields(self):
+        return self.consumed_fields()
 
+    def run(self):
+        # Values are converted by columns
+        for batch in self.input.batches():
+            columns = {}
+            for i in self.string_indexes:
+                columns[i] = [self._coalesce_string(value) for value in batch.column(i)]
             for i in self.integer_indexes:
-                value = row[i]
-                if type(value) == str or type(value) == unicode:
-                    value = re.sub(r"\s", "", value.strip())
+                columns[i] = [self._coalesce_number(value, int, self.integer_none)
+                              for value in batch.column(i)]
+            for i in self.float_indexes:
+                columns[i] = [self._coalesce_number(value, float, self.float_none)
+                              for value in batch.column(i)]
 
-                if value is None:
-                    value = self.integer_none
-                else:
-                    try:
-                        value = int(value)
-                    except ValueError:
-                        value = self.integer_none
+            batch = batch.replace_columns(columns)
+            # Rows are lists, as when the values are converted row by row
+            batch.row_objects = [list(row) for row in batch]
+            self.put_batch(batch)
 
-                row[i] = value
+    def _coalesce_string(self, value):
+        if type(value) == str or type(value) == unicode:
+            value = value.strip()
+        elif value:
+            value = unicode(value)
 
-            for i in self.float_indexes:
-                value = row[i]
-                if type(value) == str or type(value) == unicode:
-                    value = re.sub(r"\s", "", value.strip())
+        if not value:
+            value = self.string_none
 
-                if value is None:
-                    value = self.float_none
-                else:
-                    try:
-                        value = float(value)
-                    except ValueError:
-                        value = self.float_none
+        return value
 
-                row[i] = value
+    def _coalesce_number(self, value, number_type, none_value):
+        if type(value) == str or type(value) == unicode:
+            value = re.sub(r"\s", "", value.strip())
 
-            self.put(row)
+        if value is None:
+            return none_value
+
+        try:
+            return number_type(value)
+        except ValueError:
+            return none_value
 
 class ValueThresholdNode(Node):
     """Create a field that will refer to a value bin based on threshold(s). Values of `range` type
@@ -381,6 +426,9 @@ class ValueThresholdNode(Node):
         ]
     }
 
+    row_operation = "map"
+    config_attributes = ("thresholds", "bin_names", "prefix", "suffix")
+
     def __init__(self, thresholds=None, bin_names=None, prefix=None, suffix=None):
         super(ValueThresholdNode, self).__init__()
         self.thresholds = thresholds
@@ -424,6 +472,14 @@ class ValueThresholdNode(Node):
 
         self.threshold_field_indexes = self.input.fields.indexes(field_names)
 
+    def consumed_fields(self):
+        return [t[0] for t in self.thresholds or []]
+
+    def produced_fields(self):
+        prefix = self.prefix or ""
+        suffix = self.suffix or "_bin"
+        return [prefix + name + suffix for name in self.consumed_fields()]
+
     def run(self):
         thresholds = []
         for t in self.thresholds:
@@ -443,6 +499,7 @@ class ValueThresholdNode(Node):
             bin_names = self.bin_names
 
         for row in self.input.rows():
+            row = list(row)
             for i, t in enumerate(thresholds):
                 value = row[self.threshold_field_indexes[i]]
                 bin = None
@@ -491,6 +548,9 @@ class DeriveNode(Node):
 
         node.formula = "i / 2"
 
+    When numpy is installed, numeric formulas are evaluated for whole batches of rows at once,
+    see :func:`brewery.expressions.compile_vector_expression`. Batches with values that are not
+    numbers are evaluated row by row.
     """
 
     node_info = {
@@ -521,6 +581,9 @@ class DeriveNode(Node):
     }
 
 
+    row_operation = "map"
+    config_attributes = ("formula", "field_name", "analytical_type", "storage_type")
+
     def __init__(self, formula = None, field_name = "new_field", analytical_type = "unknown",
                         storage_type = "unknown"):
         """Creates and initializes selection node
@@ -537,8 +600,16 @@ class DeriveNode(Node):
         return self._output_fields
 
     def initialize(self):
+        self._row_formula = None
+        self._vector_formula = None
         if isinstance(self.formula, basestring):
-            self._expression = compile(self.formula, "SelectNode condition", "eval")
+            self._row_formula = compile_row_expression(self.formula, self.input.fields.names(),
+                                                       "DeriveNode formula")
+            if self._row_formula:
+                self._vector_formula = compile_vector_expression(self.formula,
+                                                                 self.input.fields.names(),
+                                                                 "DeriveNode formula")
+            self._expression = compile(self.formula, "DeriveNode formula", "eval")
             self._formula_callable = self._eval_expression
         else:
             self._formula_callable = self.formula
@@ -552,17 +623,59 @@ class DeriveNode(Node):
                                   storage_type = self.storage_type)
         self._output_fields.append(new_field)
 
+        if self._vector_formula:
+            self.input_format = self.output_format = "batches"
+        else:
+            self.input_format = self.output_format = "rows"
+
     def _eval_expression(self, **record):
         return eval(self._expression, None, record)
 
+    def consumed_fields(self):
+        if isinstance(self.formula, basestring):
+            names = expression_names(self.formula)
+            return list(names) if names is not None else None
+        return None
+
+    def produced_fields(self):
+        return [self.field_name]
+
     def run(self):
-        for record in self.input.records():
-            if self._formula_callable:
-                record[self.field_name] = self._formula_callable(**record)
+        if self._vector_formula:
+            formula = self._vector_formula
+            row_formula = self._row_formula
+            new_field = self._output_fields[-1]
+            for batch in self.input.batches():
+                values = formula.evaluate(batch)
+                if values is None:
+                    values = [row_formula(row) for row in batch]
+                else:
+                    # Python numbers, not numpy scalars, are passed to other nodes
+                    values = values.tolist()
+                batch = batch.add_column(new_field, values)
+                # Rows are lists, as when the formula is evaluated row by row
+                batch.row_objects = [list(row) for row in batch]
+                self.put_batch(batch)
+            return
+
+        if self._row_formula:
+            # Compiled string formula reads values directly from rows
+            formula = self._row_formula
+            for row in self.input.rows():
+                row = list(row)
+                row.append(formula(row))
+                self.put(row)
+            return
+
+        names = self.input.fields.names()
+        formula = self._formula_callable
+        for row in self.input.rows():
+            row = list(row)
+            if formula:
+                row.append(formula(**dict(zip(names, row))))
             else:
-                record[self.field_name] = None
-
-            self.put_record(record)
+                row.append(None)
+            self.put(row)
 
 class BinningNode(Node):
     """Derive a bin/category field from a value.
@@ -3,11 +3,18 @@
 from __future__ import absolute_import
 from .base import Node, Stack
 from ..dq.field_statistics import FieldStatistics
-from ..metadata import FieldMap, FieldList, Field
+from ..expressions import expression_names, compile_row_expression, compile_vector_expression
+from ..metadata import FieldMap, FieldList, Field, aggregated_fields
+from ..utils import MissingPackage
 import logging
 import itertools
 import random
 
+try:
+    import numpy
+except ImportError:
+    numpy = MissingPackage("numpy", "Vectorized expressions", "http://numpy.scipy.org/")
+
 class SampleNode(Node):
     """Create a data sample from input stream. There are more sampling possibilities:
 
@@ -63,6 +70,26 @@ class SampleNode(Node):
             raise ValueError, "Sample size must be between 0 and 100 with 'percent' method."
 
 
+    config_attributes = ("size", "discard_sample", "method")
+
+    @property
+    def holds_rows(self):
+        return self.method == "random"
+
+    def config_key(self):
+        if self.method in ("random", "percent"):
+            return None
+        return super(SampleNode, self).config_key()
+
+    def required_fields(self, fields):
+        return fields
+
+    def memory_behavior(self):
+        if self.method == "random":
+            return ("blocking", "keeps %s randomly sampled rows until whole input is read"
+                                % self.size)
+        return ("streaming", None)
+
     def run(self):
         pipe = self.input
         count = 0
@@ -94,6 +121,8 @@ class AppendNode(Node):
         "description" : "Concatenate input streams."
     }
 
+    config_attributes = ()
+
     def __init__(self):
         """Creates a node that concatenates records from inputs. Order of input pipes matter."""
         super(AppendNode, self).__init__()
@@ -105,6 +134,9 @@ class AppendNode(Node):
 
         return self.inputs[0].fields
 
+    def required_fields(self, fields):
+        return fields
+
     def run(self):
         """Append data objects from inputs sequentially."""
         for pipe in self.inputs:
@@ -213,6 +245,9 @@ class MergeNode(Node):
         ]
     }
 
+    holds_rows = True
+    config_attributes = ("joins", "master", "maps")
+
     def __init__(self, joins = None, master = None, maps = None):
         super(MergeNode, self).__init__()
         if joins:
@@ -289,9 +324,10 @@ class MergeNode(Node):
                 self._maps[tag] = fmap
                 self._filters[tag] = f
 
-        # Construct output fields
+        # Construct output fields: master fields first, then details - same as rows are joined
         fields = []
-        for (tag, pipe) in enumerate(self.inputs):
+        inputs = [(self.master, self.master_input)] + self.detail_inputs
+        for (tag, pipe) in inputs:
             fmap = self._maps.get(tag, None)
             if fmap:
                 fields += fmap.map(pipe.fields)
@@ -306,6 +342,35 @@ class MergeNode(Node):
     def output_fields(self):
         return self._output_fields
 
+    def required_fields(self, fields):
+        # Names are not distinguished by input, result is union for all inputs
+        if fields is None:
+            return None
+
+        names = set(fields)
+        for fmap in (self.maps or {}).values():
+            if isinstance(fmap, FieldMap):
+                rename = fmap.rename
+            else:
+                rename = fmap.get("rename") or {}
+            sources = dict((target, source) for (source, target) in rename.items())
+            names |= set(sources.get(name, name) for name in fields)
+
+        for join in self.joins:
+            for key in join[1:]:
+                if isinstance(key, (list, tuple)):
+                    names |= set(key)
+                else:
+                    names.add(key)
+
+        return list(names)
+
+    def memory_behavior(self):
+        details = [str(join[0]) for join in self.joins]
+        return ("buffering", "detail inputs %s are read into memory, indexed by join key, "
+                             "before master input %s is streamed"
+                             % (", ".join(details), self.master))
+
     def run(self):
         """Only inner join is implemented"""
         # First, read details, then master. )
@@ -319,9 +384,9 @@ class MergeNode(Node):
 
         for row in self.master_input.rows():
             if rfilter:
-                joined_row = rfilter.filter(row[:])
+                joined_row = rfilter.filter(row)
             else:
-                joined_row = row[:]
+                joined_row = list(row)
 
             joined = False
             for (tag, pipe) in self.detail_inputs:
@@ -352,10 +417,11 @@ class MergeNode(Node):
             for i in key_indexes:
                 key.append(row[i])
 
+            # Detail rows are kept as tuples, they take less memory than lists
             if rfilter:
-                detail[tuple(key)] = rfilter.filter(row)
+                detail[tuple(key)] = tuple(rfilter.filter(row))
             else:
-                detail[tuple(key)] = row
+                detail[tuple(key)] = tuple(row)
 
 class DistinctNode(Node):
     """Node will pass distinct records with given distinct fields.
@@ -388,6 +454,8 @@ class DistinctNode(Node):
         ]
     }
 
+    config_attributes = ("distinct_fields", "discard")
+
     def __init__(self, distinct_fields = None, discard = False):
         """Creates a node that will pass distinct records with given distinct fields.
 
@@ -418,6 +486,12 @@ class DistinctNode(Node):
         field_map = FieldMap(keep=self.distinct_fields)
         self.row_filter = field_map.row_filter(self.input_fields)
 
+    def memory_behavior(self):
+        if not self.distinct_fields:
+            return ("streaming", None)
+        return ("buffering", "keeps set of all distinct values of %s"
+                             % ", ".join(self.distinct_fields or []))
+
     def run(self):
         pipe = self.input
         self.distinct_values = set()
@@ -445,29 +519,149 @@ class DistinctNode(Node):
 
 class Aggregate(object):
     """Structure holding aggregate information (should be replaced by named tuples in Python 3)"""
+
+    __slots__ = ("count", "sum", "min", "max", "average")
+
     def __init__(self):
         self.count = 0
         self.sum = 0
-        self.min = 0
-        self.max = 0
+        self.min = None
+        self.max = None
         self.average = None
 
     def aggregate_value(self, value):
         self.count += 1
         self.sum += value
-        self.min = min(self.min, value)
-        self.max = max(self.max, value)
+        if self.count == 1:
+            self.min = self.max = value
+        else:
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
 
     def finalize(self):
         if self.count:
-            self.average = self.sum / self.count
+            self.average = float(self.sum) / self.count
         else:
             self.average = None
 class KeyAggregate(object):
+    __slots__ = ("count", "field_aggregates")
+
     def __init__(self):
         self.count = 0
         self.field_aggregates = {}
 
+# Integer sums of numpy aggregation have to fit into 64 bits, larger sums are computed by python
+_MAX_ARRAY_SUM = 2 ** 62
+
+def _grown(array, size, dtype):
+    """Return numpy `array` with at least `size` items and type `dtype`. New items are zeros.
+    The array is grown to double size, so that adding groups one batch at a time is cheap."""
+    if array is None:
+        return numpy.zeros(size, dtype)
+    if len(array) < size:
+        new_array = numpy.zeros(max(size, 2 * len(array)), dtype)
+        new_array[:len(array)] = array
+        return new_array
+    if array.dtype != dtype:
+        return array.astype(dtype)
+    return array
+
+def _aggregation_dtype(array):
+    """Return type of aggregations of numeric `array`: 64 bit integers or floats."""
+    if array.dtype.kind in "iu":
+        return numpy.dtype(numpy.int64)
+    return numpy.dtype(numpy.float64)
+
+class _ArrayAggregates(object):
+    """Sum, min, max and count of measures for each group of rows, stored in numpy arrays indexed
+    by group id. Batches are reduced by groups and merged into the arrays."""
+
+    def __init__(self, measure_count):
+        self.group_count = 0
+        self.counts = numpy.zeros(0, int)
+        self.sums = [None] * measure_count
+        self.mins = [None] * measure_count
+        self.maxs = [None] * measure_count
+        # Upper bound of absolute value of integer sums
+        self.bounds = [0] * measure_count
+
+    def accepts(self, arrays):
+        """Return ``True`` if sums of measure `arrays` can be computed without integer
+        overflow and the arrays are integers or floats as the arrays of the measures added
+        before. Python aggregation of integers mixed with floats keeps integer mins and maxs,
+        numpy would convert them to floats."""
+        for (i, array) in enumerate(arrays):
+            if self.sums[i] is not None and self.sums[i].dtype != _aggregation_dtype(array):
+                return False
+            if self.bounds[i] + self._bound(array) >= _MAX_ARRAY_SUM:
+                return False
+        return True
+
+    def _bound(self, array):
+        """Return upper bound of absolute value of sum of integer `array`."""
+        if array.dtype.kind not in "iu" or not len(array):
+            return 0
+        return max(int(array.max()), -int(array.min())) * len(array)
+
+    def add(self, ids, group_count, arrays):
+        """Add rows of a batch with group ids in numpy array `ids` and measure `arrays`.
+        `group_count` is number of all groups, including new groups of the batch."""
+
+        # Sort rows by group, stable sort keeps order of values within the group
+        order = numpy.argsort(ids, kind="mergesort")
+        sorted_ids = ids[order]
+        starts = numpy.flatnonzero(numpy.concatenate(([True],
+                                                      sorted_ids[1:] != sorted_ids[:-1])))
+        groups = sorted_ids[starts]
+
+        self.group_count = group_count
+        self.counts = _grown(self.counts, group_count, self.counts.dtype)
+        new = self.counts[groups] == 0
+        self.counts[groups] += numpy.diff(numpy.append(starts, len(ids)))
+
+        for (i, array) in enumerate(arrays):
+            dtype = _aggregation_dtype(array)
+            values = array[order].astype(dtype)
+            sums = self.sums[i] = _grown(self.sums[i], group_count, dtype)
+            mins = self.mins[i] = _grown(self.mins[i], group_count, dtype)
+            maxs = self.maxs[i] = _grown(self.maxs[i], group_count, dtype)
+            self.bounds[i] += self._bound(values)
+
+            sums[groups] += numpy.add.reduceat(values, starts)
+            batch_mins = numpy.minimum.reduceat(values, starts)
+            batch_maxs = numpy.maximum.reduceat(values, starts)
+            mins[groups] = numpy.where(new, batch_mins, numpy.minimum(mins[groups], batch_mins))
+            maxs[groups] = numpy.where(new, batch_maxs, numpy.maximum(maxs[groups], batch_maxs))
+
+    def key_aggregates(self):
+        """Return list of :class:`KeyAggregate` objects, one for each group id, with
+        aggregations of measures by measure position."""
+        size = self.group_count
+        counts = self.counts[:size].tolist()
+        measures = []
+        for i in range(len(self.sums)):
+            if self.sums[i] is None:
+                measures.append(None)
+            else:
+                measures.append((self.sums[i][:size].tolist(), self.mins[i][:size].tolist(),
+                                 self.maxs[i][:size].tolist()))
+
+        key_aggregates = []
+        for (group, count) in enumerate(counts):
+            key_aggregate = KeyAggregate()
+            key_aggregate.count = count
+            for (i, measure) in enumerate(measures):
+                if measure is not None:
+                    aggregate = Aggregate()
+                    aggregate.count = count
+                    aggregate.sum = measure[0][group]
+                    aggregate.min = measure[1][group]
+                    aggregate.max = measure[2][group]
+                    key_aggregate.field_aggregates[i] = aggregate
+            key_aggregates.append(key_aggregate)
+
+        return key_aggregates
+
 class AggregateNode(Node):
     """Aggregate"""
 
@@ -494,6 +688,9 @@ class AggregateNode(Node):
         ]
     }
 
+    config_attributes = ("key_fields", "measures", "record_count_field")
+    input_format = "batches"
+
     def __init__(self, keys=None, measures=None, default_aggregations=None,
                  record_count_field="record_count"):
         """Creates a new node for aggregations. Supported aggregations: sum, avg, min, max"""
@@ -517,55 +714,41 @@ class AggregateNode(Node):
 
     @property
     def output_fields(self):
-        # FIXME: use storage types based on aggregated field type
-        fields = FieldList()
-
-        if self.key_fields:
-            for field in  self.input_fields.fields(self.key_fields):
-                fields.append(field)
+        return aggregated_fields(self.input_fields, self.key_fields, self.measures,
+                                 self.record_count_field)
 
-        for field in self.measures:
-            fields.append(Field(field + "_sum", storage_type = "float", analytical_type = "range"))
-            fields.append(Field(field + "_min", storage_type = "float", analytical_type = "range"))
-            fields.append(Field(field + "_max", storage_type = "float", analytical_type = "range"))
-            fields.append(Field(field + "_average", storage_type = "float", analytical_type = "range"))
-        fields.append(Field(self.record_count_field, storage_type = "integer", analytical_type = "range"))
+    def required_fields(self, fields):
+        return list(self.key_fields) + list(self.measures)
 
-        return fields
+    def memory_behavior(self):
+        if self.key_fields:
+            detail = "one accumulator per distinct value of %s" % ", ".join(self.key_fields)
+        else:
+            detail = "one accumulator"
+        return ("blocking", detail + ", output after whole input is read")
+
+    def _batch_keys(self, batch, key_indexes):
+        """Return list of aggregation keys of rows in `batch`."""
+        key_columns = [batch.column(i) for i in key_indexes]
+        if key_columns:
+            return zip(*key_columns)
+        else:
+            return [()] * len(batch)
 
     def run(self):
-        pipe = self.input
         self.aggregates = {}
         self.keys = []
         self.counts = {}
 
         key_selectors = self.input_fields.selectors(self.key_fields)
+        # Key values are in order of input fields
+        key_indexes = [i for (i, selected) in enumerate(key_selectors) if selected]
         measure_indexes = self.input_fields.indexes(self.measures)
 
-        for row in pipe.rows():
-            # Create aggregation key
-            key = tuple(itertools.compress(row, key_selectors))
-            # Create new aggregate record for key if it does not exist
-            #
-            if key not in self.keys:
-                self.keys.append(key)
-                key_aggregate = KeyAggregate()
-                self.aggregates[key] = key_aggregate
-            else:
-                key_aggregate = self.aggregates[key]
-
-            # Create aggregations for each field to be aggregated
-            #
-            key_aggregate.count += 1
-            for i in measure_indexes:
-                if i not in key_aggregate.field_aggregates:
-                    aggregate = Aggregate()
-                    key_aggregate.field_aggregates[i] = aggregate
-                else:
-                    aggregate = key_aggregate.field_aggregates[i]
-                value = row[i]
-
-                aggregate.aggregate_value(value)
+        batches = iter(self.input.batches())
+        if not isinstance(numpy, MissingPackage):
+            batches = self._aggregate_arrays(batches, key_indexes, measure_indexes)
+        self._aggregate_objects(batches, key_indexes, measure_indexes)
 
         # Pass results to output
         for key in self.keys:
@@ -584,6 +767,67 @@ class AggregateNode(Node):
 
             self.put(row)
 
+    def _aggregate_arrays(self, batches, key_indexes, measure_indexes):
+        """Aggregate numeric measures of `batches` with numpy until a batch with other values
+        than numbers comes, with integers mixed with floats in a measure, in the batch or with
+        the batches before, or a batch which would overflow 64 bit integer sums. Aggregations
+        are stored in `self.aggregates` as by `_aggregate_objects()` and iterator of remaining
+        batches is returned."""
+        key_ids = {}
+        aggregates = _ArrayAggregates(len(measure_indexes))
+        remaining = []
+
+        for batch in batches:
+            if not len(batch):
+                continue
+            arrays = [batch.numeric_array(i) for i in measure_indexes]
+            if any(array is None for array in arrays) or not aggregates.accepts(arrays):
+                remaining = [batch]
+                break
+
+            # Group id of a key is the order of its first occurence
+            ids = [key_ids.setdefault(key, len(key_ids))
+                        for key in self._batch_keys(batch, key_indexes)]
+            aggregates.add(numpy.array(ids, int), len(key_ids), arrays)
+
+        self.keys = sorted(key_ids, key=key_ids.__getitem__)
+        for (key, key_aggregate) in zip(self.keys, aggregates.key_aggregates()):
+            # Field aggregates are stored by measure field index
+            key_aggregate.field_aggregates = dict((measure_indexes[position], aggregate)
+                        for (position, aggregate) in key_aggregate.field_aggregates.items())
+            self.aggregates[key] = key_aggregate
+
+        return itertools.chain(remaining, batches)
+
+    def _aggregate_objects(self, batches, key_indexes, measure_indexes):
+        """Aggregate `batches` value by value with :class:`Aggregate` objects."""
+        for batch in batches:
+            # Create aggregation keys
+            keys = self._batch_keys(batch, key_indexes)
+
+            # Create new aggregate record for key if it does not exist
+            #
+            key_aggregates = []
+            for key in keys:
+                key_aggregate = self.aggregates.get(key)
+                if key_aggregate is None:
+                    self.keys.append(key)
+                    key_aggregate = KeyAggregate()
+                    self.aggregates[key] = key_aggregate
+                key_aggregate.count += 1
+                key_aggregates.append(key_aggregate)
+
+            # Create aggregations for each field to be aggregated
+            #
+            for i in measure_indexes:
+                for (key_aggregate, value) in itertools.izip(key_aggregates, batch.column(i)):
+                    aggregate = key_aggregate.field_aggregates.get(i)
+                    if aggregate is None:
+                        aggregate = Aggregate()
+                        key_aggregate.field_aggregates[i] = aggregate
+
+                    aggregate.aggregate_value(value)
+
 class SelectNode(Node):
     """Select or discard records from the stream according to a predicate.
 
@@ -613,6 +857,9 @@ class SelectNode(Node):
 
         node.condition = "i > 1000000"
 
+    When numpy is installed, numeric conditions are evaluated for whole batches of rows at once,
+    see :func:`brewery.expressions.compile_vector_expression`. Batches with values that are not
+    numbers are evaluated row by row.
     """
 
     node_info = {
@@ -634,6 +881,9 @@ class SelectNode(Node):
     }
 
 
+    row_operation = "filter"
+    config_attributes = ("condition", "discard")
+
     def __init__(self, condition = None, discard = False):
         """Creates and initializes selection node
         """
@@ -642,19 +892,64 @@ class SelectNode(Node):
         self.discard = discard
 
     def initialize(self):
+        self._row_condition = None
+        self._vector_condition = None
         if isinstance(self.condition, basestring):
+            self._row_condition = compile_row_expression(self.condition,
+                                                         self.input_fields.names(),
+                                                         "SelectNode condition")
+            if self._row_condition:
+                self._vector_condition = compile_vector_expression(self.condition,
+                                                                   self.input_fields.names(),
+                                                                   "SelectNode condition")
             self._expression = compile(self.condition, "SelectNode condition", "eval")
             self._condition_callable = self._eval_expression
         else:
             self._condition_callable = self.condition
 
+        if self._vector_condition:
+            self.input_format = self.output_format = "batches"
+        else:
+            self.input_format = self.output_format = "rows"
+
     def _eval_expression(self, **record):
         return eval(self._expression, None, record)
 
+    def consumed_fields(self):
+        if isinstance(self.condition, basestring):
+            names = expression_names(self.condition)
+            return list(names) if names is not None else None
+        return None
+
+    def produced_fields(self):
+        return []
+
     def run(self):
-        for record in self.input.records():
-            if self._condition_callable(**record):
-                self.put_record(record)
+        if self._vector_condition:
+            condition = self._vector_condition
+            row_condition = self._row_condition
+            for batch in self.input.batches():
+                flags = condition.evaluate(batch)
+                if flags is None:
+                    flags = [row_condition(row) for row in batch]
+                batch = batch.filter(flags)
+                if len(batch):
+                    self.put_batch(batch)
+            return
+
+        if self._row_condition:
+            # Compiled string condition reads values directly from rows
+            condition = self._row_condition
+            for row in self.input.rows():
+                if condition(row):
+                    self.put(row)
+            return
+
+        names = self.input_fields.names()
+        condition = self._condition_callable
+        for row in self.input.rows():
+            if condition(**dict(zip(names, row))):
+                self.put(row)
 
 class FunctionSelectNode(Node):
     """Select records that will be selected by a predicate function.
@@ -671,6 +966,17 @@ class FunctionSelectNode(Node):
         node.fields = ["amount"]
         node.kwargs = {"threshold": 100}
 
+    If `vectorized` is ``True``, the function gets numpy arrays with values of a batch of rows
+    instead of single values and returns array of flags, for example:
+
+    .. code-block:: python
+
+        def select_greater_than(value, threshold):
+            return value > threshold
+
+    works for both. The function is called with single values of each row if numpy is not
+    installed or if a batch contains values that are not numbers.
+
     The `discard` flag controls behaviour of the node: if set to ``True``, then selection is
     inversed and fields that function evaluates as ``True`` are discarded. Default is False -
     selected records are passed to the output.
@@ -698,10 +1004,18 @@ class FunctionSelectNode(Node):
                  "name": "kwargs",
                  "description": "Keyword arguments passed to the predicate function"
             },
+            {
+                "name": "vectorized",
+                 "description": "flag whether the function accepts numpy arrays of values",
+                 "default": "False"
+            },
         ]
     }
 
-    def __init__(self, function = None, fields = None, discard = False, **kwargs):
+    row_operation = "filter"
+
+    def __init__(self, function = None, fields = None, discard = False, vectorized = False,
+                 **kwargs):
         """Creates a node that will select records based on condition `function`.
 
         :Parameters:
@@ -710,6 +1024,8 @@ class FunctionSelectNode(Node):
             * `discard`: if ``True``, then selection is inversed and fields that function
               evaluates as ``True`` are discarded. Default is False - selected records are passed
               to the output.
+            * `vectorized`: if ``True``, the function is called with numpy arrays of values of
+              whole batches of rows
             * `kwargs`: additional arguments passed to the function
 
         """
@@ -717,18 +1033,53 @@ class FunctionSelectNode(Node):
         self.function = function
         self.fields = fields
         self.discard = discard
+        self.vectorized = vectorized
         self.kwargs = kwargs
 
     def initialize(self):
         self.indexes = self.input_fields.indexes(self.fields)
 
+        if self.vectorized and not isinstance(numpy, MissingPackage):
+            self.input_format = self.output_format = "batches"
+        else:
+            self.input_format = self.output_format = "rows"
+
+    def consumed_fields(self):
+        return list(self.fields or [])
+
+    def produced_fields(self):
+        return []
+
     def run(self):
+        if self.input_format == "batches":
+            self._run_vectorized()
+            return
+
         for row in self.input.rows():
             values = [row[index] for index in self.indexes]
             flag = self.function(*values, **self.kwargs)
             if (flag and not self.discard) or (not flag and self.discard):
                 self.put(row)
 
+    def _run_vectorized(self):
+        for batch in self.input.batches():
+            arrays = [batch.numeric_array(index) for index in self.indexes]
+            if any(array is None for array in arrays):
+                flags = []
+                for row in batch:
+                    values = [row[index] for index in self.indexes]
+                    flags.append(self.function(*values, **self.kwargs))
+            else:
+                flags = self.function(*arrays, **self.kwargs)
+
+            flags = numpy.asarray(flags, dtype=bool)
+            if self.discard:
+                flags = ~flags
+
+            batch = batch.filter(flags)
+            if len(batch):
+                self.put_batch(batch)
+
 class SetSelectNode(Node):
     """Select records where field value is from predefined set of values.
 
@@ -761,6 +1112,9 @@ class SetSelectNode(Node):
         ]
     }
 
+    row_operation = "filter"
+    config_attributes = ("field", "value_set", "discard")
+
     def __init__(self, field = None, value_set = None, discard = False):
         """Creates a node that will select records where `field` contains value from `value_set`.
 
@@ -780,6 +1134,12 @@ class SetSelectNode(Node):
     def initialize(self):
         self.field_index = self.input_fields.index(self.field)
 
+    def consumed_fields(self):
+        return [self.field]
+
+    def produced_fields(self):
+        return []
+
     def run(self):
         for row in self.input.rows():
             flag = row[self.field_index] in self.value_set
@@ -815,6 +1175,8 @@ class AuditNode(Node):
         ]
     }
 
+    input_format = "batches"
+
     def __init__(self, distinct_threshold = 10):
         """Creates a field audit node.
 
@@ -858,10 +1220,14 @@ class AuditNode(Node):
             stat = FieldStatistics(field.name, distinct_threshold = self.distinct_threshold)
             self.stats.append(stat)
 
+    def memory_behavior(self):
+        return ("blocking", "statistics per field with up to %s distinct values, output after "
+                            "whole input is read" % self.distinct_threshold)
+
     def run(self):
-        for row in self.input.rows():
-            for i, value in enumerate(row):
-                self.stats[i].probe(value)
+        for batch in self.input.batches():
+            for (stat, values) in zip(self.stats, batch.selected_columns()):
+                stat.probe_values(values)
 
         for stat in self.stats:
             stat.finalize()
@@ -5,9 +5,22 @@ from .base import SourceNode
 from ..ds.csv_streams import CSVDataSource
 from ..ds.elasticsearch_streams import ESDataSource
 from ..ds.gdocs_streams import GoogleSpreadsheetDataSource
-from ..ds.sql_streams import SQLDataSource
+from ..ds.sql_streams import SQLDataSource, SQLContext, table_fingerprint, sqlalchemy
+from ..ds.synthetic_streams import SyntheticDataSource
+from ..ds.binary_streams import BinaryDataSource
+from ..ds.pandas_streams import DataFrameDataSource
+from ..ds.arrow_streams import ArrowDataSource, ParquetDataSource
 from ..ds.xls_streams import XLSDataSource
 from ..ds.yaml_dir_streams import YamlDirectoryDataSource
+from ..metadata import FieldList
+from ..cache import file_fingerprint
+import itertools
+
+def _fields_key(fields):
+    """Return comparable description of explicitly specified `fields` for a scan key."""
+    if not fields:
+        return None
+    return [field.to_dict() for field in FieldList(fields)]
 
 class RowListSourceNode(SourceNode):
     """Source node that feeds rows (list/tuple of values) from a list (or any other iterable)
@@ -180,12 +193,25 @@ class CSVSourceNode(SourceNode):
         ]
     }
     def __init__(self, resource = None, *args, **kwargs):
+        """Creates a CSV source node. Arguments are passed to :class:`CSVDataSource`.
+
+        :Attributes:
+            * `projection` - list of names of fields to be read, ``None`` means all fields. Set
+              by the optimizer to the fields used downstream.
+            * `limit` - maximal number of rows to be read, ``None`` means all rows. Set by the
+              optimizer when only first rows are used downstream.
+            * `metadata_cache` - :class:`brewery.cache.MetadataCache` where the file header is
+              stored. Set by the stream from :attr:`Stream.metadata_cache`.
+        """
         super(CSVSourceNode, self).__init__()
         self.resource = resource
         self.args = args
         self.kwargs = kwargs
         self.stream = None
         self.fields = None
+        self.projection = None
+        self.limit = None
+        self.metadata_cache = None
         self._output_fields = None
 
     @property
@@ -203,6 +229,10 @@ class CSVSourceNode(SourceNode):
 
         if self.fields:
             self.stream.fields = self.fields
+        if self.projection is not None:
+            self.stream.projection = self.projection
+        if self.metadata_cache is not None:
+            self.stream.metadata_cache = self.metadata_cache
 
         self.stream.initialize()
 
@@ -210,8 +240,15 @@ class CSVSourceNode(SourceNode):
         self._output_fields = self.stream.fields.copy()
         self._output_fields.retype(self._retype_dictionary)
 
+    def scan_key(self):
+        return (type(self), self.resource, self.args, self.kwargs, _fields_key(self.fields),
+                self._retype_dictionary, self.projection, self.limit)
+
     def run(self):
-        for row in self.stream.rows():
+        rows = self.stream.rows()
+        if self.limit is not None:
+            rows = itertools.islice(rows, self.limit)
+        for row in rows:
             self.put(row)
 
     def finalize(self):
@@ -258,11 +295,18 @@ class XLSSourceNode(SourceNode):
         ]
     }
     def __init__(self, *args, **kwargs):
+        """Creates a XLS source node. Arguments are passed to :class:`XLSDataSource`.
+
+        :Attributes:
+            * `limit` - maximal number of rows to be read, ``None`` means all rows. Set by the
+              optimizer when only first rows are used downstream.
+        """
         super(XLSSourceNode, self).__init__()
         self.args = args
         self.kwargs = kwargs
         self.stream = None
         self._fields = None
+        self.limit = None
 
     @property
     def output_fields(self):
@@ -293,8 +337,18 @@ class XLSSourceNode(SourceNode):
         self.stream.initialize()
         self._fields = self.stream.fields
 
+    def scan_key(self):
+        return (type(self), self.args, self.kwargs, _fields_key(self._fields), self.limit)
+
+    def resource_fingerprint(self):
+        resource = self.args[0] if self.args else self.kwargs.get("resource")
+        return file_fingerprint(resource)
+
     def run(self):
-        for row in self.stream.rows():
+        rows = self.stream.rows()
+        if self.limit is not None:
+            rows = itertools.islice(rows, self.limit)
+        for row in rows:
             self.put(row)
 
     def finalize(self):
@@ -485,11 +539,32 @@ class SQLSourceNode(SourceNode):
         ]
     }
     def __init__(self, *args, **kwargs):
+        """Creates a SQL source node. Arguments are passed to :class:`SQLDataSource`.
+
+        :Attributes:
+            * `conditions` - list of functions that get table columns and return SQLAlchemy
+              clause. Only rows matching all the clauses are read. The list is used by the
+              optimizer to push filters down to the database.
+            * `projection` - list of names of columns to be read, ``None`` means all columns.
+              Set by the optimizer to the fields used downstream.
+            * `limit` - maximal number of rows to be read, ``None`` means all rows. Set by the
+              optimizer when only first rows are used downstream.
+            * `aggregation` - aggregation computed by the database, see
+              :class:`SQLDataSource`. Set by the optimizer when the source is followed by
+              :class:`AggregateNode`.
+            * `metadata_cache` - :class:`brewery.cache.MetadataCache` where the reflected table
+              is stored. Set by the stream from :attr:`Stream.metadata_cache`.
+        """
         super(SQLSourceNode, self).__init__()
         self.args = args
         self.kwargs = kwargs
         self.stream = None
         self._fields = None
+        self.conditions = []
+        self.projection = None
+        self.limit = None
+        self.aggregation = None
+        self.metadata_cache = None
 
     @property
     def output_fields(self):
@@ -512,10 +587,43 @@ class SQLSourceNode(SourceNode):
     fields = property(__get_fields, __set_fields)
 
     def initialize(self):
-        self.stream = SQLDataSource(*self.args, **self.kwargs)
+        kwargs = dict(self.kwargs)
+        if self.metadata_cache is not None:
+            kwargs["metadata_cache"] = self.metadata_cache
+        self.stream = SQLDataSource(*self.args, **kwargs)
+        if self.projection is not None:
+            self.stream.projection = self.projection
+        if self.limit is not None:
+            self.stream.limit = self.limit
+        if self.aggregation is not None:
+            self.stream.aggregation = self.aggregation
         self.stream.initialize()
         self._fields = self.stream.fields
 
+        if self.conditions:
+            columns = self.stream.table.columns
+            clauses = [condition(columns) for condition in self.conditions]
+            if self.stream.condition is not None:
+                clauses.insert(0, self.stream.condition)
+            self.stream.condition = sqlalchemy.and_(*clauses)
+
+    def scan_key(self):
+        return (type(self), self.args, self.kwargs, self.conditions, self.projection,
+                self.limit, self.aggregation)
+
+    def resource_fingerprint(self):
+        """Return hash of definition of the read table, see
+        :func:`brewery.ds.sql_streams.table_fingerprint`, or ``None`` if it is not known.
+        Changes of rows that do not change the table definition are not detected."""
+        kwargs = dict(self.kwargs)
+        kwargs["autoinit"] = False
+        source = SQLDataSource(*self.args, **kwargs)
+        context = SQLContext(source.url, source.connection, source.schema)
+        try:
+            return table_fingerprint(context.connection, source.table_name, source.schema)
+        finally:
+            context.close()
+
     def run(self):
         for row in self.stream.rows():
             self.put(row)
@@ -642,3 +750,288 @@ class GeneratorFunctionSourceNode(SourceNode):
         for row in self.function(*self.args, **self.kwargs):
             self.put(row)
 
+
+class SyntheticSourceNode(SourceNode):
+    """Source node that generates random rows. Values are generated according to field storage
+    types and per-field distributions, see :class:`brewery.ds.SyntheticDataSource` for
+    description of the distributions. Rows are generated and passed to the output in large
+    batches, column by column, so the node can be used to load-test streams without preparing
+    data files.
+
+    Example::
+
+        node = SyntheticSourceNode(fields=[("id", "integer"), ("category", "string"),
+                                           ("amount", "float")],
+                                   count=10000000, seed=0)
+        node.distributions = {
+            "id": {"distribution": "sequence"},
+            "category": {"distribution": "zipf", "cardinality": 1000, "null_ratio": 0.01},
+            "amount": {"min": 0, "max": 1000}
+        }
+    """
+
+    node_info = {
+        "label" : "Synthetic Data Source",
+        "description" : "Generate random rows with given fields and value distributions",
+        "attributes" : [
+            {
+                 "name": "fields",
+                 "description": "Fields to be generated"
+            },
+            {
+                 "name": "count",
+                 "description": "Number of rows, default is 1000"
+            },
+            {
+                 "name": "distributions",
+                 "description": "Dictionary of value distributions by field name"
+            },
+            {
+                 "name": "seed",
+                 "description": "Random seed"
+            },
+            {
+                 "name": "batch_size",
+                 "description": "Number of rows generated at once, default is 10000"
+            }
+        ]
+    }
+
+    output_format = "batches"
+
+    def __init__(self, fields=None, count=1000, distributions=None, seed=None,
+                 batch_size=10000):
+        super(SyntheticSourceNode, self).__init__()
+        self.fields = fields
+        self.count = count
+        self.distributions = distributions
+        self.seed = seed
+        self.batch_size = batch_size
+        self.stream = None
+
+    @property
+    def output_fields(self):
+        if not self.stream:
+            raise ValueError("Stream is not initialized")
+        return self.stream.fields
+
+    def initialize(self):
+        self.stream = SyntheticDataSource(self.fields, self.count, self.distributions,
+                                          self.seed, self.batch_size)
+        self.stream.initialize()
+
+    def run(self):
+        for batch in self.stream.batches():
+            self.put_batch(batch)
+
+    def finalize(self):
+        self.stream.finalize()
+
+class DataFrameSourceNode(SourceNode):
+    """Source node that reads rows of a pandas data frame. Rows are passed in batches of
+    `chunk_size` rows, numeric columns as slices of the data frame columns, so the data are not
+    converted into python rows unless a following node reads rows. See
+    :class:`brewery.ds.DataFrameDataSource`.
+
+    Example::
+
+        node = DataFrameSourceNode(dataframe)
+    """
+
+    node_info = {
+        "label" : "Data Frame Source",
+        "description" : "Read rows of a pandas data frame",
+        "protected": True,
+        "attributes" : [
+            {
+                 "name": "dataframe",
+                 "description": "pandas data frame"
+            },
+            {
+                 "name": "fields",
+                 "description": "Fields to be read, default are all columns with storage types "
+                                "derived from column types"
+            },
+            {
+                 "name": "chunk_size",
+                 "description": "Number of rows passed at once, default is 10000"
+            }
+        ]
+    }
+
+    output_format = "batches"
+
+    def __init__(self, dataframe=None, fields=None, chunk_size=10000):
+        super(DataFrameSourceNode, self).__init__()
+        self.dataframe = dataframe
+        self.fields = fields
+        self.chunk_size = chunk_size
+        self.stream = None
+
+    @property
+    def output_fields(self):
+        if not self.stream:
+            raise ValueError("Stream is not initialized")
+        return self.stream.fields
+
+    def initialize(self):
+        self.stream = DataFrameDataSource(self.dataframe, self.fields, self.chunk_size)
+        self.stream.initialize()
+
+    def run(self):
+        for batch in self.stream.batches():
+            self.put_batch(batch)
+
+    def finalize(self):
+        self.stream.finalize()
+
+class _ArrowFileSourceNode(SourceNode):
+    """Base of source nodes reading typed columnar files."""
+
+    output_format = "batches"
+    stream_class = None
+
+    def __init__(self, resource=None, batch_size=10000):
+        """Creates a source node reading file `resource` in batches of at most `batch_size`
+        rows.
+
+        :Attributes:
+            * `projection` - list of names of columns to be read, ``None`` means all columns.
+              Set by the optimizer to the fields used downstream.
+            * `limit` - maximal number of rows to be read, ``None`` means all rows. Set by the
+              optimizer when only first rows are used downstream.
+        """
+        super(_ArrowFileSourceNode, self).__init__()
+        self.resource = resource
+        self.batch_size = batch_size
+        self.projection = None
+        self.limit = None
+        self.stream = None
+
+    @property
+    def output_fields(self):
+        if not self.stream:
+            raise ValueError("Stream is not initialized")
+        return self.stream.fields
+
+    def initialize(self):
+        self.stream = self.stream_class(self.resource, self.projection, self.limit,
+                                        self.batch_size)
+        self.stream.initialize()
+
+    def scan_key(self):
+        return (type(self), self.resource, self.projection, self.limit)
+
+    def run(self):
+        for batch in self.stream.batches():
+            self.put_batch(batch)
+
+    def finalize(self):
+        self.stream.finalize()
+
+class ArrowSourceNode(_ArrowFileSourceNode):
+    """Source node that reads an Arrow IPC file. Fields are read from the file with storage types
+    of the file columns. Data are passed in batches, integer and float columns as numpy arrays
+    mapped from the file. See :class:`brewery.ds.ArrowDataSource`.
+
+    Example::
+
+        node = ArrowSourceNode("transactions.arrow")
+    """
+
+    node_info = {
+        "label" : "Arrow Source",
+        "description" : "Read data from an Arrow IPC file",
+        "attributes" : [
+            {
+                 "name": "resource",
+                 "description": "File name or file-like object"
+            },
+            {
+                 "name": "batch_size",
+                 "description": "Maximal number of rows passed at once, default is 10000"
+            }
+        ]
+    }
+
+    stream_class = ArrowDataSource
+
+class ParquetSourceNode(_ArrowFileSourceNode):
+    """Source node that reads a Parquet file. Fields are read from the file with storage types of
+    the file columns. Only columns used downstream are read, one row group at a time. Data are
+    passed in batches, integer and float columns as numpy arrays. See
+    :class:`brewery.ds.ParquetDataSource`.
+
+    Example::
+
+        node = ParquetSourceNode("transactions.parquet")
+    """
+
+    node_info = {
+        "label" : "Parquet Source",
+        "description" : "Read data from a Parquet file",
+        "attributes" : [
+            {
+                 "name": "resource",
+                 "description": "File name or file-like object"
+            },
+            {
+                 "name": "batch_size",
+                 "description": "Maximal number of rows passed at once, default is 10000"
+            }
+        ]
+    }
+
+    stream_class = ParquetDataSource
+
+class ReplaySourceNode(SourceNode):
+    """Source node that replays rows recorded from a pipe with :meth:`Stream.record` (or written
+    by :class:`brewery.ds.BinaryDataTarget`). Output fields are the fields of the recorded pipe.
+    Rows are read in the recorded batches and passed to the output as they are, at full speed.
+
+    Example - record a pipe of a slow stream::
+
+        stream.record("source", "aggregate", "capture.brw")
+        stream.run()
+
+    and replay it to reproduce the rest of the stream in isolation::
+
+        stream = Stream()
+        stream.add(ReplaySourceNode("capture.brw"), "source")
+        ...
+    """
+
+    node_info = {
+        "label" : "Replay Source",
+        "description" : "Replay rows recorded from a stream pipe",
+        "attributes" : [
+            {
+                 "name": "resource",
+                 "description": "Recording file name"
+            }
+        ]
+    }
+
+    output_format = "batches"
+
+    def __init__(self, resource=None):
+        super(ReplaySourceNode, self).__init__()
+        self.resource = resource
+        self.stream = None
+
+    @property
+    def output_fields(self):
+        if not self.stream:
+            raise ValueError("Stream is not initialized")
+        return self.stream.fields
+
+    def initialize(self):
+        self.stream = BinaryDataSource(self.resource)
+        self.stream.initialize()
+
+    def run(self):
+        for batch in self.stream.batches():
+            self.put_batch(batch)
+
+    def finalize(self):
+        self.stream.finalize()
@@ -4,7 +4,11 @@ from __future__ import absolute_import
 from .base import TargetNode
 from ..ds.csv_streams import CSVDataTarget
 from ..ds.sql_streams import SQLDataTarget
+from ..ds.pandas_streams import DataFrameDataTarget
+from ..ds.arrow_streams import ArrowDataTarget, ParquetDataTarget
+from ..metadata import FieldMap
 import sys
+import string
 
 class StreamTargetNode(TargetNode):
     """Generic data stream target. Wraps a :mod:`brewery.ds` data target and feeds data from the
@@ -74,6 +78,9 @@ class RowListTargetNode(TargetNode):
         else:
             self.list = []
 
+    def memory_behavior(self):
+        return ("buffering", "all rows are collected in a list")
+
     def run(self):
         self.list = []
         for row in self.input.rows():
@@ -107,6 +114,9 @@ class RecordListTargetNode(TargetNode):
         else:
             self.list = []
 
+    def memory_behavior(self):
+        return ("buffering", "all records are collected in a list")
+
     def run(self):
         self.list = []
         for record in self.input.records():
@@ -116,6 +126,136 @@ class RecordListTargetNode(TargetNode):
     def records(self):
         return self.list
 
+class DataFrameTargetNode(TargetNode):
+    """Target node that collects data from input into a pandas data frame, available as
+    `dataframe` when the stream finishes. Data are collected by columns in chunks, numeric
+    columns as numpy arrays, see :class:`brewery.ds.DataFrameDataTarget`.
+    """
+
+    node_info = {
+        "label" : "Data Frame Target",
+        "description" : "Collect data into a pandas data frame",
+        "attributes" : [
+            {
+                 "name": "dataframe",
+                 "description": "Created data frame."
+            },
+            {
+                 "name": "chunk_size",
+                 "description": "Number of rows converted into columns at once, default is "
+                                "10000"
+            }
+        ]
+    }
+
+    input_format = "batches"
+
+    def __init__(self, chunk_size=10000):
+        super(DataFrameTargetNode, self).__init__()
+        self.chunk_size = chunk_size
+        self.stream = None
+        self.dataframe = None
+
+    def memory_behavior(self):
+        return ("buffering", "all data are collected in column arrays")
+
+    def initialize(self):
+        self.stream = DataFrameDataTarget(self.input_fields, self.chunk_size)
+        self.stream.initialize()
+
+    def run(self):
+        for batch in self.input.batches():
+            self.stream.append_batch(batch)
+
+    def finalize(self):
+        self.stream.finalize()
+        self.dataframe = self.stream.dataframe
+
+class ArrowTargetNode(TargetNode):
+    """Target node that writes data into an Arrow IPC file. Column types are derived from
+    storage types of the input fields, see :class:`brewery.ds.ArrowDataTarget`.
+    """
+
+    node_info = {
+        "label" : "Arrow Target",
+        "description" : "Write data into an Arrow IPC file",
+        "attributes" : [
+            {
+                 "name": "resource",
+                 "description": "Target file name or file-like object"
+            },
+            {
+                 "name": "chunk_size",
+                 "description": "Number of rows of one record batch of the file, default is "
+                                "10000"
+            }
+        ]
+    }
+
+    input_format = "batches"
+
+    def __init__(self, resource=None, chunk_size=10000):
+        super(ArrowTargetNode, self).__init__()
+        self.resource = resource
+        self.chunk_size = chunk_size
+        self.stream = None
+
+    def initialize(self):
+        self.stream = ArrowDataTarget(self.resource, self.input_fields, self.chunk_size)
+        self.stream.initialize()
+
+    def run(self):
+        for batch in self.input.batches():
+            self.stream.append_batch(batch)
+
+    def finalize(self):
+        self.stream.finalize()
+
+class ParquetTargetNode(TargetNode):
+    """Target node that writes data into a Parquet file. Column types are derived from storage
+    types of the input fields, see :class:`brewery.ds.ParquetDataTarget`.
+    """
+
+    node_info = {
+        "label" : "Parquet Target",
+        "description" : "Write data into a Parquet file",
+        "attributes" : [
+            {
+                 "name": "resource",
+                 "description": "Target file name or file-like object"
+            },
+            {
+                 "name": "row_group_size",
+                 "description": "Number of rows of one row group, default is 100000"
+            },
+            {
+                 "name": "compression",
+                 "description": "Compression codec: snappy (default), gzip, brotli or none"
+            }
+        ]
+    }
+
+    input_format = "batches"
+
+    def __init__(self, resource=None, row_group_size=100000, compression="snappy"):
+        super(ParquetTargetNode, self).__init__()
+        self.resource = resource
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.stream = None
+
+    def initialize(self):
+        self.stream = ParquetDataTarget(self.resource, self.input_fields, self.row_group_size,
+                                        self.compression)
+        self.stream.initialize()
+
+    def run(self):
+        for batch in self.input.batches():
+            self.stream.append_batch(batch)
+
+    def finalize(self):
+        self.stream.finalize()
+
 class CSVTargetNode(TargetNode):
     """Node that writes rows into a comma separated values (CSV) file.
 
@@ -288,11 +428,20 @@ class FormattedPrinterNode(TargetNode):
             if self.delimiter:
                 self.handle.write(self.delimiter)
 
-        for record in self.input.records():
-            self.handle.write(format_string.format(**record).encode("utf-8"))
+        row_format = _positional_format(format_string, names)
+        if row_format is not None:
+            # Fields are formatted from rows by index, without a record dictionary
+            for row in self.input.rows():
+                self.handle.write(row_format.format(*row).encode("utf-8"))
 
-            if self.delimiter:
-                self.handle.write(self.delimiter)
+                if self.delimiter:
+                    self.handle.write(self.delimiter)
+        else:
+            for record in self.input.records():
+                self.handle.write(format_string.format(**record).encode("utf-8"))
+
+                if self.delimiter:
+                    self.handle.write(self.delimiter)
 
         if self.footer:
             self.handle.write(self.footer)
@@ -307,6 +456,38 @@ class FormattedPrinterNode(TargetNode):
             if self.close_handle:
                 self.handle.close()
 
+def _positional_format(format_string, names):
+    """Return `format_string` with replacement fields referring to field `names` replaced by
+    field indexes, so that it can be formatted with a row instead of a record. Returns ``None``
+    if the format string refers to something else than a field name."""
+
+    indexes = dict((name, index) for (index, name) in enumerate(names))
+    result = []
+
+    for (literal, field_name, spec, conversion) in string.Formatter().parse(format_string):
+        result.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field_name is None:
+            continue
+
+        # Attribute or item access, such as {date.year} or {values[0]}
+        split = min([i for i in (field_name.find("."), field_name.find("[")) if i >= 0]
+                    or [len(field_name)])
+        name = field_name[:split]
+        if name not in indexes:
+            return None
+
+        field = u"%d%s" % (indexes[name], field_name[split:])
+        if conversion:
+            field += u"!" + conversion
+        if spec:
+            spec = _positional_format(spec, names)
+            if spec is None:
+                return None
+            field += u":" + spec
+        result.append(u"{" + field + u"}")
+
+    return u"".join(result)
+
 class PrettyPrinterNode(TargetNode):
     """Target node that will pretty print output as a table.
     """
@@ -376,12 +557,16 @@ class PrettyPrinterNode(TargetNode):
         for i, value in enumerate(row):
             self.widths[i] = max(self.widths[i], len(unicode(value)))
 
+    def memory_behavior(self):
+        return ("blocking", "all rows are held to compute column widths before printing")
+
     def run(self):
 
         rows = []
 
         for row in self.input.rows():
-            rows.append(row)
+            # Tuples take less memory than lists
+            rows.append(tuple(row))
             self._update_widths(row)
 
         #
@@ -469,6 +654,17 @@ class SQLTableTargetNode(TargetNode):
 
     def __init__(self, url=None, table=None, truncate=False, create=False,
                  replace=False, **kwargs):
+        """Creates a SQL table target node. Other arguments are passed to
+        :class:`SQLDataTarget`.
+
+        :Attributes:
+            * `insert_from` - list of nodes: :class:`SQLSourceNode` followed by
+              :class:`FieldMapNode` nodes that lead to this node, or ``None``. When set, the
+              node has no input and rows of the source are inserted by the database with
+              ``INSERT ... SELECT``. Set by the optimizer when the source uses the same database.
+            * `metadata_cache` - :class:`brewery.cache.MetadataCache` where the reflected table
+              is stored. Set by the stream from :attr:`Stream.metadata_cache`.
+        """
         super(SQLTableTargetNode, self).__init__()
         self.url = url
         self.table = table
@@ -478,29 +674,62 @@ class SQLTableTargetNode(TargetNode):
 
         self.kwargs = kwargs
         self.stream = None
+        self.insert_from = None
+        self.metadata_cache = None
+        self._select_names = None
 
         # FIXME: document this
         self.concrete_type_map = None
 
     def initialize(self):
+        kwargs = dict(self.kwargs)
+        if self.metadata_cache is not None:
+            kwargs["metadata_cache"] = self.metadata_cache
         self.stream = SQLDataTarget(url=self.url,
                                 table=self.table,
                                 truncate=self.truncate,
                                 create=self.create,
                                 replace=self.replace,
-                                **self.kwargs)
+                                **kwargs)
 
-        self.stream.fields = self.input_fields
+        if self.insert_from:
+            self.stream.fields = self._initialize_insert_from()
+        else:
+            self.stream.fields = self.input_fields
         self.stream.concrete_type_map = self.concrete_type_map
         self.stream.initialize()
 
+    def _initialize_insert_from(self):
+        """Initialize source of `insert_from` and return fields the node would get through the
+        field maps. Names of source fields to be selected are kept in `_select_names`."""
+        source = self.insert_from[0]
+        source.initialize()
+
+        fields = source.output_fields
+        names = fields.names()
+        for node in self.insert_from[1:]:
+            field_map = FieldMap(rename=node.mapped_fields, drop=node.dropped_fields,
+                                 keep=node.kept_fields)
+            names = field_map.row_filter(fields).filter(names)
+            fields = field_map.map(fields)
+
+        self._select_names = names
+        return fields
+
     def run(self):
+        if self.insert_from:
+            statement = self.insert_from[0].stream.select_statement(self._select_names)
+            self.stream.insert_select(statement)
+            return
+
         for row in self.input.rows():
             self.stream.append(row)
 
     def finalize(self):
         """Flush remaining records and close the connection if necessary"""
         self.stream.finalize()
+        if self.insert_from:
+            self.insert_from[0].finalize()
 
 # Original name is depreciated
 DatabaseTableTargetNode = SQLTableTargetNode
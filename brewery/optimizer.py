@@ -0,0 +1,696 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Rule based stream optimizer. Optimizer creates an execution plan of a stream - a copy of the
+stream graph rewritten by optimizer rules. The original stream is not modified.
+
+Rules use node hints: :attr:`Node.row_operation`, :meth:`Node.consumed_fields` and
+:meth:`Node.produced_fields`."""
+
+import functools
+from collections import OrderedDict
+from brewery.graph import Graph
+from brewery.metadata import FieldMap
+from brewery.nodes.record_nodes import MergeNode, SelectNode, SetSelectNode, SampleNode, \
+                                       AggregateNode
+from brewery.nodes.base import SourceNode
+from brewery.nodes.source_nodes import SQLSourceNode
+from brewery.nodes.field_nodes import FieldMapNode
+from brewery.nodes.target_nodes import SQLTableTargetNode
+from brewery.ds.sql_streams import sql_condition, sql_set_condition
+
+__all__ = (
+    "StreamPlan",
+    "OptimizerRule",
+    "FilterPushdownRule",
+    "SQLPredicatePushdownRule",
+    "SQLAggregationPushdownRule",
+    "SharedScanRule",
+    "ProjectionPushdownRule",
+    "DeadFieldEliminationRule",
+    "LimitPushdownRule",
+    "SQLInsertSelectRule",
+    "default_rules",
+    "aggressive_rules",
+    "optimize"
+)
+
+class StreamPlan(Graph):
+    """Execution plan of a stream: copy of stream nodes and connections that can be rewritten
+    by optimizer rules."""
+    def __init__(self, stream):
+        """Creates a plan for `stream`.
+
+        :Attributes:
+            * `input_order` - dictionary where keys are nodes with more than one input and values
+              are lists of source nodes in order of node inputs. The order is the order in which
+              the original stream would connect the inputs, rules have to keep it when they
+              rewrite connections, as nodes such as :class:`MergeNode` refer to inputs by index.
+            * `protected` - set of connections that should not be rewritten, such as recorded
+              pipes
+            * `attributes` - dictionary where keys are nodes and values are dictionaries of node
+              attributes to be set while the plan is executed. Original values are restored
+              afterwards. Use :meth:`attribute` and :meth:`set_attribute`.
+            * `rewrites` - list of descriptions of applied rewrites
+        """
+        super(StreamPlan, self).__init__()
+        self.nodes = OrderedDict(stream.nodes)
+        self.connections = set(stream.connections)
+
+        self.protected = set(stream.recordings.keys())
+        self.attributes = {}
+        self.rewrites = []
+
+        self.input_order = {}
+        for node in stream.sorted_nodes():
+            for target in self.node_targets(node):
+                self.input_order.setdefault(target, []).append(node)
+        for (node, sources) in self.input_order.items():
+            if len(sources) < 2:
+                del self.input_order[node]
+
+    def describe(self, node):
+        """Return node description used in rewrite descriptions."""
+        return "%s '%s'" % (node.identifier(), self.node_name(node))
+
+    def attribute(self, node, name):
+        """Return value of node attribute `name` as it will be when the plan is executed."""
+        values = self.attributes.get(node, {})
+        if name in values:
+            return values[name]
+        return getattr(node, name)
+
+    def set_attribute(self, node, name, value):
+        """Set node attribute `name` to `value` for execution of the plan. Do not modify the
+        original value in place, as the node is shared with the stream."""
+        self.attributes.setdefault(node, {})[name] = value
+
+    def substitute_input(self, node, old_source, new_source):
+        """Replace `old_source` with `new_source` in the input order of `node`."""
+        order = self.input_order.get(node)
+        if order:
+            order[order.index(old_source)] = new_source
+
+    def move_before(self, node, before):
+        """Move single-input `node` from its place in the graph in front of the single-input
+        node `before` which is the only source of `node`::
+
+            P -> before -> node -> T    becomes    P -> node -> before -> T
+        """
+        (source, ) = self.node_sources(before)
+        targets = self.node_targets(node)
+
+        self.remove_connection(source, before)
+        self.remove_connection(before, node)
+        for target in targets:
+            self.remove_connection(node, target)
+
+        self.connect(source, node)
+        self.connect(node, before)
+        for target in targets:
+            self.connect(before, target)
+            self.substitute_input(target, node, before)
+
+        self.substitute_input(before, source, node)
+
+    def bypass(self, node):
+        """Remove single-input `node` from the plan and connect its source directly to its
+        targets::
+
+            P -> node -> T    becomes    P -> T
+        """
+        (source, ) = self.node_sources(node)
+        targets = self.node_targets(node)
+
+        self.remove(node)
+        for target in targets:
+            self.connect(source, target)
+            self.substitute_input(target, node, source)
+
+    def downstream_nodes(self, node):
+        """Return set of nodes reachable from `node` through connections, `node` excluded."""
+        nodes = set()
+        pending = list(self.node_targets(node))
+        while pending:
+            target = pending.pop()
+            if target not in nodes:
+                nodes.add(target)
+                pending.extend(self.node_targets(target))
+        return nodes
+
+    def required_output_fields(self):
+        """Return dictionary where keys are nodes and values are sets of names of node output
+        fields that are used downstream, or ``None`` if all output fields might be used. Computed
+        from :meth:`Node.required_fields` in reverse topological order. Output of nodes without
+        targets and output passing through protected connections is considered fully used."""
+
+        required = {}
+
+        for node in reversed(self.sorted_nodes()):
+            targets = self.node_targets(node)
+            names = set() if targets else None
+
+            for target in targets:
+                if (node, target) in self.protected:
+                    names = None
+                    break
+                target_names = required[target]
+                if target_names is not None:
+                    target_names = sorted(target_names)
+                needed = target.required_fields(target_names)
+                if needed is None:
+                    names = None
+                    break
+                names |= set(needed)
+
+            required[node] = names
+
+        return required
+
+class OptimizerRule(object):
+    """Base class for optimizer rules."""
+
+    def apply(self, plan):
+        """Rewrite `plan`. Descriptions of rewrites should be appended to `plan.rewrites`.
+        Subclasses should implement this method."""
+        raise NotImplementedError("Subclasses of OptimizerRule should implement apply()")
+
+def _field_map(fmap):
+    """Return `fmap` (merge node map specification) as :class:`FieldMap`."""
+    if fmap is None or isinstance(fmap, FieldMap):
+        return fmap
+    return FieldMap(rename=fmap.get("rename"), drop=fmap.get("drop"), keep=fmap.get("keep"))
+
+class FilterPushdownRule(OptimizerRule):
+    """Move filters (nodes with `row_operation` ``"filter"``, such as :class:`SelectNode` or
+    :class:`SetSelectNode`) upstream, so that expensive nodes process only rows that are not
+    thrown away. A filter is moved:
+
+    * in front of a ``map`` node that does not create or change any field the filter reads
+    * in front of a :class:`MergeNode`, onto its master input, if the filter reads only fields
+      that come unchanged from the master input. This is known only if maps of all detail
+      inputs specify `keep` fields.
+
+    Only a node that passes data exactly to the filter is passed this way, so other branches of
+    the stream are not affected.
+    """
+
+    def apply(self, plan):
+        filters = [node for node in plan.sorted_nodes() if node.row_operation == "filter"]
+
+        for node in filters:
+            consumed = node.consumed_fields()
+            if consumed is None:
+                continue
+            consumed = set(consumed)
+
+            while self._push(plan, node, consumed):
+                pass
+
+    def _push(self, plan, node, consumed):
+        sources = plan.node_sources(node)
+        if len(sources) != 1:
+            return False
+        source = sources[0]
+
+        if len(plan.node_targets(source)) != 1 or (source, node) in plan.protected:
+            return False
+
+        if source.row_operation == "map":
+            return self._push_through_map(plan, node, source, consumed)
+        elif isinstance(source, MergeNode):
+            return self._push_through_merge(plan, node, source, consumed)
+        else:
+            return False
+
+    def _push_through_map(self, plan, node, source, consumed):
+        produced = source.produced_fields()
+        if produced is None or consumed & set(produced):
+            return False
+
+        upstream = plan.node_sources(source)
+        if len(upstream) != 1 or (upstream[0], source) in plan.protected:
+            return False
+
+        plan.move_before(node, source)
+        plan.rewrites.append("%s moved before %s" % (plan.describe(node),
+                                                     plan.describe(source)))
+        return True
+
+    def _push_through_merge(self, plan, node, merge, consumed):
+        order = plan.input_order.get(merge)
+        if not order or merge.master >= len(order):
+            return False
+
+        master = order[merge.master]
+        if (master, merge) in plan.protected:
+            return False
+
+        maps = merge.maps or {}
+
+        # Fields that come from details must be known and must not be read by the filter
+        for tag in range(len(order)):
+            if tag == merge.master:
+                continue
+            fmap = _field_map(maps.get(tag))
+            if not fmap or not fmap.keep:
+                return False
+            detail_names = set(fmap.rename.get(name, name) for name in fmap.keep)
+            if consumed & detail_names:
+                return False
+
+        # Fields read by the filter should pass from master unchanged
+        fmap = _field_map(maps.get(merge.master))
+        if fmap:
+            renamed = set(fmap.rename.keys()) | set(fmap.rename.values())
+            if consumed & renamed:
+                return False
+            if fmap.keep and not consumed <= set(fmap.keep):
+                return False
+            if consumed & set(fmap.drop):
+                return False
+
+        targets = plan.node_targets(node)
+        plan.remove_connection(master, merge)
+        plan.remove_connection(merge, node)
+        for target in targets:
+            plan.remove_connection(node, target)
+
+        plan.connect(master, node)
+        plan.connect(node, merge)
+        for target in targets:
+            plan.connect(merge, target)
+            plan.substitute_input(target, node, merge)
+
+        plan.substitute_input(merge, master, node)
+
+        plan.rewrites.append("%s moved before %s onto master input from %s"
+                             % (plan.describe(node), plan.describe(merge),
+                                plan.describe(master)))
+        return True
+
+class SQLPredicatePushdownRule(OptimizerRule):
+    """Push filters directly following a :class:`SQLSourceNode` into the database as ``WHERE``
+    condition, so only matching rows are read. The filter node is removed from the plan.
+
+    Pushed are :class:`SelectNode` conditions that can be translated by
+    :func:`brewery.ds.sql_streams.sql_condition` and :class:`SetSelectNode` value sets. Rows with
+    ``NULL`` values are selected the same way as the filter would select rows with ``None``.
+    """
+
+    def apply(self, plan):
+        filters = [node for node in plan.sorted_nodes() if node.row_operation == "filter"]
+
+        for node in filters:
+            sources = plan.node_sources(node)
+            if len(sources) != 1:
+                continue
+            source = sources[0]
+            if not isinstance(source, SQLSourceNode) \
+                    or len(plan.node_targets(source)) != 1 \
+                    or (source, node) in plan.protected:
+                continue
+
+            condition = self._condition(node)
+            if not condition:
+                continue
+
+            rewrite = "%s pushed into %s as SQL condition" % (plan.describe(node),
+                                                              plan.describe(source))
+            conditions = plan.attribute(source, "conditions")
+            plan.set_attribute(source, "conditions", conditions + [condition])
+            plan.bypass(node)
+            plan.rewrites.append(rewrite)
+
+    def _condition(self, node):
+        """Return function creating SQL clause equivalent to filter `node` from table columns or
+        ``None`` if the filter can not be translated."""
+
+        if isinstance(node, SelectNode):
+            if not isinstance(node.condition, basestring) or node.discard:
+                return None
+            if sql_condition(node.condition) is None:
+                return None
+            return functools.partial(sql_condition, node.condition)
+
+        elif isinstance(node, SetSelectNode):
+            if node.value_set is None:
+                return None
+            return functools.partial(sql_set_condition, node.field, list(node.value_set),
+                                     node.discard)
+
+        return None
+
+def _sql_source_path(plan, node):
+    """Return list of nodes from `node` through field maps to a SQL source or ``None`` if there
+    is no such path. Each node on the path has only one input and each source only one target."""
+    path = [node]
+
+    while True:
+        sources = plan.node_sources(node)
+        if len(sources) != 1:
+            return None
+        source = sources[0]
+        if len(plan.node_targets(source)) != 1 or (source, node) in plan.protected:
+            return None
+
+        path.append(source)
+
+        if isinstance(source, SQLSourceNode) and not plan.node_sources(source):
+            return path
+        elif not isinstance(source, FieldMapNode):
+            return None
+
+        node = source
+
+class SQLAggregationPushdownRule(OptimizerRule):
+    """Compute :class:`AggregateNode` by the database when the node reads from a
+    :class:`SQLSourceNode`, directly or through :class:`FieldMapNode` nodes. The source gets
+    `aggregation` and produces the same fields as the aggregate node would, the aggregate node and
+    field maps are removed from the plan. Filters pushed into the source before are applied in
+    the ``WHERE`` clause.
+
+    Output differs from the aggregate node in order of the groups and in handling of ``NULL``
+    values, which are ignored by the database, while the aggregate node fails on ``None``.
+    Therefore the rule is not in `default_rules`, only in `aggressive_rules`.
+    """
+
+    def apply(self, plan):
+        aggregates = [node for node in plan.sorted_nodes() if isinstance(node, AggregateNode)]
+
+        for aggregate in aggregates:
+            path = _sql_source_path(plan, aggregate)
+            if not path:
+                continue
+
+            source = path[-1]
+            if plan.attribute(source, "aggregation") is not None \
+                    or plan.attribute(source, "projection") is not None \
+                    or plan.attribute(source, "limit") is not None:
+                continue
+
+            maps = path[1:-1]
+
+            keys = self._columns(aggregate.key_fields, maps)
+            measures = self._columns(aggregate.measures, maps)
+            if keys is None or measures is None:
+                continue
+
+            rename = {}
+            for (column, name) in zip(keys + measures, aggregate.key_fields + aggregate.measures):
+                if column != name:
+                    rename[column] = name
+
+            aggregation = {
+                "keys": keys,
+                "measures": measures,
+                "record_count_field": aggregate.record_count_field,
+                "rename": rename
+            }
+
+            rewrite = "%s pushed into %s as GROUP BY query" % (plan.describe(aggregate),
+                                                               plan.describe(source))
+            plan.set_attribute(source, "aggregation", aggregation)
+            for node in path[:-1]:
+                plan.bypass(node)
+            plan.rewrites.append(rewrite)
+
+    def _columns(self, names, maps):
+        """Return list of source column names of fields `names` passed through field `maps`
+        (ordered from the aggregate node towards the source) or ``None`` if some field is dropped
+        on the way."""
+        columns = []
+        for name in names:
+            for fmap in maps:
+                sources = dict((target, source) for (source, target)
+                                                in fmap.mapped_fields.items())
+                name = sources.get(name, name)
+                if name in fmap.dropped_fields \
+                        or (fmap.kept_fields and name not in fmap.kept_fields):
+                    return None
+            columns.append(name)
+        return columns
+
+def _comparable(value):
+    """Return `value` with partial functions replaced by tuples, so that partial functions
+    created by rules from equal arguments compare equal."""
+    if isinstance(value, functools.partial):
+        return (value.func, _comparable(value.args), _comparable(value.keywords or {}))
+    elif isinstance(value, (list, tuple)):
+        return [_comparable(item) for item in value]
+    elif isinstance(value, dict):
+        return dict((key, _comparable(item)) for (key, item) in value.items())
+    return value
+
+class SharedScanRule(OptimizerRule):
+    """Read data only once when more source nodes read the same data: source nodes with equal
+    :meth:`SourceNode.scan_key` and equal attributes set by the plan are replaced by the first
+    of them, which feeds targets of all of them. Sources with unknown key (``None``) are not
+    merged, neither are sources with recorded outputs or sources whose outputs meet in the same
+    node downstream.
+
+    The rule runs after filters are pushed into sources, so only sources with the same pushed
+    filters are merged, and before projection pushdown, so the shared source reads fields used
+    by any of the branches.
+    """
+
+    def apply(self, plan):
+        scans = []
+
+        for node in plan.sorted_nodes():
+            if plan.node_sources(node) or not isinstance(node, SourceNode):
+                continue
+
+            key = node.scan_key()
+            if key is None:
+                continue
+            key = (_comparable(key), _comparable(plan.attributes.get(node, {})))
+
+            for (shared, shared_key) in scans:
+                if shared_key == key and self._can_merge(plan, node, shared):
+                    self._merge(plan, node, shared)
+                    break
+            else:
+                scans.append((node, key))
+
+    def _can_merge(self, plan, node, shared):
+        # Branches meeting again downstream, such as master and detail of a merge, would wait
+        # for each other on the single shared reader
+        if plan.downstream_nodes(node) & plan.downstream_nodes(shared):
+            return False
+        targets = plan.node_targets(node)
+        return not any((node, target) in plan.protected for target in targets)
+
+    def _merge(self, plan, node, shared):
+        rewrite = "%s merged into %s as shared scan" % (plan.describe(node),
+                                                       plan.describe(shared))
+        targets = plan.node_targets(node)
+        plan.remove(node)
+        for target in targets:
+            plan.connect(shared, target)
+            plan.substitute_input(target, node, shared)
+        plan.rewrites.append(rewrite)
+
+class ProjectionPushdownRule(OptimizerRule):
+    """Tell source nodes which fields are used downstream, so they do not read the others. Source
+    nodes supporting projection have attribute `projection` – list of field names to be read,
+    such as :class:`CSVSourceNode` (unused columns are not decoded) or :class:`SQLSourceNode`
+    (only used columns are selected).
+
+    Fields used downstream are known only if a node on each path from the source narrows the
+    fields, such as :class:`FieldMapNode` with `keep_fields` or :class:`AggregateNode`, and all
+    nodes between the source and such node declare what they read with
+    :meth:`Node.required_fields`.
+    """
+
+    def apply(self, plan):
+        required = plan.required_output_fields()
+
+        for node in plan.nodes.values():
+            if plan.node_sources(node) or not hasattr(node, "projection"):
+                continue
+            if hasattr(node, "aggregation") and plan.attribute(node, "aggregation") is not None:
+                continue
+
+            names = required.get(node)
+            if not names:
+                continue
+
+            projection = plan.attribute(node, "projection")
+            if projection is not None:
+                names &= set(projection)
+            names = sorted(names)
+
+            plan.set_attribute(node, "projection", names)
+            plan.rewrites.append("%s reads only fields %s" % (plan.describe(node),
+                                                               ", ".join(names)))
+
+class DeadFieldEliminationRule(OptimizerRule):
+    """Drop fields that are not used downstream before nodes that keep or copy whole rows (nodes
+    with `holds_rows` flag, such as :class:`MergeNode`), so that less memory is held and fewer
+    values are copied. A :class:`FieldMapNode` keeping only used fields is inserted in front of
+    such node. Fields are not dropped if their source already reads only used fields or if it is
+    already a field map keeping only them.
+
+    Used fields are determined the same way as in :class:`ProjectionPushdownRule`.
+    """
+
+    def apply(self, plan):
+        required = plan.required_output_fields()
+
+        for target in list(plan.nodes.values()):
+            if not target.holds_rows:
+                continue
+
+            names = required.get(target)
+            if names is not None:
+                names = sorted(names)
+            needed = target.required_fields(names)
+            if needed is None:
+                continue
+            needed = set(needed)
+
+            for source in plan.node_sources(target):
+                if (source, target) in plan.protected or self._is_narrow(plan, source, needed):
+                    continue
+
+                keep = sorted(needed)
+                node = FieldMapNode(keep_fields=keep)
+                name = "%s_input_%s" % (plan.node_name(target), plan.node_name(source))
+                plan.add(node, name if name not in plan.nodes else None)
+
+                plan.remove_connection(source, target)
+                plan.connect(source, node)
+                plan.connect(node, target)
+                plan.substitute_input(target, source, node)
+
+                plan.rewrites.append("%s inserted before %s keeping fields %s"
+                                     % (plan.describe(node), plan.describe(target),
+                                        ", ".join(keep)))
+
+    def _is_narrow(self, plan, node, needed):
+        """Return ``True`` if `node` passes only `needed` fields already."""
+        if isinstance(node, FieldMapNode):
+            return bool(node.kept_fields) and node.kept_fields <= needed
+        if hasattr(node, "projection"):
+            projection = plan.attribute(node, "projection")
+            return projection is not None and set(projection) <= needed
+        return False
+
+class LimitPushdownRule(OptimizerRule):
+    """Push size of :class:`SampleNode` with method ``first`` into a source node with attribute
+    `limit` (such as :class:`SQLSourceNode`, :class:`CSVSourceNode` or :class:`XLSSourceNode`),
+    so the source stops reading after that number of rows. The limit is passed only over nodes
+    with `row_operation` ``"map"`` that have no other targets, as those do not change number of
+    rows. The sample node is kept.
+    """
+
+    def apply(self, plan):
+        for sample in list(plan.nodes.values()):
+            if not isinstance(sample, SampleNode) or sample.method != "first" \
+                    or sample.discard_sample:
+                continue
+
+            node = sample
+            while True:
+                sources = plan.node_sources(node)
+                if len(sources) != 1:
+                    break
+                source = sources[0]
+                if len(plan.node_targets(source)) != 1 or (source, node) in plan.protected:
+                    break
+
+                if not plan.node_sources(source) and hasattr(source, "limit"):
+                    self._set_limit(plan, source, sample)
+                    break
+                elif source.row_operation != "map":
+                    break
+
+                node = source
+
+    def _set_limit(self, plan, source, sample):
+        limit = plan.attribute(source, "limit")
+        if limit is not None and limit <= sample.size:
+            return
+
+        plan.set_attribute(source, "limit", sample.size)
+        plan.rewrites.append("limit %d of %s pushed into %s" % (sample.size,
+                                                                 plan.describe(sample),
+                                                                 plan.describe(source)))
+
+class SQLInsertSelectRule(OptimizerRule):
+    """Let the database copy rows when a :class:`SQLTableTargetNode` reads from a
+    :class:`SQLSourceNode` of the same database, directly or through :class:`FieldMapNode`
+    nodes, so rows are not fetched into python and inserted back. The source and the field maps
+    are removed from the plan and the target gets them as `insert_from`, it executes ``INSERT
+    ... SELECT``. Filters, projection and aggregation pushed into the source before are part of
+    the ``SELECT``.
+
+    The database is the same if both nodes use the same connection object or, without a
+    connection, the same URL.
+    """
+
+    def apply(self, plan):
+        targets = [node for node in plan.sorted_nodes() if isinstance(node, SQLTableTargetNode)]
+
+        for target in targets:
+            path = _sql_source_path(plan, target)
+            if not path:
+                continue
+
+            source = path[-1]
+            if source.args or not self._same_database(source, target):
+                continue
+
+            nodes = list(reversed(path[1:]))
+            rewrite = "%s copied into %s with INSERT ... SELECT" % (plan.describe(source),
+                                                                   plan.describe(target))
+            plan.set_attribute(target, "insert_from", nodes)
+            for node in nodes:
+                plan.remove(node)
+            plan.rewrites.append(rewrite)
+
+    def _same_database(self, source, target):
+        source_db = source.kwargs.get("connection") or source.kwargs.get("url")
+        target_db = target.kwargs.get("connection") or target.url
+        return source_db is not None and (source_db is target_db or source_db == target_db)
+
+"""Rules applied by default, in order. They do not change output of the stream."""
+default_rules = [
+    FilterPushdownRule,
+    SQLPredicatePushdownRule,
+    SharedScanRule,
+    ProjectionPushdownRule,
+    DeadFieldEliminationRule,
+    LimitPushdownRule,
+    SQLInsertSelectRule
+]
+
+"""Rules applied when requested with stream ``optimize = "aggressive"``, in order: default rules
+and rules that might change order of rows or handling of ``None`` values"""
+aggressive_rules = [
+    FilterPushdownRule,
+    SQLPredicatePushdownRule,
+    SQLAggregationPushdownRule,
+    SharedScanRule,
+    ProjectionPushdownRule,
+    DeadFieldEliminationRule,
+    LimitPushdownRule,
+    SQLInsertSelectRule
+]
+
+def optimize(stream, rules=None):
+    """Return :class:`StreamPlan` of `stream` rewritten by `rules` (list of
+    :class:`OptimizerRule` classes or instances, default is `default_rules`). `stream` might be a
+    :class:`StreamPlan` as well, which is then rewritten further."""
+
+    if isinstance(stream, StreamPlan):
+        plan = stream
+    else:
+        plan = StreamPlan(stream)
+
+    for rule in rules if rules is not None else default_rules:
+        if isinstance(rule, type):
+            rule = rule()
+        rule.apply(plan)
+
+    return plan
@@ -2,15 +2,24 @@
 
 import threading
 import sys
-from brewery.nodes.base import node_dictionary, TargetNode, NodeFinished
+import time
+import traceback
+import StringIO
+from brewery.nodes.base import node_dictionary, SourceNode, TargetNode, NodeFinished
 from brewery.utils import get_logger
 from brewery.nodes import *
 from brewery.common import *
+from brewery.ds.binary_streams import BinaryDataTarget
+from brewery.metadata import RecordView, Field, FieldList
+from brewery.batches import RecordBatch
+from brewery.optimizer import optimize, aggressive_rules, StreamPlan
+from brewery.cache import MetadataCache, ResultCache, value_fingerprint
 from .graph import *
 
 __all__ = [
     "Stream",
     "Pipe",
+    "RecordingPipe",
     "stream_from_dict",
     "create_builder"
 ]
@@ -23,6 +32,12 @@ def stream_from_dict(desc):
     stream.update(desc)
     return stream
 
+def _pipe_format(source, target):
+    """Return description of data passed from `source` to `target` node."""
+    if source.output_format == target.input_format:
+        return source.output_format
+    return "%s to %s" % (source.output_format, target.input_format)
+
 class SimpleDataPipe(object):
     """Dummy pipe for testing nodes"""
     def __init__(self):
@@ -45,6 +60,16 @@ class SimpleDataPipe(object):
         for row in self.rows():
             yield dict(zip(fields, row))
 
+    def record_views(self):
+        """Get data objects from pipe as read-only :class:`brewery.metadata.RecordView` objects.
+        Views are cheaper than records returned by `records()` when fields are accessed by
+        name."""
+        if not self.fields:
+            raise Exception("Can not provide records: fields for pipe are not initialized.")
+        indexes = self.fields.index_map()
+        for row in self.rows():
+            yield RecordView(row, indexes)
+
     def put_record(self, record):
         """Convenience method that will transform record into a row based on pipe fields."""
         row = [record.get(field) for field in self.fields.names()]
@@ -54,6 +79,17 @@ class SimpleDataPipe(object):
     def put(self, obj):
         self.buffer.append(obj)
 
+    def put_batch(self, batch):
+        self.buffer.extend(batch)
+
+    def batches(self, batch_size=1000):
+        """Get data from pipe as :class:`brewery.batches.RecordBatch` objects of `batch_size`
+        rows."""
+        rows = list(self.rows())
+        for start in xrange(0, len(rows), batch_size):
+            yield RecordBatch.from_rows(self.fields, rows[start:start + batch_size],
+                                        keep_rows=True)
+
     def done_receiving(self):
         self._closed = True
         pass
@@ -94,10 +130,20 @@ class Pipe(SimpleDataPipe):
         self.staging_buffer = []
         self._ready_buffer = None
 
+        # Row class rows are converted to when put into the pipe, see set_row_type()
+        self.row_type = None
+
         self._done_sending = False
         self._done_receiving = False
         self._closed = False
 
+        # Progress and state information, read by the stream watchdog.
+        # Counters are updated per buffer, not per row.
+        self.sent_count = 0
+        self.received_count = 0
+        self.sender_waiting = False
+        self.receiver_waiting = False
+
         # Taken from Python Queue implementation:
 
         # mutex must beheld whenever the queue is mutating.  All methods
@@ -128,6 +174,38 @@ class Pipe(SimpleDataPipe):
 
         if self.is_full():
             self._flush()
+
+    def _put_converted(self, obj):
+        """`put()` of pipes with `row_type`: rows are converted before they are buffered."""
+        self.staging_buffer.append(self.row_type(obj))
+
+        if self.is_full():
+            self._flush()
+
+    def set_row_type(self, row_type):
+        """Convert rows put into the pipe into `row_type`, such as a :class:`CompactRow` class.
+        The converting `put()` replaces the plain one only for this pipe, so that pipes without
+        conversion do not check for it on every row. Batches are passed as they are."""
+        self.row_type = row_type
+        if row_type is None:
+            self.__dict__.pop("put", None)
+        else:
+            self.put = self._put_converted
+
+    def put_batch(self, batch):
+        """Put :class:`brewery.batches.RecordBatch` into the pipe. Rows put before are enqueued
+        first, the batch is enqueued as a whole. Receiving node gets the batch from `batches()`
+        or its rows from `rows()`."""
+        if self.staging_buffer:
+            self._flush()
+        if not len(batch):
+            return
+        self.staging_buffer = batch
+        self._flush()
+        if self.staging_buffer is batch:
+            # Pipe was closed, batch was not enqueued
+            self.staging_buffer = []
+
     def _note(self, note):
         # print note
         pass
@@ -151,10 +229,13 @@ class Pipe(SimpleDataPipe):
 
         try:
             self._note("P _not_full wait ...")
+            self.sender_waiting = True
             while not self.is_consumed() and not self._closed:
                 self.not_full.wait()
+            self.sender_waiting = False
             self._note("P _not_full got <")
             if not self._closed:
+                self.sent_count += len(self.staging_buffer)
                 self._ready_buffer = self.staging_buffer
                 self.staging_buffer = []
                 self._closed = close
@@ -168,6 +249,20 @@ class Pipe(SimpleDataPipe):
     def rows(self):
         """Get data object from pipe. If there is no buffer ready, wait until source object sends
         some data."""
+        for buffer in self._buffers():
+            for row in buffer:
+                yield row
+
+    def batches(self):
+        """Get data from pipe as :class:`brewery.batches.RecordBatch` objects. Batches put by the
+        sender are passed as they are, rows are converted into one batch per pipe buffer."""
+        for buffer in self._buffers():
+            if not isinstance(buffer, RecordBatch):
+                buffer = RecordBatch.from_rows(self.fields, buffer, keep_rows=True)
+            yield buffer
+
+    def _buffers(self):
+        """Get buffers from pipe - lists of rows or record batches."""
 
         done_sending = False
         while not done_sending:
@@ -175,18 +270,20 @@ class Pipe(SimpleDataPipe):
             self.not_empty.acquire()
             try:
                 self._note("C _not_empty wait ...")
+                self.receiver_waiting = True
                 while not self._ready_buffer and not self._closed:
                     self.not_empty.wait()
+                self.receiver_waiting = False
                 self._note("C _not_empty got <")
 
                 if self._ready_buffer:
                     rows = self._ready_buffer
                     self._ready_buffer = None
+                    self.received_count += len(rows)
                     self._note("C _not_full notify >")
                     self.not_full.notify()
 
-                    for row in rows:
-                        yield row
+                    yield rows
                 else:
                     self._note("C no buffer")
 
@@ -216,6 +313,69 @@ class Pipe(SimpleDataPipe):
 
         self._note("C not_empty rel! r")
 
+    def abort(self):
+        """Close the pipe from outside of both sending and receiving thread, for example when
+        the stream is being stopped. Wakes up both sides if they are waiting."""
+        self.mutex.acquire()
+        try:
+            self._closed = True
+            self.not_full.notify_all()
+            self.not_empty.notify_all()
+        finally:
+            self.mutex.release()
+
+    def progress(self):
+        """Return a number that grows as data are moving through the pipe: rows staged, sent and
+        received. Used for detecting stalled streams."""
+        return self.sent_count + len(self.staging_buffer) + self.received_count
+
+class RecordingPipe(Pipe):
+    """Pipe that records all rows passing through it, together with the pipe fields, into a
+    binary row file. The file can be replayed with :class:`brewery.nodes.ReplaySourceNode`.
+
+    Rows are written in the sending thread, one frame per pipe buffer. Rows that were not passed
+    to the receiver, because it stopped receiving, are not recorded. Attribute `complete` is
+    ``True`` when the sender finished and all its rows were recorded.
+    """
+
+    def __init__(self, resource, buffer_size=1000):
+        super(RecordingPipe, self).__init__(buffer_size)
+        self.resource = resource
+        self.recorder = None
+        self.complete = False
+        self._lost_rows = False
+
+    def _flush(self, close=False):
+        if self.staging_buffer:
+            if self._closed:
+                self._lost_rows = True
+            else:
+                if not self.recorder:
+                    self._start_recording()
+                self.recorder.append_batch(self.staging_buffer)
+        super(RecordingPipe, self)._flush(close)
+
+    def _start_recording(self):
+        self.recorder = BinaryDataTarget(self.resource)
+        self.recorder.fields = self.fields
+        self.recorder.initialize()
+
+    def done_sending(self):
+        # Receiver that stopped before the sender finished might have missed some rows
+        receiving = not self._closed
+        super(RecordingPipe, self).done_sending()
+        self.complete = receiving and not self._lost_rows
+        self.finish_recording()
+
+    def finish_recording(self):
+        """Close the recording file. File with fields and no rows is written if nothing passed
+        through the pipe."""
+        if not self.recorder:
+            if self.fields is None:
+                return
+            self._start_recording()
+        self.recorder.finalize()
+
 class Stream(Graph):
     """Data processing stream"""
     def __init__(self, nodes=None, connections=None):
@@ -226,11 +386,84 @@ class Stream(Graph):
             * `connections` - list of two-item tuples. Each tuple contains source and target node
               or source and target node name.
             * `stream` - another stream or
+
+        :Attributes:
+            * `pipe_buffer_size` - number of rows collected in a pipe before they are passed to
+              the receiving node. Default is 1000.
+            * `compact_rows` - if ``True`` rows produced by source nodes are converted to
+              immutable :class:`brewery.metadata.CompactRow` tuples, which take less memory in
+              pipe buffers and in nodes holding rows. Default is ``False``.
+            * `optimize` - if ``True`` (default) the stream is rewritten by the optimizer
+              before it is run, for example filters are moved in front of expensive nodes. The
+              stream object itself is not changed. Rewrites are listed by :meth:`explain`.
+              Default rules do not change the output. Set to ``"aggressive"`` to apply also
+              rules that might change order of rows or handling of ``None`` values, such as
+              ``GROUP BY`` of aggregations in the database, or to a list of
+              :class:`brewery.optimizer.OptimizerRule` classes to apply.
+            * `stall_timeout` - number of seconds after which the stream is considered stalled if
+              no data moved through any of its pipes. State of the nodes and stacks of their
+              threads are logged when the stream stalls. Default is ``None`` - no stall
+              detection.
+            * `abort_on_stall` - if ``True`` then stalled stream is stopped and `StreamError` is
+              raised. Default is ``False`` - stall is only reported.
+            * `metadata_cache` - :class:`brewery.cache.MetadataCache` or path to its directory.
+              Source and target nodes store metadata that is expensive to obtain there, such as
+              reflected database tables or CSV headers, and reuse it in later runs while the
+              described resource does not change. The stream stores there resolved output fields
+              of source nodes, which :meth:`explain` uses instead of initializing the sources.
+              Default is ``None`` - no cache.
+            * `result_cache` - :class:`brewery.cache.ResultCache` or path to its directory where
+              output of nodes marked with :meth:`memoize` is stored. Default is ``None`` - no
+              cache, :meth:`memoize` has no effect.
         """
         super(Stream, self).__init__(nodes, connections)
         self.logger = get_logger()
 
         self.exceptions = []
+        self.pipes = []
+        self.pipe_buffer_size = 1000
+        self.recordings = {}
+        self.optimize = True
+        self.metadata_cache = None
+        self.compact_rows = False
+        self.result_cache = None
+        self.memoized = set()
+        self._pending_results = []
+        self._input_order = {}
+
+        self.stall_timeout = None
+        self.abort_on_stall = False
+        self._threads = []
+
+    def record(self, source, target, resource):
+        """Record rows passing from `source` node to `target` node into a binary row file
+        `resource`. Nodes might be specified by name. The recording can be replayed later with
+        :class:`brewery.nodes.ReplaySourceNode`, for example to reproduce and benchmark the part
+        of the stream after `source` without the original data sources.
+        """
+        source = self.coalesce_node(source)
+        target = self.coalesce_node(target)
+        if (source, target) not in self.connections:
+            raise StreamError("Nodes %s and %s are not connected" % (source, target))
+        self.recordings[(source, target)] = resource
+
+    def memoize(self, node):
+        """Store output of `node` in the `result_cache`, so that later runs replay it instead of
+        running the node and the nodes before it. Node might be specified by name.
+
+        The entry is identified by configuration of the node and of all nodes it depends on
+        (:meth:`Node.config_key`) and by fingerprints of resources read by the sources
+        (:meth:`SourceNode.resource_fingerprint`): size and modification time of local files
+        and hash of definition of database tables. Output of nodes that depend on a node without
+        known configuration, such as a function or a random sample, is not cached. Output of
+        nodes that depend on a source without fingerprint, such as a URL, is cached only if
+        the cache has `max_age`. Rows of database tables are not fingerprinted, use `max_age`
+        to expire results of tables that change.
+
+        Output is stored only when the whole stream run succeeded. Nodes before `node` that do
+        not feed other parts of the stream are not run when the output is replayed.
+        """
+        self.memoized.add(self.coalesce_node(node))
 
     def fork(self):
         """Creates a construction fork of the stream. Used for constructing streams in functional
@@ -293,6 +526,9 @@ class Stream(Graph):
                     raise Exception("Node dictionary has no 'type' key")
                 node_type = obj["type"]
 
+                if node_type not in node_dict:
+                    node_dict = node_dictionary(refresh=True)
+
                 if node_type in node_dict:
                     node_class = node_dict[node_type]
                     node_instance = node_class()
@@ -353,20 +589,13 @@ class Stream(Graph):
             node = self.coalesce_node(node_name)
             node.configure(config)
 
-    def _initialize(self):
-        """Initializes the data processing stream:
+    def _create_pipes(self, sorted_nodes):
+        """Create pipes between `sorted_nodes` according to connections. Inputs of nodes in
+        `_input_order` are ordered as specified there. Returns list of tuples (`source`,
+        `target`, `pipe`)."""
 
-        * sorts nodes based on connection dependencies
-        * creates pipes between nodes
-        * initializes each node
-        * initializes pipe fields
-
-        """
-
-        self.logger.info("initializing stream")
-        self.logger.debug("sorting nodes")
-        sorted_nodes = self.sorted_nodes()
         self.pipes = []
+        connected = []
 
         self.logger.debug("flushing pipes")
         for node in sorted_nodes:
@@ -380,10 +609,242 @@ class Stream(Graph):
             targets = self.node_targets(node)
             for target in targets:
                 self.logger.debug("  connecting with %s" % (target))
-                pipe = Pipe()
+                resource = self.recordings.get((node, target))
+                if resource is not None:
+                    pipe = RecordingPipe(resource, self.pipe_buffer_size)
+                else:
+                    pipe = Pipe(self.pipe_buffer_size)
                 node.add_output(pipe)
                 target.add_input(pipe)
                 self.pipes.append(pipe)
+                connected.append((node, target, pipe))
+
+        for (node, sources) in self._input_order.items():
+            pipes = dict((source, pipe) for (source, target, pipe) in connected
+                                        if target is node)
+            node.inputs = [pipes[source] for source in sources]
+
+        return connected
+
+    def _apply_plan(self):
+        """Replace stream nodes and connections with optimized plan and set node attributes
+        changed by the plan. Nodes with attribute `metadata_cache` get the stream's metadata
+        cache, output of memoized nodes is replayed from the result cache or recorded into it.
+        Returns tuple of original nodes, connections, attribute values and recordings to be
+        passed to `_restore_graph()` and the plan (``None`` if the stream is not optimized nor
+        memoized)."""
+
+        attributes = []
+
+        cache = self._metadata_cache()
+        if cache is not None:
+            for node in self.nodes.values():
+                if hasattr(node, "metadata_cache") and node.metadata_cache is None:
+                    attributes.append((node, "metadata_cache", None))
+                    node.metadata_cache = cache
+
+        recordings = self.recordings
+        memoized = self.memoized if self.result_cache is not None else set()
+
+        if not self.optimize and not memoized:
+            return ((self.nodes, self.connections, attributes, recordings), None)
+
+        plan = StreamPlan(self)
+
+        if memoized:
+            cache = self.result_cache
+            if isinstance(cache, basestring):
+                cache = ResultCache(cache)
+            self.recordings = dict(self.recordings)
+            # Downstream first: replayed node replaces memoized nodes before it
+            for node in reversed(plan.sorted_nodes()):
+                if node in memoized and node in plan.nodes.values():
+                    self._memoize(plan, cache, node)
+
+        if self.optimize:
+            if self.optimize == "aggressive":
+                rules = aggressive_rules
+            elif isinstance(self.optimize, (list, tuple)):
+                rules = self.optimize
+            else:
+                rules = None
+            plan = optimize(plan, rules)
+
+        for (node, values) in plan.attributes.items():
+            for (name, value) in values.items():
+                attributes.append((node, name, getattr(node, name)))
+                setattr(node, name, value)
+
+        saved = (self.nodes, self.connections, attributes, recordings)
+        self.nodes = plan.nodes
+        self.connections = plan.connections
+        self._input_order = plan.input_order
+
+        return (saved, plan)
+
+    def _metadata_cache(self):
+        """Return :class:`MetadataCache` of the stream or ``None``."""
+        cache = self.metadata_cache
+        if isinstance(cache, basestring):
+            cache = MetadataCache(cache)
+        return cache
+
+    def _fields_entry(self, node):
+        """Return tuple (`key`, `fingerprint`) of the metadata cache entry with output fields of
+        source `node`: the key describes what the node reads (:meth:`SourceNode.scan_key`), the
+        fingerprint is the fingerprint of the read resource, so that fields are resolved again
+        when the resource changes. Returns ``None`` if the node has no scan key or the resource
+        has no fingerprint."""
+        key = value_fingerprint(node.scan_key())
+        if key is None:
+            return None
+        fingerprint = node.resource_fingerprint()
+        if fingerprint is None:
+            return None
+        return (("source_fields", key), fingerprint)
+
+    def _cached_fields(self, cache, entry):
+        """Return fields stored in the metadata cache `entry` or ``None``."""
+        fields = cache.get(*entry)
+        if fields is None:
+            return None
+        return FieldList([Field(**field) for field in fields])
+
+    def _store_fields(self, cache, entry, fields):
+        """Store `fields` in the metadata cache `entry` if they are not there yet."""
+        if self._cached_fields(cache, entry) != fields:
+            (key, fingerprint) = entry
+            cache.set(key, fingerprint, [field.to_dict() for field in fields])
+
+    def _memoize(self, plan, cache, node):
+        """Replace memoized `node` and nodes feeding only this node with a replay of the cached
+        output, or record output of the node into the cache if it is not there yet."""
+
+        targets = plan.node_targets(node)
+        key = self._subgraph_key(plan, node, cache.max_age is not None)
+        if key is None or not targets:
+            self.logger.info("output of node %s can not be cached" % plan.describe(node))
+            return
+
+        path = cache.lookup(key)
+        if path:
+            removed = self._exclusive_ancestors(plan, node) | set([node])
+            if any(source in removed for (source, target) in self.recordings):
+                self.logger.info("cached output of node %s is not used, a replaced pipe is "
+                                 "recorded" % plan.describe(node))
+                return
+
+            name = plan.node_name(node)
+            rewrite = "output of %s replayed from result cache" % plan.describe(node)
+            for removed_node in removed:
+                plan.remove(removed_node)
+
+            replay = ReplaySourceNode(path)
+            plan.add(replay, name)
+            for target in targets:
+                plan.connect(replay, target)
+                plan.substitute_input(target, node, replay)
+            plan.rewrites.append(rewrite)
+        else:
+            target = sorted(targets, key=plan.node_name)[0]
+            if (node, target) in self.recordings:
+                return
+
+            temporary_path = cache.temporary_path()
+            self.recordings[(node, target)] = temporary_path
+            self._pending_results.append((cache, key, temporary_path))
+            plan.protected.update((node, target) for target in targets)
+            plan.rewrites.append("output of %s stored in result cache" % plan.describe(node))
+
+    def _subgraph_key(self, plan, node, expiring=False):
+        """Return fingerprint of `node` and all nodes it depends on, ``None`` if some of them
+        does not have known configuration or, unless the cached result is `expiring`, if some
+        of the sources has no resource fingerprint."""
+        nodes = self._ancestors(plan, node) | set([node])
+        keys = {}
+
+        for current in plan.sorted_nodes():
+            if current not in nodes:
+                continue
+            config = current.config_key()
+            if config is None:
+                return None
+            if isinstance(current, SourceNode) and not expiring \
+                    and current.resource_fingerprint() is None:
+                return None
+            sources = plan.input_order.get(current) or plan.node_sources(current)
+            key = value_fingerprint((config, [keys[source] for source in sources]))
+            if key is None:
+                return None
+            keys[current] = key
+
+        return keys[node]
+
+    def _ancestors(self, plan, node):
+        """Return set of nodes `node` depends on."""
+        ancestors = set()
+        queue = list(plan.node_sources(node))
+        while queue:
+            source = queue.pop()
+            if source not in ancestors:
+                ancestors.add(source)
+                queue += plan.node_sources(source)
+        return ancestors
+
+    def _exclusive_ancestors(self, plan, node):
+        """Return set of nodes `node` depends on that do not feed any other node."""
+        exclusive = self._ancestors(plan, node)
+        changed = True
+        while changed:
+            changed = False
+            for ancestor in list(exclusive):
+                for target in plan.node_targets(ancestor):
+                    if target is not node and target not in exclusive:
+                        exclusive.discard(ancestor)
+                        changed = True
+                        break
+        return exclusive
+
+    def _store_results(self):
+        """Store results recorded for memoized nodes in the result cache."""
+        pipes = dict((pipe.resource, pipe) for pipe in self.pipes
+                                           if isinstance(pipe, RecordingPipe))
+        pending = []
+        for (cache, key, path) in self._pending_results:
+            pipe = pipes.get(path)
+            if pipe is not None and pipe.complete:
+                cache.store(key, path)
+            else:
+                pending.append((cache, key, path))
+        self._pending_results = pending
+
+    def _discard_results(self):
+        """Remove results recorded for memoized nodes that were not stored."""
+        for (cache, key, path) in self._pending_results:
+            cache.discard(path)
+        self._pending_results = []
+
+    def _restore_graph(self, saved):
+        (self.nodes, self.connections, attributes, self.recordings) = saved
+        for (node, name, value) in attributes:
+            setattr(node, name, value)
+        self._input_order = {}
+
+    def _initialize(self):
+        """Initializes the data processing stream:
+
+        * sorts nodes based on connection dependencies
+        * creates pipes between nodes
+        * initializes each node
+        * initializes pipe fields
+
+        """
+
+        self.logger.info("initializing stream")
+        self.logger.debug("sorting nodes")
+        sorted_nodes = self.sorted_nodes()
+        self._create_pipes(sorted_nodes)
+        cache = self._metadata_cache()
 
         # Initialize fields
         for node in sorted_nodes:
@@ -399,8 +860,14 @@ class Stream(Graph):
 
             fields = node.output_fields
             self.logger.debug("  node output fields: %s" % fields.names())
+            if cache is not None and isinstance(node, SourceNode):
+                entry = self._fields_entry(node)
+                if entry:
+                    self._store_fields(cache, entry, fields)
             for output_pipe in node.outputs:
                 output_pipe.fields = fields
+                if self.compact_rows and isinstance(node, SourceNode):
+                    output_pipe.set_row_type(fields.row_type())
 
     def run(self):
         """Run all nodes in the stream.
@@ -411,13 +878,20 @@ class Stream(Graph):
         attribute `exceptions`.
 
         """
-        self._initialize()
-
-        # FIXME: do better exception handling here: what if both will raise exception?
+        (saved, plan) = self._apply_plan()
         try:
-            self._run()
+            self._initialize()
+
+            # FIXME: do better exception handling here: what if both will raise exception?
+            try:
+                self._run()
+            finally:
+                self._finalize()
+
+            self._store_results()
         finally:
-            self._finalize()
+            self._discard_results()
+            self._restore_graph(saved)
 
     def _run(self):
         self.logger.info("running stream")
@@ -429,26 +903,54 @@ class Stream(Graph):
         for node in sorted_nodes:
             self.logger.debug("launching thread for node %s" % node_label(node))
             thread = _StreamNodeThread(node)
+            # Node stuck outside of a pipe (for example in a database call) can not be stopped,
+            # it should not prevent the process from exiting after the stream was aborted
+            thread.daemon = self.abort_on_stall
             thread.start()
             threads.append((thread, node))
 
+        self._threads = threads
+
+        watchdog = None
+        join_timeout = JOIN_TIMEOUT
+        if self.stall_timeout:
+            watchdog = _StreamWatchdog(self, self.stall_timeout, self.abort_on_stall)
+            watchdog.start()
+            join_timeout = watchdog.interval
+
         self.exceptions = []
-        for (thread, node) in threads:
-            self.logger.debug("joining thread for %s" % node_label(node))
-            while True:
-                thread.join(JOIN_TIMEOUT)
-                if thread.isAlive():
-                    pass
-                    # self.logger.debug("thread join timed out")
-                else:
-                    if thread.exception:
-                        self._add_thread_exception(thread)
+        try:
+            for (thread, node) in threads:
+                self.logger.debug("joining thread for %s" % node_label(node))
+                while True:
+                    thread.join(join_timeout)
+                    if thread.isAlive():
+                        pass
+                        # self.logger.debug("thread join timed out")
                     else:
-                        self.logger.debug("thread joined")
-                    break
-                if self.exceptions:
-                    self.logger.info("node exception occured, trying to kill threads")
-                    self.kill_threads()
+                        if thread.exception:
+                            self._add_thread_exception(thread)
+                        else:
+                            self.logger.debug("thread joined")
+                        break
+                    if self.exceptions:
+                        self.logger.info("node exception occured, trying to kill threads")
+                        self.kill_threads()
+                    if watchdog and watchdog.aborted:
+                        # Pipes are closed, give the node a chance to notice it
+                        thread.join(self.stall_timeout)
+                        if thread.isAlive():
+                            self.logger.warn("node %s does not respond, leaving it behind"
+                                             % node_label(node))
+                            break
+        finally:
+            if watchdog:
+                watchdog.stop()
+
+        if watchdog and watchdog.aborted:
+            self.logger.info("run aborted: stream stalled")
+            raise StreamError("Stream stalled: no data moved through any pipe for %s seconds"
+                              % self.stall_timeout)
 
         if self.exceptions:
             self.logger.info("run finished with exception")
@@ -494,7 +996,216 @@ class Stream(Graph):
 
 
     def kill_threads(self):
+        """Stop running nodes by closing all pipes in the stream. Nodes waiting for data or
+        waiting for their output to be consumed are woken up and finish. Nodes that are busy
+        outside of pipes will notice closed pipes on their next read or write."""
         self.logger.info("killing threads")
+        for pipe in self.pipes:
+            pipe.abort()
+
+    def progress(self):
+        """Return a number that grows as long as data are moving anywhere in the stream."""
+        return sum(pipe.progress() for pipe in self.pipes)
+
+    def print_state(self, output=None):
+        """Print state of running nodes and their pipes: whether node is running, which pipe it
+        is blocked on, how many rows went through its inputs and outputs, and stack of the node
+        thread. Used to diagnose stalled streams. By default text is printed to standard error
+        output."""
+
+        if not output:
+            output = sys.stderr
+
+        frames = sys._current_frames()
+        pipe_names = {}
+        for (source, target) in self.connections:
+            label = "%s->%s" % (self.node_name(source), self.node_name(target))
+            for pipe in source.outputs:
+                if pipe in target.inputs:
+                    pipe_names[pipe] = label
+
+        text = "stream state:\n"
+        for (thread, node) in self._threads:
+            text += "node %s (%s): %s\n" % (self.node_name(node), node_label(node), thread.state)
+
+            for pipe in node.inputs:
+                text += "    input %s: %d rows received, %d ready, closed: %s%s\n" \
+                            % (pipe_names.get(pipe, "?"), pipe.received_count,
+                               len(pipe._ready_buffer or []), pipe.closed(),
+                               " - BLOCKED waiting for data" if pipe.receiver_waiting else "")
+
+            for pipe in node.outputs:
+                text += "    output %s: %d rows sent, %d staged, closed: %s%s\n" \
+                            % (pipe_names.get(pipe, "?"), pipe.sent_count,
+                               len(pipe.staging_buffer), pipe.closed(),
+                               " - BLOCKED waiting for consumer" if pipe.sender_waiting else "")
+
+            frame = frames.get(thread.ident)
+            if frame:
+                text += "    thread stack:\n"
+                for line in traceback.format_stack(frame):
+                    text += "        " + line.rstrip().replace("\n", "\n        ") + "\n"
+
+        output.write(text)
+
+    def explain(self):
+        """Describe what would be executed when the stream is run, without running it. Nodes are
+        initialized in the topological order to resolve their output fields, except target nodes
+        which are not initialized at all, so nothing is created or written. Sources are finalized
+        afterwards. Nothing is read from sources beyond metadata (such as CSV header or table
+        description). If the stream has `metadata_cache`, fields of sources resolved in a
+        previous run or explanation are taken from the cache and the sources are not initialized
+        while the read resources do not change.
+
+        Returns a dictionary with keys:
+
+        * ``nodes`` - list of node descriptions in order of initialization: ``name``, ``type``
+          (node identifier), ``inputs`` and ``outputs`` (names of connected nodes in order of the
+          node pipes), ``fields`` - list of ``(name, storage_type)`` of output fields or ``None``,
+          ``memory`` and ``memory_detail`` from :meth:`Node.memory_behavior` and ``error`` - why
+          fields could not be resolved
+        * ``pipes`` - list of pipe descriptions: ``source``, ``target``, ``buffer_size``,
+          ``recording`` - recording resource or ``None``, ``format`` - ``rows``, ``batches`` or
+          conversion between them, such as ``rows to batches``
+        * ``optimizations`` - list of descriptions of rewrites the optimizer would apply to the
+          stream before it is run, nodes and pipes are described as they would be after the
+          rewrites
+
+        Use :meth:`print_explain` to get human readable output.
+        """
+
+        (saved, plan) = self._apply_plan()
+        try:
+            explanation = self._explain()
+        finally:
+            self._discard_results()
+            self._restore_graph(saved)
+
+        if plan:
+            explanation["optimizations"] = list(plan.rewrites)
+
+        return explanation
+
+    def _explain(self):
+        sorted_nodes = self.sorted_nodes()
+        connected = self._create_pipes(sorted_nodes)
+
+        pipe_sources = dict((pipe, source) for (source, target, pipe) in connected)
+        pipe_targets = dict((pipe, target) for (source, target, pipe) in connected)
+
+        cache = self._metadata_cache()
+
+        nodes = []
+        initialized = []
+        try:
+            for node in sorted_nodes:
+                (memory, memory_detail) = node.memory_behavior()
+                description = {
+                    "name": self.node_name(node),
+                    "type": node.identifier(),
+                    "inputs": [self.node_name(pipe_sources[p]) for p in node.inputs],
+                    "outputs": [self.node_name(pipe_targets[p]) for p in node.outputs],
+                    "fields": None,
+                    "memory": memory,
+                    "memory_detail": memory_detail,
+                    "error": None
+                }
+                nodes.append(description)
+
+                if isinstance(node, TargetNode):
+                    continue
+
+                if any(pipe.fields is None for pipe in node.inputs):
+                    description["error"] = "input fields are not resolved"
+                    continue
+
+                entry = None
+                fields = None
+                if cache is not None and isinstance(node, SourceNode):
+                    entry = self._fields_entry(node)
+                    if entry:
+                        fields = self._cached_fields(cache, entry)
+
+                if fields is None:
+                    try:
+                        node.initialize()
+                        if isinstance(node, SourceNode):
+                            initialized.append(node)
+                        fields = node.output_fields
+                    except Exception as e:
+                        description["error"] = "%s: %s" % (e.__class__.__name__, e)
+                        continue
+                    if entry:
+                        self._store_fields(cache, entry, fields)
+
+                description["fields"] = [(f.name, f.storage_type) for f in fields]
+                for pipe in node.outputs:
+                    pipe.fields = fields
+        finally:
+            for node in initialized:
+                try:
+                    node.finalize()
+                except Exception as e:
+                    self.logger.warn("finalizing node %s after explain failed: %s"
+                                     % (node_label(node), e))
+
+        pipes = []
+        for (source, target, pipe) in connected:
+            pipes.append({
+                "source": self.node_name(source),
+                "target": self.node_name(target),
+                "buffer_size": pipe.buffer_size,
+                "recording": getattr(pipe, "resource", None),
+                "format": _pipe_format(source, target)
+            })
+
+        return {"nodes": nodes, "pipes": pipes, "optimizations": []}
+
+    def print_explain(self, output=None):
+        """Print result of :meth:`explain` in human readable form. By default text is printed to
+        standard output."""
+
+        if not output:
+            output = sys.stdout
+
+        explanation = self.explain()
+
+        text = "execution order:\n"
+        for (i, node) in enumerate(explanation["nodes"]):
+            text += "%3d. %s (%s)" % (i + 1, node["name"], node["type"])
+            if node["inputs"]:
+                text += " <- %s" % ", ".join(node["inputs"])
+            text += "\n"
+
+            if node["fields"] is not None:
+                fields = ["%s:%s" % field for field in node["fields"]]
+                text += "     output: %s (%d fields)\n" % (", ".join(fields), len(fields))
+            elif node["error"]:
+                text += "     output: unresolved - %s\n" % node["error"]
+
+            text += "     memory: %s" % node["memory"]
+            if node["memory_detail"]:
+                text += " - %s" % node["memory_detail"]
+            text += "\n"
+
+        text += "pipes:\n"
+        for pipe in explanation["pipes"]:
+            text += "     %s -> %s: buffer %d rows" % (pipe["source"], pipe["target"],
+                                                      pipe["buffer_size"])
+            if pipe["format"] != "rows":
+                text += ", %s" % pipe["format"]
+            if pipe["recording"]:
+                text += ", recorded into %s" % pipe["recording"]
+            text += "\n"
+
+        text += "optimizations:\n"
+        if explanation["optimizations"]:
+            for optimization in explanation["optimizations"]:
+                text += "     %s\n" % optimization
+        else:
+            text += "     none\n"
+
+        output.write(text)
 
     def _finalize(self):
         self.logger.info("finalizing nodes")
@@ -504,6 +1215,10 @@ class Stream(Graph):
             self.logger.debug("finalizing node %s" % node_label(node))
             node.finalize()
 
+        for pipe in self.pipes:
+            if isinstance(pipe, RecordingPipe):
+                pipe.finish_recording()
+
 def node_label(node):
     """Debug label for a node: node identifier with python object id."""
     return "%s(%s)" % (node.identifier() or str(type(node)), id(node))
@@ -522,6 +1237,7 @@ class _StreamNodeThread(threading.Thread):
         self.node = node
         self.exception = None
         self.traceback = None
+        self.state = "waiting"
         self.logger = get_logger()
 
     def run(self):
@@ -529,6 +1245,7 @@ class _StreamNodeThread(threading.Thread):
 
         label = node_label(self.node)
         self.logger.debug("%s: start" % label)
+        self.state = "running"
         try:
             self.node.run()
         except NodeFinished:
@@ -540,6 +1257,8 @@ class _StreamNodeThread(threading.Thread):
             self.logger.debug("node %s failed: %s" % (label, e.__class__.__name__), exc_info=sys.exc_info)
             self.exception = e
 
+        self.state = "failed" if self.exception else "finishing"
+
         # Flush pipes after node is finished
         self.logger.debug("%s: finished" % label)
         self.logger.debug("%s: flushing outputs" % label)
@@ -552,6 +1271,73 @@ class _StreamNodeThread(threading.Thread):
             if not pipe.closed():
                 pipe.done_sending()
         self.logger.debug("%s: stopped" % self)
+        if not self.exception:
+            self.state = "finished"
+
+class _StreamWatchdog(threading.Thread):
+    def __init__(self, stream, timeout, abort=False):
+        """Creates a watchdog thread that detects stalled `stream`: stream where no data moved
+        through any pipe for `timeout` seconds. State of the stream is logged on stall and if
+        `abort` is ``True``, then the stream is stopped.
+
+        :Attributes:
+            * `stalled`: ``True`` while the stream is stalled
+            * `aborted`: ``True`` if the stream was stopped by the watchdog
+        """
+        super(_StreamWatchdog, self).__init__()
+        self.daemon = True
+        self.stream = stream
+        self.timeout = timeout
+        self.abort = abort
+        self.interval = min(1.0, timeout / 4.0)
+
+        self.stalled = False
+        self.aborted = False
+        self.logger = get_logger()
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        last_progress = self.stream.progress()
+        last_time = time.time()
+
+        while not self._stop_event.is_set():
+            self._stop_event.wait(self.interval)
+
+            progress = self.stream.progress()
+            now = time.time()
+
+            if progress != last_progress:
+                if self.stalled:
+                    self.logger.info("stream is moving again")
+                self.stalled = False
+                last_progress = progress
+                last_time = now
+            elif now - last_time >= self.timeout:
+                self.stalled = True
+                self._report(now - last_time)
+                # Report again if the stall continues
+                last_time = now
+
+                if self.abort:
+                    self.logger.warn("aborting stalled stream")
+                    self.aborted = True
+                    self.stream.kill_threads()
+                    break
+
+    def _report(self, interval):
+        output = StringIO.StringIO()
+        try:
+            self.stream.print_state(output)
+            state = output.getvalue()
+        except Exception as e:
+            state = "unable to get stream state: %s" % e
+        finally:
+            output.close()
+
+        self.logger.warn("stream stalled: no data moved for %.1f seconds\n%s" % (interval, state))
 
 class _StreamFork(object):
     """docstring for StreamFork"""
@@ -611,6 +1397,8 @@ class _StreamFork(object):
         # FIXME: use create_node here
 
         class_dict = node_dictionary()
+        if name not in class_dict:
+            class_dict = node_dictionary(refresh=True)
 
         node_class = class_dict[name]
 
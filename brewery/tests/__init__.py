@@ -13,19 +13,35 @@ from test_node_stream import *
 from test_data_quality import *
 from test_sql_streams import *
 from test_forks import *
+from test_bench import *
+from test_optimizer import *
 
 test_cases = [FieldListCase,
               DataSourceUtilsTestCase,
               DataSourceTestCase,
               PipeTestCase,
               Pipe2TestCase,
+              RecordBatchTestCase,
               NodesTestCase,
               StreamBuildingTestCase,
               StreamInitializationTestCase,
+              StreamWatchdogTestCase,
               DataQualityTestCase,
               StreamConfigurationTestCase,
               SQLStreamsTestCase,
-              ForksTestCase
+              SQLMetadataCacheTestCase,
+              ForksTestCase,
+              NodeBenchmarksTestCase,
+              StreamBenchmarksTestCase,
+              FilterPushdownTestCase,
+              SQLPredicatePushdownTestCase,
+              ProjectionPushdownTestCase,
+              DeadFieldEliminationTestCase,
+              LimitPushdownTestCase,
+              SQLAggregationPushdownTestCase,
+              SQLInsertSelectTestCase,
+              SharedScanTestCase,
+              ResultCacheTestCase
                 ]
 
 def load_tests(loader, tests, pattern):
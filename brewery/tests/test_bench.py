@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import brewery.bench as bench
+
+class NodeBenchmarksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.settings = {"rows": 50, "width": 6}
+
+    def test_synthetic_rows(self):
+        fields = bench.synthetic_fields(6)
+        rows = bench.synthetic_rows(self.settings)
+        self.assertEqual(6, len(fields))
+        self.assertEqual(50, len(rows))
+        self.assertEqual(6, len(rows[0]))
+        self.assertEqual(rows, bench.synthetic_rows(self.settings))
+
+    def test_run_all(self):
+        suite = bench.node_benchmarks()
+        results = suite.run(self.settings, repeat=1, isolate=False)
+
+        self.assertEqual(set(suite.names()), set(results.keys()))
+        self.assertEqual(50, results["aggregate"]["rows"])
+        self.assertEqual(100, results["merge"]["rows"])
+
+    def test_isolated(self):
+        suite = bench.node_benchmarks()
+        result = bench.run_benchmark(suite.benchmark("distinct"), self.settings, repeat=1)
+        self.assertEqual(50, result["rows"])
+        self.assertIn("peak_memory", result)
+
+    def test_killed(self):
+        def setup(settings):
+            return (lambda: os._exit(1), 1)
+        benchmark = bench.Benchmark("exit", setup)
+        self.assertRaisesRegexp(Exception, "Benchmark 'exit' failed: .*code 1",
+                                bench.run_benchmark, benchmark, self.settings, repeat=1)
+
+    def test_compare(self):
+        baseline = {"results": {
+                        "fast": {"rows_per_second": 1000, "peak_memory": 10000000},
+                        "slow": {"rows_per_second": 1000, "peak_memory": 10000000},
+                        "fat": {"rows_per_second": 1000, "peak_memory": 10000000}
+                    }}
+        results = {
+                "fast": {"rows_per_second": 1500, "peak_memory": 10000000},
+                "slow": {"rows_per_second": 700, "peak_memory": 10000000},
+                "fat": {"rows_per_second": 1000, "peak_memory": 20000000},
+                "new": {"rows_per_second": 1000, "peak_memory": 0}
+            }
+
+        comparisons = bench.compare_results(results, baseline, tolerance=0.2)
+        regressions = dict((c["name"], c["regression"]) for c in comparisons)
+
+        self.assertEqual({"fast": False, "slow": True, "fat": True, "new": False},
+                         regressions)
+
+    def test_baseline_file(self):
+        if not os.path.exists("test_out"):
+            os.makedirs("test_out")
+        path = os.path.join("test_out", "baseline.json")
+
+        results = {"select": {"rows_per_second": 1000, "peak_memory": 0}}
+        bench.save_baseline(path, results, self.settings)
+        baseline = bench.load_baseline(path)
+
+        self.assertEqual(50, baseline["settings"]["rows"])
+        self.assertEqual(1000, baseline["results"]["select"]["rows_per_second"])
+
+class StreamBenchmarksTestCase(unittest.TestCase):
+    def test_names(self):
+        suite = bench.stream_benchmarks(buffer_sizes=[10, 100])
+        self.assertIn("aggregate_sql:threads:10", suite.names())
+        self.assertIn("audit_wide:threads:100", suite.names())
+        self.assertRaises(KeyError, bench.stream_benchmarks, ["nonexistent"])
+
+    def test_run_all(self):
+        suite = bench.stream_benchmarks()
+        results = suite.run({"rows": 30}, repeat=1, isolate=False)
+
+        self.assertEqual(set(suite.names()), set(results.keys()))
+        for result in results.values():
+            self.assertEqual(30, result["rows"])
+            self.assertTrue(result["first_row_latency"] > 0)
@@ -5,6 +5,11 @@ import unittest
 import os
 import brewery.ds
 import brewery
+import brewery.batches
+import datetime
+import StringIO
+import shutil
+from brewery.cache import MetadataCache
 
 TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
 
@@ -41,6 +46,10 @@ class DataSourceUtilsTestCase(unittest.TestCase):
 #         ds = brewery.ds.datastore(desc)
 #       self.assertEqual("sqlalchemy", ds.adapter_name)
  		
+class UnseekableFile(object):
+    def __init__(self, data):
+        self.read = StringIO.StringIO(data).read
+
 class DataSourceTestCase(unittest.TestCase):
     output_dir = None
     @classmethod
@@ -123,6 +132,40 @@ class DataSourceTestCase(unittest.TestCase):
         self.assertEqual(3, result["min_fields"])
         self.assertEqual(8, result["count"])
 
+    def test_csv_header_cache(self):
+        path = self.output_file('test_header.csv')
+        shutil.copy(self.data_file('test.csv'), path)
+        cache = MetadataCache(self.output_file('header_cache'))
+        cache.clear()
+
+        src = brewery.ds.CSVDataSource(path, metadata_cache=cache)
+        src.initialize()
+        names = ['id', 'name', 'type', 'location.name', 'location.code', 'amount']
+        self.assertEqual(names, src.fields.names())
+        src.finalize()
+        self.assertEqual(1, len(os.listdir(self.output_file('header_cache'))))
+
+        # Replace the cached header to see that it is used instead of the file header
+        key = src._header_key()
+        fingerprint = brewery.cache.file_fingerprint(path)
+        cache.set(key, fingerprint, (True, names[:5] + ['total']))
+        src = brewery.ds.CSVDataSource(path, metadata_cache=cache)
+        src.initialize()
+        self.assertEqual(names[:5] + ['total'], src.fields.names())
+        self.assertEqual(8, self.read_source(src)["count"])
+        src.finalize()
+
+        # Changed file is read again
+        with open(path, "a") as handle:
+            handle.write("9,name,type,location,code,10\n")
+        mtime = os.path.getmtime(path) + 1
+        os.utime(path, (mtime, mtime))
+        src = brewery.ds.CSVDataSource(path, metadata_cache=cache)
+        src.initialize()
+        self.assertEqual(names, src.fields.names())
+        self.assertEqual(9, self.read_source(src)["count"])
+        src.finalize()
+
     def test_copy(self):
         src = brewery.ds.CSVDataSource(self.data_file('test_tab.csv'), dialect = "excel-tab")
         src.initialize()
@@ -145,6 +188,49 @@ class DataSourceTestCase(unittest.TestCase):
         self.assertEqual(3, result["min_fields"])
         self.assertEqual(8, result["count"])
 
+    def test_binary_file(self):
+        fields = brewery.FieldList([("id", "integer"), ("name", "string"), ("day", "date")])
+        rows = [(i, u"item-%d" % i if i % 3 else None,
+                 datetime.date(2012, 1, 1 + i % 28) if i >= 50 else None) for i in range(120)]
+        path = self.output_file("test_out.brw")
+
+        target = brewery.ds.BinaryDataTarget(path, buffer_size=25, compression=1)
+        target.fields = fields
+        target.initialize()
+        for row in rows[:100]:
+            target.append(row)
+        target.append_batch(brewery.batches.RecordBatch.from_rows(fields, rows[100:]))
+        target.finalize()
+
+        source = brewery.ds.BinaryDataSource(path)
+        source.initialize()
+        self.assertEqual(fields.names(), source.fields.names())
+        self.assertEqual(["integer", "string", "date"],
+                         [field.storage_type for field in source.fields])
+        self.assertEqual(rows, list(source.rows()))
+        self.assertEqual(5, source.batch_count())
+        self.assertEqual(120, source.row_count())
+        self.assertEqual(rows[75:100], source.read_batch(3).rows())
+
+        ranges = source.ranges(2)
+        self.assertEqual([(0, 3), (3, 5)], ranges)
+        source.finalize()
+
+        read = []
+        for (start, stop) in ranges:
+            part = brewery.ds.BinaryDataSource(path, start, stop)
+            part.initialize()
+            read += list(part.rows())
+            part.finalize()
+        self.assertEqual(rows, read)
+
+        # Files are read sequentially without the index, even if they are not seekable
+        with open(path, "rb") as handle:
+            stream = UnseekableFile(handle.read())
+        source = brewery.ds.BinaryDataSource(stream)
+        source.initialize()
+        self.assertEqual(rows, list(source.rows()))
+
     def test_row_record(self):
         pass
         # * Test whether all streams support correctly reading/writing both records and rows
@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import cPickle as pickle
+import operator
 import brewery
 from brewery import ds
 
@@ -33,6 +35,42 @@ class FieldListCase(unittest.TestCase):
         indexes = fields.indexes( fields.fields() )
         self.assertEqual((0,1,2,3), indexes)
 
+    def test_record_view(self):
+        fields = brewery.FieldList(["a", "b", "c"])
+        indexes = fields.index_map()
+        self.assertEqual({"a": 0, "b": 1, "c": 2}, indexes)
+
+        view = brewery.RecordView([1, 2, 3], indexes)
+        self.assertEqual(2, view["b"])
+        self.assertEqual(None, view.get("d"))
+        self.assertRaises(KeyError, view.__getitem__, "d")
+        self.assertIn("c", view)
+        self.assertEqual({"a": 1, "b": 2, "c": 3}, view.to_dict())
+        self.assertEqual({"a": 1, "b": 2, "c": 3}, view)
+
+        def unpack(a, **record):
+            return (a, record)
+        self.assertEqual((1, {"b": 2, "c": 3}), unpack(**view))
+
+    def test_compact_row(self):
+        fields = brewery.FieldList(["a", "b"])
+        row_type = fields.row_type()
+        self.assertIs(row_type, brewery.FieldList(["a", "b"]).row_type())
+        self.assertIsNot(row_type, brewery.FieldList(["a", "c"]).row_type())
+
+        row = row_type([1, 2])
+        self.assertEqual((1, 2), row)
+        self.assertEqual(2, row.get("b"))
+        self.assertEqual(None, row.get("c"))
+        self.assertEqual({"a": 1, "b": 2}, row.to_dict())
+        self.assertEqual((1, 3), row.replace({"b": 3}))
+        self.assertIsInstance(row.replace({"b": 3}), row_type)
+        self.assertRaises(TypeError, operator.setitem, row, 0, 1)
+
+        restored = pickle.loads(pickle.dumps(row, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(row, restored)
+        self.assertIs(row_type, type(restored))
+
     def test_deletion(self):
         fields = brewery.FieldList(["a", "b", "c", "d"])
         del fields[0]
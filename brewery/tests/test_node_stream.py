@@ -2,11 +2,13 @@
 # -*- coding: utf-8 -*-
 
 import brewery
+import brewery.cache
 from brewery import ds
 import unittest
 import logging
 import time
 import StringIO
+import os
 
 from brewery.streams import *
 from brewery.nodes import *
@@ -175,6 +177,107 @@ class StreamInitializationTestCase(unittest.TestCase):
         expected = [{'record_count': 2, 'str': 'a'}, {'record_count': 1, 'str': 'b'}]
         self.assertEqual(expected, data)
         
+    def test_explain(self):
+        explanation = self.stream.explain()
+
+        nodes = dict((node["name"], node) for node in explanation["nodes"])
+        order = [node["name"] for node in explanation["nodes"]]
+
+        self.assertEqual(6, len(order))
+        self.assertTrue(order.index("source") < order.index("sample") < order.index("map"))
+        self.assertEqual([("a", "unknown"), ("b", "unknown"), ("str", "unknown")],
+                         nodes["map"]["fields"])
+        self.assertEqual(["source"], nodes["aggregate"]["inputs"])
+        self.assertEqual("blocking", nodes["aggregate"]["memory"])
+        self.assertEqual("streaming", nodes["map"]["memory"])
+        self.assertEqual(None, nodes["target"]["fields"])
+
+        self.assertEqual(5, len(explanation["pipes"]))
+        self.assertEqual(1000, explanation["pipes"][0]["buffer_size"])
+
+        output = StringIO.StringIO()
+        self.stream.print_explain(output)
+        self.assertIn("aggregate (aggregate) <- source", output.getvalue())
+        self.assertIn("optimizations:\n     none", output.getvalue())
+
+        # Explained stream is not affected
+        self.stream.run()
+        self.assertEqual(3, len(self.stream.node("target").list))
+
+    def test_explain_unresolved(self):
+        self.stream.add(CSVSourceNode("nonexistent.csv"), "csv")
+        self.stream.add(FieldMapNode(), "csv_map")
+        self.stream.connect("csv", "csv_map")
+
+        nodes = dict((node["name"], node) for node in self.stream.explain()["nodes"])
+        self.assertIn("IOError", nodes["csv"]["error"])
+        self.assertEqual("input fields are not resolved", nodes["csv_map"]["error"])
+        self.assertEqual(None, nodes["csv_map"]["fields"])
+
+    def test_record_replay(self):
+        if not os.path.exists("test_out"):
+            os.makedirs("test_out")
+        path = os.path.join("test_out", "sample_map.brw")
+
+        self.assertRaises(StreamError, self.stream.record, "source", "map", path)
+        self.stream.record("sample", "map", path)
+        self.stream.run()
+
+        nodes = {
+            "source": ReplaySourceNode(path),
+            "map": FieldMapNode(drop_fields = ["c"]),
+            "target": RecordListTargetNode()
+        }
+        stream = Stream(nodes, [("source", "map"), ("map", "target")])
+        stream.run()
+
+        self.assertEqual(self.fields.names(), nodes["source"].output_fields.names())
+        self.assertEqual(self.stream.node("target").list, nodes["target"].list)
+
+    def test_compact_rows(self):
+        self.stream.add(StringStripNode(), "strip")
+        self.stream.add(RowListTargetNode(), "strip_target")
+        self.stream.connect("source", "strip")
+        self.stream.connect("strip", "strip_target")
+        self.stream.compact_rows = True
+        self.stream.run()
+
+        self.assertEqual([{'a': 1, 'b': 2, 'str': 'a'},
+                          {'a': 4, 'b': 5, 'str': 'b'},
+                          {'a': 7, 'b': 8, 'str': 'a'}], self.stream.node("target").list)
+        self.assertEqual(self.src_list, self.stream.node("strip_target").rows)
+        # Source rows are not modified
+        self.assertEqual([1, 2, 3, "a"], self.src_list[0])
+
+    def test_batches(self):
+        #  source ---> coalesce ---+---> aggregate ---> aggtarget
+        #                          |
+        #                          +---> target
+        fields = brewery.FieldList([("str", "string"), ("amount", "integer")])
+        rows = [[" a ", "1"], ["b", "2"], ["a", " 3"], ["", "4"]]
+        nodes = {
+            "source": RowListSourceNode(rows, fields),
+            "coalesce": CoalesceValueToTypeNode(),
+            "aggregate": AggregateNode(keys = ["str"], measures = ["amount"]),
+            "aggtarget": RowListTargetNode(),
+            "target": RowListTargetNode()
+        }
+        connections = [("source", "coalesce"), ("coalesce", "aggregate"),
+                       ("aggregate", "aggtarget"), ("coalesce", "target")]
+        stream = Stream(nodes, connections)
+
+        formats = dict(((pipe["source"], pipe["target"]), pipe["format"])
+                       for pipe in stream.explain()["pipes"])
+        self.assertEqual("rows to batches", formats[("source", "coalesce")])
+        self.assertEqual("batches", formats[("coalesce", "aggregate")])
+        self.assertEqual("batches to rows", formats[("coalesce", "target")])
+
+        stream.run()
+        self.assertEqual([[u"a", 1], [u"b", 2], [u"a", 3], [None, 4]],
+                         nodes["target"].rows)
+        self.assertEqual([[u"a", 4, 1, 3, 2, 2], [u"b", 2, 2, 2, 2, 1]],
+                         nodes["aggtarget"].rows[:2])
+
     def test_run_removed(self):
         self.stream.remove("aggregate")
         self.stream.remove("aggtarget")
@@ -234,4 +337,227 @@ class StreamConfigurationTestCase(unittest.TestCase):
         node.configure(config)
         self.assertEqual(config["resource"], node.resource)
         self.assertEqual(config["fields"], node.fields)
-        
\ No newline at end of file
+        
+class StreamWatchdogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fields = brewery.FieldList(["i", "str"])
+        self.src_list = [[i, "item-%d" % i] for i in range(5000)]
+
+    def create_deadlocked_stream(self):
+        # Merge reads all details before master, but both are fed by the same source. The source
+        # blocks on a full master pipe before detail input is finished.
+        #
+        #  source ---+-----------------> merge ----> target
+        #            |                     ^
+        #            +---> map ------------+
+        nodes = {
+            "source": RowListSourceNode(self.src_list, self.fields),
+            "map": FieldMapNode(map_fields={"str": "detail_str"}),
+            "merge": brewery.nodes.MergeNode(joins=[(1, "i")]),
+            "target": RowListTargetNode()
+        }
+        connections = [
+            ("source", "merge"),
+            ("source", "map"),
+            ("map", "merge"),
+            ("merge", "target")
+        ]
+
+        return Stream(nodes, connections)
+
+    def test_abort_stalled(self):
+        stream = self.create_deadlocked_stream()
+        stream.stall_timeout = 0.3
+        stream.abort_on_stall = True
+
+        self.assertRaisesRegexp(StreamError, "stalled", stream.run)
+
+    def test_print_state(self):
+        stream = self.create_deadlocked_stream()
+        stream.stall_timeout = 0.3
+        stream.abort_on_stall = True
+        states = []
+
+        print_state = stream.print_state
+        def record_state(output=None):
+            handle = StringIO.StringIO()
+            print_state(handle)
+            states.append(handle.getvalue())
+            handle.close()
+        stream.print_state = record_state
+
+        self.assertRaises(StreamError, stream.run)
+
+        self.assertEqual(1, len(states))
+        self.assertIn("BLOCKED waiting for consumer", states[0])
+        self.assertIn("thread stack:", states[0])
+
+    def test_no_stall(self):
+        nodes = {
+            "source": RowListSourceNode(self.src_list, self.fields),
+            "target": RowListTargetNode()
+        }
+        stream = Stream(nodes, [("source", "target")])
+        stream.stall_timeout = 0.3
+        stream.abort_on_stall = True
+        stream.run()
+
+        self.assertEqual(5000, len(nodes["target"].rows))
+
+class ResultCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join("test_out", "result_cache")
+        self.data_path = os.path.join("test_out", "result_cache.csv")
+        self.cache = brewery.cache.ResultCache(self.path)
+        self.cache.clear()
+        self.write_data(["a", "b", "a"])
+
+    def write_data(self, values):
+        if not os.path.exists("test_out"):
+            os.makedirs("test_out")
+        with open(self.data_path, "w") as f:
+            f.write("id,str\n")
+            for (i, value) in enumerate(values):
+                f.write("%d, %s \n" % (i, value))
+
+    def create_stream(self):
+        #  source ---> strip ---+---> aggregate ---> aggtarget
+        #                       |
+        #                       +---> target
+        nodes = {
+            "source": CSVSourceNode(self.data_path),
+            "strip": StringStripNode(),
+            "aggregate": AggregateNode(keys = ["str"]),
+            "aggtarget": RecordListTargetNode(),
+            "target": RecordListTargetNode()
+        }
+        connections = [
+            ("source", "strip"),
+            ("strip", "aggregate"),
+            ("aggregate", "aggtarget"),
+            ("strip", "target")
+        ]
+        stream = Stream(nodes, connections)
+        stream.optimize = False
+        stream.result_cache = self.cache
+        stream.memoize("strip")
+        return stream
+
+    def entries(self):
+        return [name for name in os.listdir(self.path) if name.endswith(".brw")]
+
+    def test_memoize(self):
+        stream = self.create_stream()
+        stream.run()
+        self.assertEqual(1, len(self.entries()))
+        self.assertEqual([], [name for name in os.listdir(self.path) if name.endswith(".tmp")])
+        expected = stream.node("target").list
+        self.assertEqual({"id": "0", "str": "a"}, expected[0])
+
+        stream = self.create_stream()
+        explanation = stream.explain()
+        self.assertEqual(["output of string_strip 'strip' replayed from result cache"],
+                         explanation["optimizations"])
+        nodes = dict((node["name"], node) for node in explanation["nodes"])
+        self.assertNotIn("source", nodes)
+
+        stream.run()
+        self.assertEqual(expected, stream.node("target").list)
+        self.assertEqual([{"str": "a", "record_count": 2}, {"str": "b", "record_count": 1}],
+                         stream.node("aggtarget").list)
+        # Stream graph is restored
+        self.assertIn("source", stream.nodes)
+
+    def test_changed_source(self):
+        stream = self.create_stream()
+        stream.run()
+
+        self.write_data(["a", "b", "c", "d"])
+        os.utime(self.data_path, (0, 0))
+        stream = self.create_stream()
+        stream.run()
+        self.assertEqual(4, len(stream.node("target").list))
+        self.assertEqual(2, len(self.entries()))
+
+    def test_not_cacheable(self):
+        # Function has no stable fingerprint
+        stream = self.create_stream()
+        stream.add(FunctionSelectNode(lambda value: True, ["str"]), "select")
+        stream.add(RecordListTargetNode(), "select_target")
+        stream.connect("strip", "select")
+        stream.connect("select", "select_target")
+        stream.memoize("select")
+        stream.run()
+        self.assertEqual(1, len(self.entries()))
+
+    def test_source_without_fingerprint(self):
+        # Such as a URL: result is cached only when it expires
+        stream = self.create_stream()
+        stream.node("source").resource_fingerprint = lambda: None
+        stream.run()
+        self.assertEqual([], self.entries())
+
+        self.cache.max_age = 3600
+        stream.run()
+        self.assertEqual(1, len(self.entries()))
+
+    def test_changed_table(self):
+        try:
+            import sqlalchemy
+        except ImportError:
+            self.skipTest("sqlalchemy is not installed")
+
+        path = os.path.join("test_out", "result_cache.sqlite")
+        if os.path.exists(path):
+            os.remove(path)
+        url = "sqlite:///" + path
+        engine = sqlalchemy.create_engine(url)
+        engine.execute("CREATE TABLE data (id INTEGER, str VARCHAR)")
+        engine.execute("INSERT INTO data VALUES (1, ' a ')")
+
+        def create_stream():
+            nodes = {
+                "source": brewery.nodes.SQLSourceNode(url=url, table="data"),
+                "strip": StringStripNode(),
+                "target": RecordListTargetNode()
+            }
+            stream = Stream(nodes, [("source", "strip"), ("strip", "target")])
+            stream.result_cache = self.cache
+            stream.memoize("strip")
+            return stream
+
+        create_stream().run()
+        self.assertEqual(1, len(self.entries()))
+
+        engine.execute("ALTER TABLE data ADD COLUMN amount INTEGER")
+        engine.dispose()
+        stream = create_stream()
+        stream.run()
+        self.assertEqual(2, len(self.entries()))
+        self.assertEqual([{"id": 1, "str": "a", "amount": None}], stream.node("target").list)
+
+    def test_failed_run(self):
+        stream = self.create_stream()
+        stream.add(FailNode(), "fail")
+        stream.connect("strip", "fail")
+        self.assertRaises(Exception, stream.run)
+        self.assertEqual([], os.listdir(self.path))
+
+    def test_eviction(self):
+        for key in ["a", "b", "c"]:
+            path = self.cache.temporary_path()
+            with open(path, "w") as f:
+                f.write("x" * 10)
+            self.cache.store(key, path)
+            os.utime(self.cache.lookup(key), (time.time() - ord("d") + ord(key), time.time()))
+
+        self.cache.lookup("a")
+        self.cache.max_size = 20
+        self.cache.evict()
+        self.assertEqual(["a.brw", "c.brw"], sorted(self.entries()))
+
+        self.cache.max_age = 10
+        self.assertTrue(self.cache.lookup("a"))
+        os.utime(self.cache._entry_path("a"), (time.time(), time.time() - 20))
+        self.assertEqual(None, self.cache.lookup("a"))
+        self.assertEqual(["c.brw"], self.entries())
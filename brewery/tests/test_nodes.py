@@ -6,6 +6,12 @@ import brewery
 from brewery import ds
 import brewery.nodes
 import random
+import StringIO
+import os
+import datetime
+import __future__
+from brewery.expressions import compile_row_expression, compile_vector_expression
+from brewery.batches import RecordBatch
 
 class StackTestCase(unittest.TestCase):
 
@@ -64,6 +70,17 @@ class NodesTestCase(unittest.TestCase):
         self.assertNotIn("source", d)
         self.assertNotIn("aggregate_node", d)
 
+    def test_node_dictionary_refresh(self):
+        brewery.nodes.node_dictionary()
+
+        class LateDefinedNode(brewery.nodes.Node):
+            node_info = {"name": "late_defined_test"}
+
+        self.assertNotIn("late_defined_test", brewery.nodes.node_dictionary())
+        node = brewery.nodes.create_node("late_defined_test")
+        self.assertIsInstance(node, LateDefinedNode)
+        self.assertIn("late_defined_test", brewery.nodes.node_dictionary())
+
     def test_sample_node_first_n(self):
         node = brewery.nodes.SampleNode(size = 5, discard_sample = False, method = 'first')
         self.setup_node(node)
@@ -409,6 +426,50 @@ class NodesTestCase(unittest.TestCase):
         self.assertEqual([5040], sums)
         self.assertAllRows()
 
+    def test_aggregate_batches(self):
+        # Rows of several batches, the second batch has a sum that does not fit into 64 bits
+        self.input.fields = brewery.FieldList(["key", "amount", "price"])
+        rows = [[i % 7, i, i * 0.5] for i in range(2500)]
+        rows[1500][1] = 2 ** 70
+        self.input.buffer = rows
+
+        node = brewery.nodes.AggregateNode(keys = ["key"], measures = ["amount", "price"])
+        self.setup_node(node)
+        self.initialize_node(node)
+        node.run()
+
+        expected = []
+        for key in range(7):
+            amounts = [row[1] for row in rows if row[0] == key]
+            prices = [row[2] for row in rows if row[0] == key]
+            expected.append([key, sum(amounts), min(amounts), max(amounts),
+                             float(sum(amounts)) / len(amounts), sum(prices),
+                             min(prices), max(prices), sum(prices) / len(prices), len(prices)])
+        self.assertEqual(expected, self.output.buffer)
+        self.assertEqual(int, type(self.output.buffer[0][2]))
+
+    def test_aggregate_mixed_numbers(self):
+        # Integers mixed with floats in one batch or in different batches keep python types
+        self.input.fields = brewery.FieldList(["key", "amount"])
+        node = brewery.nodes.AggregateNode(keys = ["key"], measures = ["amount"])
+        self.setup_node(node)
+
+        for rows in ([[0, 2 ** 60 + 1], [0, 0.5], [1, 3]],
+                     [[i % 2, i if i < 1000 else i + 0.5] for i in range(1500)]):
+            self.input.buffer = rows
+            self.output.empty()
+            self.initialize_node(node)
+            node.run()
+
+            expected = []
+            for key in range(2):
+                amounts = [row[1] for row in rows if row[0] == key]
+                expected.append([key, sum(amounts), min(amounts), max(amounts),
+                                 float(sum(amounts)) / len(amounts), len(amounts)])
+            self.assertEqual(expected, self.output.buffer)
+            self.assertEqual([map(type, row) for row in expected],
+                             [map(type, row) for row in self.output.buffer])
+
     def assertAllRows(self, pipe = None):
         if not pipe:
             pipe = self.output
@@ -536,6 +597,138 @@ class NodesTestCase(unittest.TestCase):
         val = sum([row[4] for row in self.output.buffer])
         self.assertEqual(49500, val)
 
+    def test_compiled_expression(self):
+        function = compile_row_expression("len(b) + a / 2", ["a", "b", "len"])
+        self.assertEqual(4, function([3, "xyz", lambda value: 3]))
+        function = compile_row_expression("a / 2", ["a"], flags=__future__.division.compiler_flag)
+        self.assertEqual(1.5, function((3, )))
+        function = compile_row_expression("[a * x for x in range(b)]", ["a", "b"])
+        self.assertEqual([0, 2, 4], function([2, 3]))
+
+        # Expression assigning to a field is evaluated with records
+        self.assertEqual(None, compile_row_expression("[a for a in range(b)]", ["a", "b"]))
+        self.assertRaises(SyntaxError, compile_row_expression, "a >", ["a"])
+
+        node = brewery.nodes.DeriveNode(formula = "[i for i in [i * 2]][0]")
+        self.setup_node(node)
+        self.create_sample()
+        self.initialize_node(node)
+        node.run()
+        node.finalize()
+        self.assertEqual([0, 2, 4], [row[4] for row in self.output.buffer[:3]])
+
+        # Conditions have the same meaning as with eval()
+        node = brewery.nodes.SelectNode(condition = "i / 2 == 1")
+        self.output.empty()
+        self.setup_node(node)
+        self.create_sample(10)
+        self.initialize_node(node)
+        node.run()
+        node.finalize()
+        self.assertEqual([2, 3], [row[0] for row in self.output.buffer])
+
+    def test_vectorized_expression(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("numpy is not installed")
+
+        fields = brewery.FieldList(["a", "b", "s"])
+        batch = RecordBatch.from_rows(fields, [(1, 2.5, "x"), (-7, 0.5, "y"), (4, 2.0, "z")])
+        expression = compile_vector_expression("a * b > 2 and not a < 0", fields.names())
+        self.assertEqual([0, 1], expression.indexes)
+        self.assertEqual([True, False, True], expression.evaluate(batch).tolist())
+        expression = compile_vector_expression("abs(a) / 2 + -b", fields.names())
+        function = compile_row_expression("abs(a) / 2 + -b", fields.names())
+        self.assertEqual([function(row) for row in batch], expression.evaluate(batch).tolist())
+        expression = compile_vector_expression("a / 2", fields.names(),
+                                               flags=__future__.division.compiler_flag)
+        self.assertEqual([0.5, -3.5, 2.0], expression.evaluate(batch).tolist())
+        expression = compile_vector_expression("0 < a < 3", fields.names())
+        self.assertEqual([True, False, False], expression.evaluate(batch).tolist())
+
+        # Non-numeric columns and failed arithmetic are evaluated row by row
+        self.assertEqual(None, compile_vector_expression("s + 1", fields.names())
+                               .evaluate(batch))
+        self.assertEqual(None, compile_vector_expression("a / (a - 4)", fields.names())
+                               .evaluate(batch))
+
+        # So are integers mixed with floats and integer results that might not fit into 64 bits
+        mixed = RecordBatch.from_rows(fields, [(3, 1.0, "x"), (2.0, 1.0, "y")])
+        self.assertEqual(None, compile_vector_expression("a / 2", fields.names())
+                               .evaluate(mixed))
+        large = RecordBatch.from_rows(fields, [(2 ** 40, 1.0, "x"), (3, 1.0, "y")])
+        for text in ["a * a", "a * a > 0", "a * a * b", "a ** 2", "a + 2 ** 70"]:
+            self.assertEqual(None, compile_vector_expression(text, fields.names())
+                                   .evaluate(large))
+        self.assertEqual([2 ** 41, 6], compile_vector_expression("a * 2", fields.names())
+                                       .evaluate(large).tolist())
+
+        # Expressions that python evaluates differently are not vectorized
+        for text in ["a and b", "(a > 1) + (b > 1)", "len(s)", "a if b else 1", "1 + 2",
+                     "~a", "a.real", "[a]"]:
+            self.assertEqual(None, compile_vector_expression(text, fields.names()))
+
+        node = brewery.nodes.SelectNode(condition = "i % 3 == 0 and q < 10")
+        self.setup_node(node)
+        self.create_sample()
+        self.initialize_node(node)
+        self.assertEqual("batches", node.input_format)
+        node.run()
+        self.assertEqual([0, 3, 6, 9, 12, 15, 18, 21, 24, 27, 30, 33, 36, 39],
+                         [row[0] for row in self.output.buffer])
+        # Selected rows are passed on as they are
+        self.assertEqual(self.input.buffer[3], self.output.buffer[1])
+        self.assertEqual(list, type(self.output.buffer[1]))
+
+        node = brewery.nodes.DeriveNode(formula = "i // custom")
+        self.setup_node(node)
+        self.output.empty()
+        self.create_sample(4, custom = 2)
+        self.initialize_node(node)
+        node.run()
+        self.assertEqual([0, 0, 1, 1], [row[4] for row in self.output.buffer])
+        self.assertEqual(int, type(self.output.buffer[0][4]))
+        self.assertEqual(list, type(self.output.buffer[0]))
+
+        # None is not a number: row by row evaluation raises the python exception
+        self.create_sample(4)
+        self.assertRaises(TypeError, node.run)
+        self.create_sample(4, custom = 0)
+        self.assertRaises(ZeroDivisionError, node.run)
+
+        node = brewery.nodes.FunctionSelectNode(function = lambda value: value > 97,
+                                                fields = ["i"], vectorized = True,
+                                                discard = True)
+        self.setup_node(node)
+        self.output.empty()
+        self.create_sample()
+        self.initialize_node(node)
+        self.assertEqual("batches", node.input_format)
+        node.run()
+        self.assertEqual(98, len(self.output.buffer))
+
+    def test_formatted_printer(self):
+        output = StringIO.StringIO()
+        node = brewery.nodes.FormattedPrinterNode(format = u"{i:>3}|{str!r}|{q.real}",
+                                                  target = output, header = u"")
+        node.inputs = [self.input]
+        self.create_sample(3)
+        node.initialize()
+        node.run()
+        self.assertEqual("\n  0|'item-0'|0.0\n  1|'item-1'|0.25\n  2|'item-2'|0.5\n",
+                         output.getvalue())
+
+        # Format with other than field names is formatted with records
+        node.format = u"{i}{{}}{unknown}"
+        self.assertRaises(KeyError, node.run)
+
+    def test_record_views(self):
+        self.create_sample(2)
+        views = list(self.input.record_views())
+        self.assertEqual(u"item-1", views[1]["str"])
+        self.assertEqual(list(self.input.records()), views)
+
     def test_set_select(self):
         node = brewery.nodes.SetSelectNode(field = "type", value_set = ["a"])
 
@@ -637,6 +830,7 @@ class NodesTestCase(unittest.TestCase):
         self.assertEqual(["foo", "123", "123.0", "foo", "foo", None], strings) 
         self.assertEqual([123, 123, 123, 123, None, None], integers) 
         self.assertEqual([123, 123, 123, 123, None, None], floats) 
+        self.assertEqual([list], list(set(type(row) for row in self.output.buffer)))
 
     def test_merge(self):
         node = brewery.nodes.MergeNode()
@@ -672,6 +866,28 @@ class NodesTestCase(unittest.TestCase):
         self.assertEqual(5, len(self.output.buffer[0]))
         self.assertEqual(input_len, len(self.output.buffer)) 
         
+    def test_merge_master_not_first(self):
+        node = brewery.nodes.MergeNode(joins=[(0, "code")], master=1)
+
+        detail = brewery.streams.SimpleDataPipe()
+        detail.fields = brewery.FieldList(["code", "name"])
+        detail.put([1, "one"])
+
+        master = brewery.streams.SimpleDataPipe()
+        master.fields = brewery.FieldList(["code", "amount"])
+        master.put([1, 100])
+
+        node.inputs = [detail, master]
+        node.outputs = [self.output]
+        node.maps = {0: {"keep": ["name"]}}
+        self.initialize_node(node)
+
+        self.assertEqual(["code", "amount", "name"], node.output_fields.names())
+
+        node.run()
+        node.finalize()
+        self.assertEqual([[1, 100, "one"]], self.output.buffer)
+
     def test_generator_function(self):
         node = brewery.nodes.GeneratorFunctionSourceNode()
         def generator(start=0, end=10):
@@ -696,3 +912,149 @@ class NodesTestCase(unittest.TestCase):
         a = [row[0] for row in self.output.buffer]
         self.assertEqual([0,1,2,3,4], a)
 
+    def test_synthetic_source(self):
+        fields = brewery.metadata.FieldList([("id", "integer"), ("category", "string"),
+                                             ("amount", "float"), ("flag", "boolean")])
+        node = brewery.nodes.SyntheticSourceNode(fields, count=2500, seed=1, batch_size=1000)
+        node.distributions = {
+            "id": {"distribution": "sequence", "min": 1},
+            "category": {"distribution": "zipf", "values": ["a", "b", "c", "d"],
+                         "null_ratio": 0.2},
+            "amount": {"min": 10, "max": 20}
+        }
+        node.outputs = [self.output]
+
+        self.initialize_node(node)
+        node.run()
+        node.finalize()
+
+        rows = self.output.buffer
+        self.assertEqual(2500, len(rows))
+        self.assertEqual(range(1, 2501), [row[0] for row in rows])
+        self.assertEqual(4, len(rows[0]))
+
+        categories = [row[1] for row in rows]
+        self.assertTrue(categories.count("a") > categories.count("d"))
+        self.assertTrue(300 < categories.count(None) < 700)
+        self.assertTrue(all(10 <= row[2] <= 20 for row in rows))
+
+        self.output.buffer = []
+        self.initialize_node(node)
+        node.run()
+        self.assertEqual(rows, self.output.buffer)
+
+        node.distributions = {"amount": {"distribution": "normal"}}
+        self.assertRaises(ValueError, node.initialize)
+
+    def test_dataframe_source_target(self):
+        try:
+            import numpy
+            import pandas
+        except ImportError:
+            self.skipTest("pandas is not installed")
+
+        frame = pandas.DataFrame({"id": range(25), "amount": [i * 0.5 for i in range(25)],
+                                  "name": [u"item-%d" % i if i % 5 else None
+                                           for i in range(25)]},
+                                 columns=["id", "amount", "name"])
+        frame.loc[3, "amount"] = None
+
+        source = brewery.nodes.DataFrameSourceNode(frame, chunk_size=10)
+        source.initialize()
+        fields = source.output_fields
+        self.assertEqual(["id", "amount", "name"], fields.names())
+        self.assertEqual(["integer", "float", "string"],
+                         [field.storage_type for field in fields])
+
+        batches = list(source.stream.batches())
+        self.assertEqual([10, 10, 5], [len(batch) for batch in batches])
+        # Numeric columns are not copied, missing values are None
+        self.assertTrue(numpy.shares_memory(frame["id"].values, batches[1].columns[0]))
+        rows = list(batches[0])
+        self.assertEqual((0, 0.0, None), rows[0])
+        self.assertEqual((3, None, u"item-3"), rows[3])
+        self.assertEqual(int, type(rows[1][0]))
+
+        stream = brewery.streams.Stream()
+        stream.add(brewery.nodes.DataFrameSourceNode(frame, chunk_size=10), "source")
+        stream.add(brewery.nodes.SelectNode(condition="id % 2 == 0"), "select")
+        stream.add(brewery.nodes.DataFrameTargetNode(), "target")
+        stream.add(brewery.nodes.RowListTargetNode(), "rows")
+        stream.connect("source", "select")
+        stream.connect("select", "target")
+        stream.connect("source", "rows")
+        stream.run()
+
+        result = stream.node("target").dataframe
+        expected = frame[frame["id"] % 2 == 0].reset_index(drop=True)
+        self.assertEqual(["id", "amount", "name"], list(result.columns))
+        self.assertEqual("int64", str(result["id"].dtype))
+        self.assertEqual("float64", str(result["amount"].dtype))
+        self.assertTrue(result.equals(expected))
+
+        rows = stream.node("rows").rows
+        self.assertEqual(25, len(rows))
+        self.assertEqual((1, 0.5, u"item-1"), rows[1])
+
+    def test_arrow_parquet_source_target(self):
+        try:
+            import numpy
+            import pyarrow
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+
+        if not os.path.exists("test_out"):
+            os.makedirs("test_out")
+
+        fields = brewery.metadata.FieldList([("id", "integer"), ("amount", "float"),
+                                             ("name", "string"), ("day", "date"),
+                                             ("flag", "boolean")])
+        rows = [[i, i * 0.5 if i != 3 else None, u"item-%d" % i if i % 5 else None,
+                 datetime.date(2012, 1, 1 + i), i % 2 == 0] for i in range(25)]
+
+        for (target_class, source_class, name) in [
+                    (brewery.nodes.ArrowTargetNode, brewery.nodes.ArrowSourceNode, "rows.arrow"),
+                    (brewery.nodes.ParquetTargetNode, brewery.nodes.ParquetSourceNode,
+                     "rows.parquet")]:
+            path = os.path.join("test_out", name)
+
+            stream = brewery.streams.Stream()
+            stream.add(brewery.nodes.RowListSourceNode(rows, fields), "source")
+            stream.add(target_class(path, 10), "target")
+            stream.connect("source", "target")
+            stream.run()
+
+            source = source_class(path, batch_size=4)
+            source.initialize()
+            self.assertEqual(fields.names(), source.output_fields.names())
+            self.assertEqual(["integer", "float", "string", "date", "boolean"],
+                             [field.storage_type for field in source.output_fields])
+
+            batches = list(source.stream.batches())
+            source.finalize()
+            self.assertEqual([4, 4, 2] * 2 + [4, 1], [len(batch) for batch in batches])
+            self.assertTrue(isinstance(batches[0].columns[0], numpy.ndarray))
+            read = [list(row) for batch in batches for row in batch]
+            self.assertEqual(rows, read)
+            self.assertEqual(int, type(read[0][0]))
+
+            # Projection and limit are pushed into the source by the optimizer
+            stream = brewery.streams.Stream()
+            stream.add(source_class(path), "source")
+            stream.add(brewery.nodes.SampleNode(size=12), "sample")
+            stream.add(brewery.nodes.FieldMapNode(keep_fields=["name", "id"]), "map")
+            stream.add(brewery.nodes.RowListTargetNode(), "target")
+            stream.connect("source", "sample")
+            stream.connect("sample", "map")
+            stream.connect("map", "target")
+
+            plan = brewery.optimizer.optimize(stream)
+            attributes = plan.attributes[stream.node("source")]
+            self.assertEqual(["id", "name"], attributes["projection"])
+            self.assertEqual(12, attributes["limit"])
+
+            stream.run()
+            self.assertEqual(["id", "name"], stream.node("source").output_fields.names())
+            self.assertEqual([[row[0], row[2]] for row in rows[:12]],
+                             [list(row) for row in stream.node("target").rows])
+
@@ -0,0 +1,740 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import unittest
+import brewery
+from brewery.streams import *
+from brewery.nodes import *
+from brewery.expressions import expression_names
+from brewery.ds.sql_streams import sql_condition
+import brewery.nodes
+import brewery.optimizer
+from brewery.optimizer import aggressive_rules
+
+class FilterPushdownTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fields = brewery.FieldList([("id", "integer"), ("amount", "integer"),
+                                         ("str", "string")])
+        self.rows = [[i, i * 10, "str %d" % i] for i in range(10)]
+
+    def create_stream(self, condition="amount > 50"):
+        #  source -> derive -> select -> target
+        nodes = {
+            "source": RowListSourceNode(self.rows, self.fields),
+            "derive": DeriveNode("amount * 2", "double"),
+            "select": SelectNode(condition),
+            "target": RowListTargetNode()
+        }
+        connections = [("source", "derive"), ("derive", "select"), ("select", "target")]
+        return Stream(nodes, connections)
+
+    def test_expression_names(self):
+        self.assertEqual(set(["a", "b", "len"]), expression_names("a > 1 and len(b) < 2"))
+        self.assertEqual(None, expression_names("a >"))
+
+    def test_move_before_map(self):
+        stream = self.create_stream()
+        connections = set(stream.connections)
+
+        plan = brewery.optimizer.optimize(stream)
+        self.assertEqual(1, len(plan.rewrites))
+        self.assertIn("select 'select' moved before derive 'derive'", plan.rewrites[0])
+        self.assertEqual([stream.node("select")], plan.node_sources("derive"))
+        self.assertEqual(connections, stream.connections)
+
+        stream.run()
+        self.assertEqual(connections, stream.connections)
+
+        rows = stream.node("target").rows
+        self.assertEqual(4, len(rows))
+        self.assertEqual([6, 60, "str 6", 120], rows[0])
+
+        optimizations = stream.explain()["optimizations"]
+        self.assertEqual(plan.rewrites, optimizations)
+
+    def test_keep_before_producer(self):
+        stream = self.create_stream("double > 100")
+        plan = brewery.optimizer.optimize(stream)
+        self.assertEqual([], plan.rewrites)
+
+        stream.run()
+        self.assertEqual(4, len(stream.node("target").rows))
+
+    def test_keep_branches(self):
+        stream = self.create_stream()
+        stream.add(RowListTargetNode(), "derive_target")
+        stream.connect("derive", "derive_target")
+
+        plan = brewery.optimizer.optimize(stream)
+        self.assertEqual([], plan.rewrites)
+
+    def test_disabled(self):
+        stream = self.create_stream()
+        stream.optimize = False
+        self.assertEqual([], stream.explain()["optimizations"])
+
+    def test_move_before_merge(self):
+        details = [[i, "detail %d" % i] for i in range(10)]
+        nodes = {
+            "master": RowListSourceNode(self.rows, self.fields),
+            "detail": RowListSourceNode(details, brewery.FieldList(["code", "name"])),
+            "merge": brewery.nodes.MergeNode(),
+            "select": SetSelectNode("str", set(["str 1", "str 2"])),
+            "target": RowListTargetNode()
+        }
+        connections = [("master", "merge"), ("detail", "merge"), ("merge", "select"),
+                       ("select", "target")]
+
+        stream = Stream(nodes, connections)
+
+        # Inputs are ordered as the stream would connect them
+        order = brewery.optimizer.StreamPlan(stream).input_order[nodes["merge"]]
+        master = order.index(nodes["master"])
+        detail = order.index(nodes["detail"])
+        nodes["merge"].master = master
+        nodes["merge"].joins = [(detail, "id", "code")]
+        nodes["merge"].maps = {detail: {"keep": ["name"]}}
+
+        stream.optimize = False
+        stream.run()
+        expected = nodes["target"].rows
+
+        stream.optimize = True
+        plan = brewery.optimizer.optimize(stream)
+        self.assertEqual(1, len(plan.rewrites))
+        self.assertIn("onto master input", plan.rewrites[0])
+        self.assertEqual(nodes["select"], plan.input_order[nodes["merge"]][master])
+
+        stream.run()
+        self.assertEqual(2, len(expected))
+        self.assertEqual(expected, nodes["target"].rows)
+
+        # Filter reading detail field can not be moved
+        nodes["select"].field = "name"
+        self.assertEqual([], brewery.optimizer.optimize(stream).rewrites)
+
+        # Detail fields are not known
+        nodes["select"].field = "str"
+        nodes["merge"].maps = None
+        self.assertEqual([], brewery.optimizer.optimize(stream).rewrites)
+
+def create_test_table(name):
+    """Create sqlite database `name` in test_out with table ``data`` and return its URL."""
+    import sqlalchemy
+
+    if not os.path.exists("test_out"):
+        os.makedirs("test_out")
+    path = os.path.join("test_out", name)
+    if os.path.exists(path):
+        os.remove(path)
+
+    url = "sqlite:///" + path
+    engine = sqlalchemy.create_engine(url)
+    metadata = sqlalchemy.MetaData()
+    table = sqlalchemy.Table("data", metadata,
+                             sqlalchemy.Column("id", sqlalchemy.Integer),
+                             sqlalchemy.Column("amount", sqlalchemy.Integer),
+                             sqlalchemy.Column("str", sqlalchemy.Unicode))
+    metadata.create_all(engine)
+
+    rows = [{"id": i, "amount": i * 10 if i % 3 else None,
+             "str": u"str %d" % i if i % 4 else None} for i in range(10)]
+    engine.execute(table.insert(), rows)
+    engine.dispose()
+
+    return url
+
+class SQLPredicatePushdownTestCase(unittest.TestCase):
+    def setUp(self):
+        try:
+            import sqlalchemy
+        except ImportError:
+            self.skipTest("sqlalchemy is not installed")
+
+        self.url = create_test_table("pushdown.sqlite")
+
+    def create_stream(self, select):
+        nodes = {
+            "source": brewery.nodes.SQLSourceNode(url=self.url, table="data"),
+            "select": select,
+            "target": RowListTargetNode()
+        }
+        connections = [("source", "select"), ("select", "target")]
+        return Stream(nodes, connections)
+
+    def assertPushed(self, select, count=None):
+        stream = self.create_stream(select)
+        stream.optimize = False
+        stream.run()
+        expected = sorted(list(row) for row in stream.node("target").rows)
+
+        plan = brewery.optimizer.optimize(stream)
+        self.assertEqual(1, len(plan.rewrites))
+        self.assertIn("pushed into sql_source 'source'", plan.rewrites[0])
+        self.assertEqual([], stream.node("source").conditions)
+
+        stream.optimize = True
+        stream.run()
+        self.assertEqual(expected, sorted(list(row) for row in stream.node("target").rows))
+        self.assertIsNotNone(stream.node("source").stream.condition)
+        self.assertEqual([], stream.node("source").conditions)
+        if count is not None:
+            self.assertEqual(count, len(expected))
+
+    def test_comparison(self):
+        self.assertPushed(SelectNode("amount > 40"), 3)
+        self.assertPushed(SelectNode("40 < amount"), 3)
+        self.assertPushed(SelectNode("amount < 40"), 6)
+        self.assertPushed(SelectNode("amount <= 40"), 7)
+        self.assertPushed(SelectNode("amount != 40"), 9)
+        self.assertPushed(SelectNode("amount == None"), 4)
+        self.assertPushed(SelectNode("10 < amount < 60"), 3)
+
+    def test_boolean(self):
+        self.assertPushed(SelectNode("amount > 40 and str != None"), 2)
+        self.assertPushed(SelectNode("amount > 40 or str is None"), 5)
+
+    def test_in(self):
+        self.assertPushed(SelectNode("str in ('str 1', 'str 2')"), 2)
+        self.assertPushed(SelectNode("str in ['str 1', None]"), 4)
+        self.assertPushed(SelectNode("str not in ['str 1']"), 9)
+        self.assertPushed(SelectNode("str not in ['str 1', None]"), 6)
+
+    def test_set_select(self):
+        self.assertPushed(SetSelectNode("str", set([u"str 1", u"str 2"])), 2)
+        self.assertPushed(SetSelectNode("str", set([u"str 1"]), discard=True), 9)
+        self.assertPushed(SetSelectNode("amount", set([None])), 4)
+
+    def test_not_translated(self):
+        for condition in ["len(str) > 5", "not amount > 40", "amount > id", "amount",
+                          "amount + 1 > 40", "amount < None"]:
+            stream = self.create_stream(SelectNode(condition))
+            self.assertEqual([], brewery.optimizer.optimize(stream).rewrites)
+            self.assertEqual(None, sql_condition(condition))
+
+        stream = self.create_stream(SelectNode(lambda amount, **record: amount > 40))
+        self.assertEqual([], brewery.optimizer.optimize(stream).rewrites)
+
+    def test_unknown_column(self):
+        stream = self.create_stream(SelectNode("unknown > 40"))
+        self.assertRaises(ValueError, stream.run)
+        self.assertEqual([], stream.node("source").conditions)
+
+class ProjectionPushdownTestCase(unittest.TestCase):
+    def setUp(self):
+        if not os.path.exists("test_out"):
+            os.makedirs("test_out")
+        self.csv_path = os.path.join("test_out", "projection.csv")
+        with open(self.csv_path, "w") as f:
+            f.write("id,amount,str,extra\n")
+            for i in range(10):
+                f.write("%d,%d,str %d,extra %d\n" % (i, i * 10, i, i))
+
+    def run_both(self, stream):
+        """Run stream without and with optimization, return rows of target and the plan."""
+        stream.optimize = False
+        stream.run()
+        expected = [list(row) for row in stream.node("target").rows]
+
+        plan = brewery.optimizer.optimize(stream)
+
+        stream.optimize = True
+        stream.run()
+        self.assertEqual(expected, [list(row) for row in stream.node("target").rows])
+
+        return plan
+
+    def test_csv_keep(self):
+        nodes = {
+            "source": CSVSourceNode(self.csv_path),
+            "derive": DeriveNode("len(str)", "length"),
+            "map": FieldMapNode(keep_fields=["id", "length"]),
+            "target": RowListTargetNode()
+        }
+        connections = [("source", "derive"), ("derive", "map"), ("map", "target")]
+        stream = Stream(nodes, connections)
+
+        plan = self.run_both(stream)
+        self.assertEqual(["id", "len", "str"], plan.attributes[nodes["source"]]["projection"])
+        self.assertIn("csv_source 'source' reads only fields", plan.rewrites[0])
+        self.assertEqual(["id", "str"], nodes["source"].output_fields.names())
+        self.assertEqual(None, nodes["source"].projection)
+
+        rows = nodes["target"].rows
+        self.assertEqual([u"3", 5], rows[3])
+
+    def test_rename(self):
+        nodes = {
+            "source": CSVSourceNode(self.csv_path),
+            "map": FieldMapNode(map_fields={"str": "name"}),
+            "keep": FieldMapNode(keep_fields=["name"]),
+            "target": RowListTargetNode()
+        }
+        connections = [("source", "map"), ("map", "keep"), ("keep", "target")]
+        stream = Stream(nodes, connections)
+
+        plan = self.run_both(stream)
+        self.assertEqual(["str"], plan.attributes[nodes["source"]]["projection"])
+
+    def test_branches(self):
+        nodes = {
+            "source": CSVSourceNode(self.csv_path),
+            "map": FieldMapNode(keep_fields=["id"]),
+            "target": RowListTargetNode(),
+            "other": RowListTargetNode()
+        }
+        connections = [("source", "map"), ("map", "target"), ("source", "other")]
+        stream = Stream(nodes, connections)
+
+        self.assertEqual([], brewery.optimizer.optimize(stream).rewrites)
+
+        stream.remove("other")
+        stream.add(FieldMapNode(keep_fields=["amount"]), "other_map")
+        stream.add(RowListTargetNode(), "other")
+        stream.connect("source", "other_map")
+        stream.connect("other_map", "other")
+
+        plan = brewery.optimizer.optimize(stream)
+        self.assertEqual(["amount", "id"], plan.attributes[nodes["source"]]["projection"])
+
+        stream.record("source", "map", os.path.join("test_out", "projection.brw"))
+        self.assertEqual([], brewery.optimizer.optimize(stream).rewrites)
+
+    def test_sql_aggregate(self):
+        try:
+            import sqlalchemy
+        except ImportError:
+            self.skipTest("sqlalchemy is not installed")
+
+        url = create_test_table("projection.sqlite")
+        nodes = {
+            "source": brewery.nodes.SQLSourceNode(url=url, table="data"),
+            "derive": DeriveNode("id * 2", "double"),
+            "aggregate": AggregateNode(keys=["str"], measures=["double"]),
+            "target": RowListTargetNode()
+        }
+        connections = [("source", "derive"), ("derive", "aggregate"), ("aggregate", "target")]
+        stream = Stream(nodes, connections)
+
+        plan = self.run_both(stream)
+        self.assertEqual(["id", "str"], plan.attributes[nodes["source"]]["projection"])
+        self.assertEqual(["id", "str"], nodes["source"].output_fields.names())
+
+class DeadFieldEliminationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fields = brewery.FieldList([("id", "integer"), ("amount", "integer"),
+                                         ("str", "string")])
+        self.rows = [[i, i * 10, "str %d" % i] for i in range(10)]
+
+    def test_merge(self):
+        details = [[i, "detail %d" % i, "extra"] for i in range(10)]
+        nodes = {
+            "master": RowListSourceNode(self.rows, self.fields),
+            "detail": RowListSourceNode(details, brewery.FieldList(["code", "name", "extra"])),
+            "merge": brewery.nodes.MergeNode(),
+            "map": FieldMapNode(keep_fields=["amount", "name"]),
+            "target": RowListTargetNode()
+        }
+        connections = [("master", "merge"), ("detail", "merge"), ("merge", "map"),
+                       ("map", "target")]
+        stream = Stream(nodes, connections)
+
+        order = brewery.optimizer.StreamPlan(stream).input_order[nodes["merge"]]
+        master = order.index(nodes["master"])
+        detail = order.index(nodes["detail"])
+        nodes["merge"].master = master
+        nodes["merge"].joins = [(detail, "id", "code")]
+
+        stream.optimize = False
+        stream.run()
+        expected = nodes["target"].rows
+
+        plan = brewery.optimizer.optimize(stream)
+        self.assertEqual(2, len(plan.rewrites))
+        self.assertIn("keeping fields amount, code, id, name", plan.rewrites[0])
+
+        inputs = plan.input_order[nodes["merge"]]
+        self.assertIsInstance(inputs[master], FieldMapNode)
+        self.assertEqual([nodes["master"]], plan.node_sources(inputs[master]))
+
+        stream.optimize = True
+        stream.run()
+        self.assertEqual(10, len(expected))
+        self.assertEqual(expected, nodes["target"].rows)
+        self.assertEqual(["id", "amount", "code", "name"],
+                         nodes["merge"].output_fields.names())
+
+    def test_sample(self):
+        nodes = {
+            "source": RowListSourceNode(self.rows, self.fields),
+            "sample": SampleNode(100, method="random"),
+            "map": FieldMapNode(keep_fields=["id"]),
+            "target": RowListTargetNode()
+        }
+        connections = [("source", "sample"), ("sample", "map"), ("map", "target")]
+        stream = Stream(nodes, connections)
+
+        plan = brewery.optimizer.optimize(stream)
+        self.assertEqual(1, len(plan.rewrites))
+        self.assertIn("before sample 'sample' keeping fields id", plan.rewrites[0])
+
+        stream.run()
+        self.assertEqual([[i] for i in range(10)], sorted(nodes["target"].rows))
+
+        # Output is used as a whole
+        nodes["sample"].method = "first"
+        self.assertEqual([], brewery.optimizer.optimize(stream).rewrites)
+        nodes["sample"].method = "random"
+        stream.remove("map")
+        stream.connect("sample", "target")
+        self.assertEqual([], brewery.optimizer.optimize(stream).rewrites)
+
+class LimitPushdownTestCase(unittest.TestCase):
+    def setUp(self):
+        if not os.path.exists("test_out"):
+            os.makedirs("test_out")
+        self.csv_path = os.path.join("test_out", "limit.csv")
+        with open(self.csv_path, "w") as f:
+            f.write("id,amount\n")
+            for i in range(10):
+                f.write("%d,%d\n" % (i, i * 10))
+
+    def test_csv(self):
+        nodes = {
+            "source": CSVSourceNode(self.csv_path),
+            "derive": DeriveNode("int(id) + 1", "next"),
+            "sample": SampleNode(3),
+            "target": RowListTargetNode()
+        }
+        connections = [("source", "derive"), ("derive", "sample"), ("sample", "target")]
+        stream = Stream(nodes, connections)
+
+        plan = brewery.optimizer.optimize(stream)
+        self.assertEqual(["limit 3 of sample 'sample' pushed into csv_source 'source'"],
+                         plan.rewrites)
+
+        stream.run()
+        self.assertEqual(3, len(nodes["target"].rows))
+        self.assertEqual(None, nodes["source"].limit)
+
+    def test_not_pushed(self):
+        nodes = {
+            "source": CSVSourceNode(self.csv_path),
+            "select": SelectNode(lambda id, **record: id > "5"),
+            "sample": SampleNode(3),
+            "target": RowListTargetNode()
+        }
+        connections = [("source", "select"), ("select", "sample"), ("sample", "target")]
+        stream = Stream(nodes, connections)
+        self.assertEqual([], brewery.optimizer.optimize(stream).rewrites)
+
+        stream.remove("select")
+        stream.connect("source", "sample")
+        nodes["sample"].method = "random"
+        self.assertEqual([], brewery.optimizer.optimize(stream).rewrites)
+
+        nodes["sample"].method = "first"
+        stream.add(RowListTargetNode(), "other")
+        stream.connect("source", "other")
+        self.assertEqual([], brewery.optimizer.optimize(stream).rewrites)
+
+    def test_sql(self):
+        try:
+            import sqlalchemy
+        except ImportError:
+            self.skipTest("sqlalchemy is not installed")
+
+        url = create_test_table("limit.sqlite")
+        nodes = {
+            "source": brewery.nodes.SQLSourceNode(url=url, table="data"),
+            "select": SelectNode("id >= 5"),
+            "sample": SampleNode(2),
+            "target": RowListTargetNode()
+        }
+        connections = [("source", "select"), ("select", "sample"), ("sample", "target")]
+        stream = Stream(nodes, connections)
+
+        plan = brewery.optimizer.optimize(stream)
+        self.assertEqual(2, len(plan.rewrites))
+        self.assertIn("limit 2", plan.rewrites[1])
+
+        stream.run()
+        self.assertEqual(2, nodes["source"].stream.limit)
+        self.assertEqual([5, 6], sorted(row[0] for row in nodes["target"].rows))
+
+class SQLAggregationPushdownTestCase(unittest.TestCase):
+    def setUp(self):
+        try:
+            import sqlalchemy
+        except ImportError:
+            self.skipTest("sqlalchemy is not installed")
+
+        self.url = create_test_table("aggregation.sqlite")
+
+    def create_stream(self, condition="id > 0", keys=None, fmap=None):
+        nodes = {
+            "source": brewery.nodes.SQLSourceNode(url=self.url, table="data"),
+            "select": SelectNode(condition),
+            "map": fmap or FieldMapNode(map_fields={"id": "ident"}),
+            "aggregate": AggregateNode(keys=keys, measures=["ident"]),
+            "target": RowListTargetNode()
+        }
+        connections = [("source", "select"), ("select", "map"), ("map", "aggregate"),
+                       ("aggregate", "target")]
+        return Stream(nodes, connections)
+
+    def assertSameResult(self, stream):
+        stream.optimize = False
+        stream.run()
+        expected = sorted(list(row) for row in stream.node("target").rows)
+        fields = stream.node("aggregate").output_fields.names()
+
+        stream.optimize = "aggressive"
+        stream.run()
+        self.assertEqual(expected, sorted(list(row) for row in stream.node("target").rows))
+        self.assertEqual(fields, stream.node("source").output_fields.names())
+
+        return expected
+
+    def test_group_by(self):
+        stream = self.create_stream(keys=["str"])
+
+        for rewrite in brewery.optimizer.optimize(stream).rewrites:
+            self.assertNotIn("GROUP BY", rewrite)
+
+        plan = brewery.optimizer.optimize(stream, aggressive_rules)
+        self.assertEqual(2, len(plan.rewrites))
+        self.assertIn("aggregate 'aggregate' pushed into sql_source 'source' as GROUP BY",
+                      plan.rewrites[1])
+        self.assertEqual([plan.node("source")], plan.node_sources("target"))
+
+        rows = self.assertSameResult(stream)
+        self.assertEqual(8, len(rows))
+        self.assertEqual([None, 12, 4, 8, 6.0, 2], rows[0])
+
+    def test_no_keys(self):
+        stream = self.create_stream()
+        rows = self.assertSameResult(stream)
+        self.assertEqual([[45, 1, 9, 5.0, 9]], rows)
+
+        stream = self.create_stream("id > 100")
+        self.assertEqual([], self.assertSameResult(stream))
+
+    def test_not_pushed(self):
+        stream = self.create_stream(fmap=FieldMapNode(map_fields={"id": "ident"},
+                                                      drop_fields=["id"]))
+        rewrites = brewery.optimizer.optimize(stream, aggressive_rules).rewrites
+        self.assertEqual(1, len(rewrites))
+        self.assertIn("SQL condition", rewrites[0])
+
+        stream = self.create_stream(condition="len(str) > 0")
+        for rewrite in brewery.optimizer.optimize(stream, aggressive_rules).rewrites:
+            self.assertNotIn("GROUP BY", rewrite)
+
+class SQLInsertSelectTestCase(unittest.TestCase):
+    def setUp(self):
+        try:
+            import sqlalchemy
+        except ImportError:
+            self.skipTest("sqlalchemy is not installed")
+
+        self.url = create_test_table("insert_select.sqlite")
+
+    def create_stream(self, node, target_url=None):
+        nodes = {
+            "source": brewery.nodes.SQLSourceNode(url=self.url, table="data"),
+            "select": SelectNode("id > 4"),
+            "node": node,
+            "target": SQLTableTargetNode(url=target_url or self.url, table="copy",
+                                         create=True, replace=True)
+        }
+        connections = [("source", "select"), ("select", "node"), ("node", "target")]
+        return Stream(nodes, connections)
+
+    def read_copy(self, url=None):
+        source = brewery.ds.SQLDataSource(url=url or self.url, table="copy")
+        rows = sorted(list(row) for row in source.rows())
+        fields = source.fields.names()
+        source.finalize()
+        return (fields, rows)
+
+    def assertSameCopy(self, stream, url=None, optimize=True):
+        stream.optimize = False
+        stream.run()
+        expected = self.read_copy(url)
+
+        stream.optimize = optimize
+        stream.run()
+        self.assertEqual(expected, self.read_copy(url))
+
+        return expected
+
+    def test_field_map(self):
+        stream = self.create_stream(FieldMapNode(map_fields={"str": "text"},
+                                                 drop_fields=["amount"]))
+        plan = brewery.optimizer.optimize(stream)
+        self.assertEqual(2, len(plan.rewrites))
+        self.assertEqual("sql_source 'source' copied into sql_table_target 'target' with "
+                         "INSERT ... SELECT", plan.rewrites[1])
+        self.assertEqual(["target"], plan.nodes.keys())
+
+        (fields, rows) = self.assertSameCopy(stream)
+        self.assertEqual(["id", "text"], fields)
+        self.assertEqual([[5, u"str 5"], [6, u"str 6"], [7, u"str 7"], [8, None],
+                          [9, u"str 9"]], rows)
+
+    def test_aggregate(self):
+        stream = self.create_stream(AggregateNode(keys=["str"], measures=["id"]))
+        rewrites = brewery.optimizer.optimize(stream).rewrites
+        self.assertNotIn("INSERT ... SELECT", rewrites[-1])
+
+        rewrites = brewery.optimizer.optimize(stream, aggressive_rules).rewrites
+        self.assertIn("INSERT ... SELECT", rewrites[-1])
+
+        (fields, rows) = self.assertSameCopy(stream, optimize="aggressive")
+        self.assertEqual(["str", "id_sum", "id_min", "id_max", "id_average", "record_count"],
+                         fields)
+        self.assertEqual(5, len(rows))
+
+    def test_not_pushed(self):
+        stream = self.create_stream(FunctionSelectNode(lambda id: id % 2, ["id"]))
+        for rewrite in brewery.optimizer.optimize(stream).rewrites:
+            self.assertNotIn("INSERT", rewrite)
+        self.assertSameCopy(stream)
+
+        url = "sqlite:///" + os.path.join("test_out", "insert_select_other.sqlite")
+        stream = self.create_stream(FieldMapNode(drop_fields=["amount"]), url)
+        for rewrite in brewery.optimizer.optimize(stream).rewrites:
+            self.assertNotIn("INSERT", rewrite)
+        self.assertSameCopy(stream, url)
+
+class SharedScanTestCase(unittest.TestCase):
+    def setUp(self):
+        if not os.path.exists("test_out"):
+            os.makedirs("test_out")
+        self.csv_path = os.path.join("test_out", "shared.csv")
+        with open(self.csv_path, "w") as f:
+            f.write("id,amount,str\n")
+            for i in range(10):
+                f.write("%d,%d,str %d\n" % (i, i * 10, i))
+
+    def create_stream(self, source1, source2, node1=None, node2=None):
+        #  source1 -> node1 -> target1
+        #  source2 -> node2 -> target2
+        nodes = {
+            "source1": source1,
+            "source2": source2,
+            "node1": node1 or FieldMapNode(keep_fields=["id", "str"]),
+            "node2": node2 or DeriveNode("int(amount) * 2", "double"),
+            "target1": RowListTargetNode(),
+            "target2": RowListTargetNode()
+        }
+        connections = [("source1", "node1"), ("node1", "target1"),
+                       ("source2", "node2"), ("node2", "target2")]
+        return Stream(nodes, connections)
+
+    def run_both(self, stream):
+        """Run stream without and with optimization, return the plan."""
+        stream.optimize = False
+        stream.run()
+        expected = [[list(row) for row in stream.node(name).rows]
+                    for name in ("target1", "target2")]
+
+        plan = brewery.optimizer.optimize(stream)
+
+        stream.optimize = True
+        stream.run()
+        result = [[list(row) for row in stream.node(name).rows]
+                  for name in ("target1", "target2")]
+        self.assertEqual(expected, result)
+
+        return plan
+
+    def test_csv(self):
+        stream = self.create_stream(CSVSourceNode(self.csv_path), CSVSourceNode(self.csv_path))
+        plan = self.run_both(stream)
+
+        self.assertEqual(1, len(plan.rewrites))
+        self.assertRegexpMatches(plan.rewrites[0], "csv_source 'source(1|2)' merged into "
+                                                   "csv_source 'source(1|2)' as shared scan")
+        self.assertEqual(5, len(plan.nodes))
+
+        source = plan.node_sources("node1")[0]
+        self.assertEqual([source], plan.node_sources("node2"))
+        self.assertEqual(10, len(stream.node("target2").rows))
+
+    def test_different_settings(self):
+        stream = self.create_stream(CSVSourceNode(self.csv_path),
+                                    CSVSourceNode(self.csv_path, empty_as_null=True))
+        for rewrite in self.run_both(stream).rewrites:
+            self.assertNotIn("shared scan", rewrite)
+
+        source = CSVSourceNode(self.csv_path)
+        source.retype("id", storage_type="integer")
+        stream = self.create_stream(CSVSourceNode(self.csv_path), source)
+        for rewrite in self.run_both(stream).rewrites:
+            self.assertNotIn("shared scan", rewrite)
+
+    def test_same_target(self):
+        nodes = {
+            "source1": CSVSourceNode(self.csv_path),
+            "source2": CSVSourceNode(self.csv_path),
+            "merge": brewery.nodes.MergeNode(joins=[(1, "id", "id")], master=0),
+            "target": RowListTargetNode()
+        }
+        connections = [("source1", "merge"), ("source2", "merge"), ("merge", "target")]
+        stream = Stream(nodes, connections)
+
+        for rewrite in brewery.optimizer.optimize(stream).rewrites:
+            self.assertNotIn("shared scan", rewrite)
+
+    def test_meeting_branches(self):
+        path = os.path.join("test_out", "shared_merge.csv")
+        with open(path, "w") as f:
+            f.write("id,amount,str\n")
+            for i in range(5000):
+                f.write("%d,%d,str %d\n" % (i, i * 10, i))
+
+        #  source1 ------------> merge -> target
+        #  source2 -> detail --/
+        nodes = {
+            "source1": CSVSourceNode(path),
+            "source2": CSVSourceNode(path),
+            "detail": FieldMapNode(map_fields={"id": "i", "str": "detail_str"},
+                                   keep_fields=["id", "str"]),
+            "merge": brewery.nodes.MergeNode(joins=[(1, "id", "i")], master=0),
+            "target": RowListTargetNode()
+        }
+        connections = [("source1", "merge"), ("source2", "detail"), ("detail", "merge"),
+                       ("merge", "target")]
+        stream = Stream(nodes, connections)
+
+        for rewrite in brewery.optimizer.optimize(stream).rewrites:
+            self.assertNotIn("shared scan", rewrite)
+
+        stream.stall_timeout = 5
+        stream.abort_on_stall = True
+        stream.run()
+        self.assertEqual(5000, len(stream.node("target").rows))
+
+    def test_sql(self):
+        try:
+            import sqlalchemy
+        except ImportError:
+            self.skipTest("sqlalchemy is not installed")
+
+        url = create_test_table("shared.sqlite")
+
+        stream = self.create_stream(brewery.nodes.SQLSourceNode(url=url, table="data"),
+                                    brewery.nodes.SQLSourceNode(url=url, table="data"),
+                                    SelectNode("id > 4"), SelectNode("id > 4"))
+        rewrites = self.run_both(stream).rewrites
+        self.assertEqual(3, len(rewrites))
+        self.assertIn("shared scan", rewrites[2])
+        self.assertEqual(5, len(stream.node("target2").rows))
+
+        stream = self.create_stream(brewery.nodes.SQLSourceNode(url=url, table="data"),
+                                    brewery.nodes.SQLSourceNode(url=url, table="data"),
+                                    SelectNode("id > 4"), SelectNode("id > 5"))
+        for rewrite in self.run_both(stream).rewrites:
+            self.assertNotIn("shared scan", rewrite)
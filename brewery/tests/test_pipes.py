@@ -4,7 +4,9 @@
 import unittest
 import threading
 import time
+import brewery
 import brewery.streams as streams
+from brewery.batches import RecordBatch
 
 class PipeTestCase(unittest.TestCase):
     def setUp(self):
@@ -158,3 +160,70 @@ class Pipe2TestCase(unittest.TestCase):
         producer.join()
         consumer.join()
         self.assertEqual(5, self.consumed_count)
+
+class RecordBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fields = brewery.FieldList(["i", "str"])
+        self.rows = [(i, "s%d" % i) for i in range(5)]
+
+    def test_batch(self):
+        batch = RecordBatch.from_rows(self.fields, self.rows)
+        self.assertEqual(5, len(batch))
+        self.assertEqual(self.rows, list(batch))
+        self.assertEqual((0, 1, 2, 3, 4), batch.column("i"))
+
+        selected = batch.filter([value % 2 for value in batch.column("i")])
+        self.assertEqual([(1, "s1"), (3, "s3")], selected.rows())
+        self.assertIs(batch.columns[0], selected.columns[0])
+        self.assertEqual([(3, "s3")], selected.select([1]).rows())
+        self.assertEqual(None, selected.compact().selection)
+
+        replaced = selected.replace_columns({1: ["a", "b"]})
+        self.assertEqual([(1, "a"), (3, "b")], replaced.rows())
+        added = selected.add_column(brewery.Field("x"), [10, 30])
+        self.assertEqual(["i", "str", "x"], added.fields.names())
+        self.assertEqual([(1, "s1", 10), (3, "s3", 30)], added.rows())
+
+        empty = RecordBatch.from_rows(self.fields, [])
+        self.assertEqual([], empty.rows())
+
+    def test_pipe(self):
+        pipe = streams.Pipe(buffer_size = 3)
+        pipe.fields = self.fields
+
+        def produce():
+            pipe.put(self.rows[0])
+            pipe.put_batch(RecordBatch.from_rows(self.fields, self.rows[1:4]))
+            pipe.put(self.rows[4])
+            pipe.done_sending()
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        batches = list(pipe.batches())
+        producer.join()
+
+        self.assertEqual([1, 3, 1], [len(batch) for batch in batches])
+        self.assertEqual(self.rows, [tuple(row) for batch in batches for row in batch])
+
+        pipe = streams.Pipe(buffer_size = 3)
+        producer = threading.Thread(target=produce)
+        producer.start()
+        rows = list(pipe.rows())
+        producer.join()
+        self.assertEqual(self.rows, rows)
+
+    def test_row_type(self):
+        pipe = streams.Pipe(buffer_size = 10)
+        row_type = self.fields.row_type()
+        pipe.set_row_type(row_type)
+        for row in self.rows:
+            pipe.put(list(row))
+        pipe.done_sending()
+
+        rows = list(pipe.rows())
+        self.assertEqual(self.rows, rows)
+        self.assertEqual([row_type], list(set(type(row) for row in rows)))
+
+        pipe.set_row_type(None)
+        pipe.put([1, 2])
+        self.assertEqual([[1, 2]], pipe.staging_buffer)
@@ -1,9 +1,13 @@
 
+import os
 import unittest
 import threading
 import time
 from brewery import ds
+from brewery.cache import MetadataCache
 import brewery.metadata
+import brewery.nodes
+import brewery.streams
 
 from sqlalchemy import Table, Column, Integer, String, Text
 from sqlalchemy import create_engine, MetaData
@@ -92,4 +96,95 @@ class SQLStreamsTestCase(unittest.TestCase):
 
         c = stream.table.c["line_item"]
 
-        self.assertEqual(123, c.type.length)
\ No newline at end of file
+        self.assertEqual(123, c.type.length)
+class SQLMetadataCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        if not os.path.exists("test_out"):
+            os.makedirs("test_out")
+        path = os.path.join("test_out", "metadata_cache.sqlite")
+        if os.path.exists(path):
+            os.remove(path)
+        self.url = "sqlite:///" + path
+
+        self.engine = create_engine(self.url)
+        metadata = MetaData()
+        table = Table("data", metadata, Column("id", Integer), Column("name", String))
+        metadata.create_all(self.engine)
+        self.engine.execute(table.insert(), [{"id": 1, "name": "one"}])
+
+        self.cache_path = os.path.join("test_out", "metadata_cache")
+        self.cache = MetadataCache(self.cache_path)
+        self.cache.clear()
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_cache(self):
+        self.assertEqual(None, self.cache.get(("key", 1), "a"))
+        self.cache.set(("key", 1), "a", {"value": 10})
+        self.assertEqual({"value": 10}, self.cache.get(("key", 1), "a"))
+
+        # Stale entry is removed
+        self.assertEqual(None, self.cache.get(("key", 1), "b"))
+        self.assertEqual([], os.listdir(self.cache_path))
+
+    def test_reflected_table(self):
+        source = ds.SQLDataSource(url=self.url, table="data", metadata_cache=self.cache)
+        self.assertEqual(["id", "name"], source.fields.names())
+        source.finalize()
+        self.assertEqual(1, len(os.listdir(self.cache_path)))
+
+        # Replace the cached table to see that it is used instead of reflection
+        key = ("sql_table", self.url, None, "data")
+        fingerprint = ds.sql_streams.table_fingerprint(self.engine.connect(), "data")
+        metadata = MetaData()
+        Table("data", metadata, Column("id", Integer))
+        self.cache.set(key, fingerprint, metadata)
+
+        source = ds.SQLDataSource(url=self.url, table="data", metadata_cache=self.cache)
+        self.assertEqual(["id"], source.fields.names())
+        self.assertEqual([[1]], [list(row) for row in source.rows()])
+        source.finalize()
+
+        # Changed table is reflected again
+        self.engine.execute("ALTER TABLE data ADD COLUMN amount INTEGER")
+        source = ds.SQLDataSource(url=self.url, table="data", metadata_cache=self.cache)
+        self.assertEqual(["id", "name", "amount"], source.fields.names())
+        source.finalize()
+
+    def test_stream(self):
+        node = brewery.nodes.SQLSourceNode(url=self.url, table="data")
+        target = brewery.nodes.RowListTargetNode()
+        stream = brewery.streams.Stream({"source": node, "target": target},
+                                        [("source", "target")])
+        stream.metadata_cache = self.cache_path
+        stream.run()
+
+        # Reflected table and resolved fields of the source
+        self.assertEqual(2, len(os.listdir(self.cache_path)))
+        self.assertEqual([[1, u"one"]], [list(row) for row in target.rows])
+        self.assertEqual(None, node.metadata_cache)
+
+        stream.run()
+        self.assertEqual([[1, u"one"]], [list(row) for row in target.rows])
+
+    def test_explain(self):
+        node = brewery.nodes.SQLSourceNode(url=self.url, table="data")
+        target = brewery.nodes.RowListTargetNode()
+        stream = brewery.streams.Stream({"source": node, "target": target},
+                                        [("source", "target")])
+        stream.metadata_cache = self.cache_path
+        stream.run()
+
+        # Source is not initialized, fields are taken from the cache
+        def initialize():
+            raise Exception("source is initialized")
+        node.initialize = initialize
+        explanation = stream.explain()
+        self.assertEqual(["id", "name"],
+                         [name for (name, storage_type) in explanation["nodes"][0]["fields"]])
+
+        # Changed table is described again
+        self.engine.execute("ALTER TABLE data ADD COLUMN amount INTEGER")
+        explanation = stream.explain()
+        self.assertTrue("source is initialized" in explanation["nodes"][0]["error"])